@@ -0,0 +1,121 @@
+import os
+import mmap
+import time
+import shutil
+import struct
+import plyvel
+import data_main
+from benchmark_space.synthetic_chain import generate_chain
+from file_parsing.blk_parser import block_parsing, read_compactsize
+from file_parsing.rev_parser import block_undo
+from file_parsing.index_parser import block_index, format_hash
+from utils.utils import address_cache
+
+dir_fixture = './result/benchmark/' # Directory where the synthetic blk*.dat, rev*.dat and block index are generated (and blocks are extracted)
+
+GENERATE = True  # Flag to determine whether the synthetic chain should be generated again (otherwise the one in dir_fixture is used)
+BENCHMARKS = ['block_parsing', 'block_undo', 'block_index', 'data_main']  # Benchmarks to run
+num_blocks = 200  # used only by GENERATE: number of blocks of the synthetic chain
+txs_per_block = 500  # used only by GENERATE: number of transactions of each block (coinbase excluded)
+blocks_per_file = 50  # used only by GENERATE: number of blocks stored in each blk/rev file pair
+seed = 0  # used only by GENERATE: seed of the random generator, the same seed always produces the same chain
+
+def dir_blocks():
+    return os.path.join(dir_fixture, 'chain', 'blocks')
+
+def load_fixture():
+    # block = (height, file, data_pos, undo_pos, tx_count, block size, undo size), read back from the block index and the files
+    blocks = []
+    with plyvel.DB(os.path.join(dir_blocks(), 'index'), compression=None) as db:
+        for key, value in db.iterator(prefix=b'b'):
+            height, file, data_pos, undo_pos = block_index(format_hash(key[1:]), value)
+            blocks.append([height, file, data_pos, undo_pos])
+    blocks.sort()
+
+    for block in blocks:
+        with open(os.path.join(dir_blocks(), f'blk{block[1]:05d}.dat'), 'rb') as blk_f, open(os.path.join(dir_blocks(), f'rev{block[1]:05d}.dat'), 'rb') as rev_f:
+            # the size of each block (and of its undo data) is stored right before it
+            blk_f.seek(block[2] - 4)
+            block_size = struct.unpack('<I', blk_f.read(4))[0]
+            rev_f.seek(block[3] - 4)
+            undo_size = struct.unpack('<I', rev_f.read(4))[0]
+            # the transaction count follows the 80 bytes of the header
+            blk_f.seek(block[2] + 80)
+            tx_count, _ = read_compactsize(blk_f.read(9), 0)
+        block.extend((tx_count, block_size, undo_size))
+
+    return [tuple(block) for block in blocks]
+
+def report(name, elapsed, num_blocks, num_transactions, num_bytes):
+    print(f'{name:<15} {elapsed:8.2f} s {num_blocks / elapsed:10.1f} blocks/s {num_transactions / elapsed:12.1f} tx/s {num_bytes / elapsed / 2**20:8.2f} MB/s')
+
+def benchmark_block_parsing(blocks):
+    address_cache.clear()
+    start_time = time.time()
+    for block in blocks:
+        block_parsing(os.path.join(dir_blocks(), f'blk{block[1]:05d}.dat'), block[2] - 8)
+    report('block_parsing', time.time() - start_time, len(blocks), sum(block[4] for block in blocks), sum(block[5] for block in blocks))
+
+def benchmark_block_undo(blocks):
+    start_time = time.time()
+    # each rev file is mapped only once, as data_main.py does
+    for file in sorted(set(block[1] for block in blocks)):
+        with open(os.path.join(dir_blocks(), f'rev{file:05d}.dat'), 'rb') as rev_f, mmap.mmap(rev_f.fileno(), 0, prot=mmap.PROT_READ) as rev_data:
+            for block in blocks:
+                if block[1] == file:
+                    block_undo(rev_data, block[3])
+    report('block_undo', time.time() - start_time, len(blocks), sum(block[4] for block in blocks), sum(block[6] for block in blocks))
+
+def benchmark_block_index(blocks):
+    start_time = time.time()
+    num_bytes = 0
+    with plyvel.DB(os.path.join(dir_blocks(), 'index'), compression=None) as db:
+        for key, value in db.iterator(prefix=b'b'):
+            block_index(format_hash(key[1:]), value)
+            num_bytes += len(key) + len(value)
+    report('block_index', time.time() - start_time, len(blocks), sum(block[4] for block in blocks), num_bytes)
+
+def benchmark_data_main(blocks):
+    # the whole extraction (block index, parsing, undo merging, writing) of all the blocks into a new directory
+    dir_results = os.path.join(dir_fixture, 'blocks')
+    shutil.rmtree(dir_results, ignore_errors=True)
+    block_index_cache = os.path.join(dir_fixture, 'block_index.npy')
+    if os.path.exists(block_index_cache):
+        os.remove(block_index_cache)
+    address_table_file = os.path.join(dir_fixture, 'addresses.txt')
+    if os.path.exists(address_table_file):
+        os.remove(address_table_file)
+
+    data_main.dir_blocks = dir_blocks()
+    data_main.dir_indexes = os.path.join(dir_blocks(), 'index')
+    data_main.dir_results_blocks = dir_results
+    data_main.block_index_cache = block_index_cache
+    data_main.address_table_file = address_table_file
+    data_main.start_block = blocks[0][0]
+    data_main.end_block = blocks[-1][0]
+
+    # the worker processes would otherwise inherit the addresses cached by benchmark_block_parsing
+    address_cache.clear()
+    start_time = time.time()
+    data_main.main()
+    report('data_main', time.time() - start_time, len(blocks), sum(block[4] for block in blocks), sum(block[5] + block[6] for block in blocks))
+
+def main():
+    if GENERATE:
+        shutil.rmtree(os.path.join(dir_fixture, 'chain'), ignore_errors=True)
+        generate_chain(os.path.join(dir_fixture, 'chain'), num_blocks, txs_per_block, blocks_per_file, seed=seed)
+
+    blocks = load_fixture()
+    print(f'{len(blocks)} blocks, {sum(block[4] for block in blocks)} transactions, {sum(block[5] for block in blocks) / 2**20:.2f} MB of blocks, {sum(block[6] for block in blocks) / 2**20:.2f} MB of undo data')
+
+    benchmarks = {
+        'block_parsing': benchmark_block_parsing,
+        'block_undo': benchmark_block_undo,
+        'block_index': benchmark_block_index,
+        'data_main': benchmark_data_main,
+    }
+    for name in BENCHMARKS:
+        benchmarks[name](blocks)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,356 @@
+import os
+import random
+import struct
+import hashlib
+import plyvel
+
+# Constant separating blocks in the .blk and .rev files
+BITCOIN_CONSTANT = b"\xf9\xbe\xb4\xd9"
+COINBASE_REWARD = 312500000 # expressed in satoshis
+
+BLOCK_VALID_SCRIPTS = 5
+BLOCK_HAVE_DATA = 8
+BLOCK_HAVE_UNDO = 16
+CLIENT_VERSION = 270000
+
+# secp256k1 field prime and generator, used only for the P2PK coins of the chainstate
+SECP256K1_P = 2**256 - 2**32 - 977
+SECP256K1_G = (0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798, 0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8)
+
+OUTPUT_TYPES = ['P2PKH', 'P2SH', 'P2WPKH', 'P2WSH', 'P2TR', 'MULTISIG', 'OP_RETURN']
+
+# -------------------------------------------------------
+# Serialization helpers
+# -------------------------------------------------------
+
+def sha256d(data):
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+def hash160(data):
+    h = hashlib.new('ripemd160')
+    h.update(hashlib.sha256(data).digest())
+    return h.digest()
+
+def compactsize(n):
+    if n < 253:
+        return bytes([n])
+    if n <= 0xffff:
+        return b'\xfd' + struct.pack('<H', n)
+    if n <= 0xffffffff:
+        return b'\xfe' + struct.pack('<I', n)
+    return b'\xff' + struct.pack('<Q', n)
+
+def push(data):
+    # only pushes shorter than OP_PUSHDATA1 are needed
+    return bytes([len(data)]) + data
+
+def core_varint(n):
+    """VARINT format of src/serialize.h of bitcoin core (used by the block index and the undo files)."""
+    tmp = []
+    while True:
+        tmp.append((n & 0x7f) | (0x80 if tmp else 0x00))
+        if n <= 0x7f:
+            break
+        n = (n >> 7) - 1
+    return bytes(reversed(tmp))
+
+def compress_amount(n):
+    if n == 0:
+        return 0
+    e = 0
+    while n % 10 == 0 and e < 9:
+        n //= 10
+        e += 1
+    if e < 9:
+        d = n % 10
+        n //= 10
+        return 1 + (n * 9 + d - 1) * 10 + e
+    return 1 + (n - 1) * 10 + 9
+
+def compress_script(script):
+    if len(script) == 35 and script[0] == 0x21 and script[-1] == 0xac and script[1] in (2, 3):
+        return script[1:34]
+    if len(script) == 67 and script[0] == 0x41 and script[-1] == 0xac and script[1] == 4:
+        return bytes([4 + (script[-2] & 1)]) + script[2:34]
+    if len(script) == 25 and script[:3] == b'\x76\xa9\x14' and script[-2:] == b'\x88\xac':
+        return b'\x00' + script[3:23]
+    if len(script) == 23 and script[:2] == b'\xa9\x14' and script[-1:] == b'\x87':
+        return b'\x01' + script[2:22]
+    return core_varint(len(script) + 6) + script
+
+# -------------------------------------------------------
+# Scripts
+# -------------------------------------------------------
+
+def _point_add(a, b):
+    # addition of two points of secp256k1 (None is the point at infinity)
+    if a is None:
+        return b
+    if a == b:
+        slope = 3 * a[0] * a[0] * pow(2 * a[1], -1, SECP256K1_P) % SECP256K1_P
+    else:
+        slope = (b[1] - a[1]) * pow(b[0] - a[0], -1, SECP256K1_P) % SECP256K1_P
+    x = (slope * slope - a[0] - b[0]) % SECP256K1_P
+    return x, (slope * (a[0] - x) - a[1]) % SECP256K1_P
+
+def valid_pubkey(rng):
+    """Returns the coordinates of a point of the curve, so that compressed keys can be decompressed (random_pubkey is enough elsewhere)."""
+    point, base, k = None, SECP256K1_G, rng.getrandbits(64) | 1
+    while k:
+        if k & 1:
+            point = _point_add(point, base)
+        base = _point_add(base, base)
+        k >>= 1
+    return point
+
+def p2pk_script(rng, uncompressed):
+    x, y = valid_pubkey(rng)
+    if uncompressed:
+        return b'\x41\x04' + x.to_bytes(32, 'big') + y.to_bytes(32, 'big') + b'\xac'
+    return b'\x21' + bytes([2 + (y & 1)]) + x.to_bytes(32, 'big') + b'\xac'
+
+def random_pubkey(rng):
+    return bytes([rng.choice((2, 3))]) + rng.randbytes(32)
+
+def signature(rng, length=72):
+    # DER-looking blob, the parsers only look at its length
+    return b'\x30' + rng.randbytes(length - 2) + b'\x01'
+
+def output_script(rng, output_type):
+    """Returns (script, key material needed to spend it)."""
+    if output_type == 'P2PKH':
+        pubkey = random_pubkey(rng)
+        return b'\x76\xa9\x14' + hash160(pubkey) + b'\x88\xac', pubkey
+    if output_type == 'P2SH':
+        # P2SH-P2WPKH
+        pubkey = random_pubkey(rng)
+        redeem_script = b'\x00\x14' + hash160(pubkey)
+        return b'\xa9\x14' + hash160(redeem_script) + b'\x87', pubkey
+    if output_type == 'P2WPKH':
+        pubkey = random_pubkey(rng)
+        return b'\x00\x14' + hash160(pubkey), pubkey
+    if output_type == 'P2WSH':
+        witness_script = push(random_pubkey(rng)) + b'\xac'
+        return b'\x00\x20' + hashlib.sha256(witness_script).digest(), witness_script
+    if output_type == 'P2TR':
+        return b'\x51\x20' + rng.randbytes(32), None
+    if output_type == 'MULTISIG':
+        return b'\x51' + push(random_pubkey(rng)) + push(random_pubkey(rng)) + b'\x52\xae', None
+    # OP_RETURN
+    return b'\x6a' + push(rng.randbytes(rng.randint(4, 40))), None
+
+def spending_data(rng, utxo):
+    """Returns (scriptSig, witness items) spending the given output."""
+    output_type, key = utxo['type'], utxo['key']
+    if output_type == 'P2PKH':
+        return push(signature(rng, rng.choice((71, 72)))) + push(key), []
+    if output_type == 'P2SH':
+        return push(b'\x00\x14' + hash160(key)), [signature(rng, 72), key]
+    if output_type == 'P2WPKH':
+        # sometimes the signature is shorter, so the address must come from the undo data
+        return b'', [signature(rng, rng.choice((71, 72, 72, 72))), key]
+    if output_type == 'P2WSH':
+        return b'', [signature(rng, 72), key]
+    if output_type == 'P2TR':
+        return b'', [rng.randbytes(64)]
+    # bare multisig
+    return b'\x00' + push(signature(rng, 72)), []
+
+# -------------------------------------------------------
+# Transactions and blocks
+# -------------------------------------------------------
+
+def serialize_transaction(inputs, outputs, witnesses, version=2, locktime=0):
+    """Returns (serialized transaction, txid)."""
+    body_inputs = compactsize(len(inputs)) + b''.join(
+        prev_hash + struct.pack('<I', prev_index) + compactsize(len(script_sig)) + script_sig + struct.pack('<I', sequence)
+        for prev_hash, prev_index, script_sig, sequence in inputs)
+    body_outputs = compactsize(len(outputs)) + b''.join(
+        struct.pack('<Q', value) + compactsize(len(script)) + script for value, script in outputs)
+
+    stripped = struct.pack('<I', version) + body_inputs + body_outputs + struct.pack('<I', locktime)
+    txid = sha256d(stripped)
+
+    if any(witnesses):
+        witness_data = b''.join(compactsize(len(items)) + b''.join(compactsize(len(item)) + item for item in items) for items in witnesses)
+        raw = struct.pack('<I', version) + b'\x00\x01' + body_inputs + body_outputs + witness_data + struct.pack('<I', locktime)
+    else:
+        raw = stripped
+
+    return raw, txid
+
+def new_outputs(rng, total, utxos_out, height, txid_index, is_coinbase, max_outputs=4):
+    """Splits total among a random number of outputs of random types."""
+    num_outputs = rng.randint(1, max_outputs)
+    cuts = sorted(rng.randint(0, total) for _ in range(num_outputs - 1))
+    values = [b - a for a, b in zip([0] + cuts, cuts + [total])]
+
+    outputs = []
+    for value in values:
+        output_type = rng.choice(OUTPUT_TYPES)
+        if output_type == 'OP_RETURN':
+            # the value of OP_RETURN outputs is lost, move it to a spendable output
+            output_type = 'P2WPKH'
+        script, key = output_script(rng, output_type)
+        outputs.append((value, script, output_type, key))
+
+    # OP_RETURN outputs with no value are mixed in
+    if rng.random() < 0.2:
+        script, key = output_script(rng, 'OP_RETURN')
+        outputs.insert(rng.randint(0, len(outputs)), (0, script, 'OP_RETURN', key))
+
+    return outputs
+
+def build_block(rng, height, prev_hash, utxos, txs_per_block):
+    spent = []
+    transactions = []
+    # (spent outputs, (value, script) of the outputs) of each transaction, in the order of the block
+    contents = []
+    created = []
+    fees = 0
+
+    for _ in range(txs_per_block):
+        if not utxos:
+            break
+        num_inputs = min(len(utxos), rng.randint(1, 3))
+        selected = [utxos.pop(rng.randrange(len(utxos))) for _ in range(num_inputs)]
+        total = sum(utxo['value'] for utxo in selected)
+        fee = min(total, rng.randint(0, 5000))
+        fees += fee
+
+        inputs = []
+        witnesses = []
+        for utxo in selected:
+            script_sig, witness = spending_data(rng, utxo)
+            inputs.append((utxo['txid'], utxo['index'], script_sig, 0xfffffffd))
+            witnesses.append(witness)
+
+        outputs = new_outputs(rng, total - fee, created, height, len(transactions) + 1, False)
+        raw, txid = serialize_transaction(inputs, [(value, script) for value, script, _, _ in outputs], witnesses)
+        transactions.append(raw)
+        spent.append(selected)
+        contents.append((selected, [(value, script) for value, script, _, _ in outputs]))
+        for index, (value, script, output_type, key) in enumerate(outputs):
+            if output_type != 'OP_RETURN':
+                created.append({'txid': txid, 'index': index, 'value': value, 'script': script, 'type': output_type, 'key': key, 'height': height, 'coinbase': False})
+
+    # coinbase transaction (block reward + fees, witness commitment, reserved value in the witness)
+    coinbase_outputs = new_outputs(rng, COINBASE_REWARD + fees, created, height, 0, True, max_outputs=2)
+    coinbase_outputs.append((0, b'\x6a\x24\xaa\x21\xa9\xed' + rng.randbytes(32), 'OP_RETURN', None))
+    coinbase_inputs = [(b'\x00' * 32, 0xffffffff, b'\x03' + struct.pack('<I', height)[:3] + rng.randbytes(8), 0xffffffff)]
+    coinbase_raw, coinbase_txid = serialize_transaction(coinbase_inputs, [(value, script) for value, script, _, _ in coinbase_outputs], [[b'\x00' * 32]])
+    for index, (value, script, output_type, key) in enumerate(coinbase_outputs):
+        if output_type != 'OP_RETURN':
+            created.append({'txid': coinbase_txid, 'index': index, 'value': value, 'script': script, 'type': output_type, 'key': key, 'height': height, 'coinbase': True})
+
+    transactions.insert(0, coinbase_raw)
+    contents.insert(0, ([], [(value, script) for value, script, _, _ in coinbase_outputs]))
+
+    header = struct.pack('<I', 0x20000000) + prev_hash + rng.randbytes(32) + struct.pack('<III', 1700000000 + height * 600, 0x17030ecd, rng.getrandbits(32))
+    block_hash = sha256d(header)
+    block = header + compactsize(len(transactions)) + b''.join(transactions)
+
+    undo = compactsize(len(spent)) + b''.join(
+        compactsize(len(selected)) + b''.join(
+            core_varint(utxo['height'] * 2 + (1 if utxo['coinbase'] else 0)) + core_varint(0) +
+            core_varint(compress_amount(utxo['value'])) + compress_script(utxo['script'])
+            for utxo in selected)
+        for selected in spent)
+
+    utxos.extend(created)
+
+    return block, block_hash, header, undo, len(transactions), contents
+
+def write_chainstate(dir_chainstate, utxos, best_block, seed=0):
+    """Writes the utxos in an obfuscated chainstate LevelDB, with the layout of bitcoin core 0.15 or later."""
+    rng = random.Random(seed)
+    key = rng.randbytes(8)
+
+    def obfuscate(value):
+        return bytes(b ^ key[i % 8] for i, b in enumerate(value))
+
+    with plyvel.DB(dir_chainstate, create_if_missing=True, compression=None) as db:
+        db.put(b'\x0e\x00obfuscate_key', b'\x08' + key)
+        db.put(b'B', obfuscate(best_block))
+        for utxo in utxos:
+            value = core_varint(utxo['height'] * 2 + (1 if utxo['coinbase'] else 0)) + core_varint(compress_amount(utxo['value'])) + compress_script(utxo['script'])
+            db.put(b'C' + utxo['txid'] + core_varint(utxo['index']), obfuscate(value))
+
+def generate_chain(dir_output, num_blocks, txs_per_block=200, blocks_per_file=50, start_height=1, seed=0, chainstate=False, transactions=None):
+    """
+    Writes blkNNNNN.dat, revNNNNN.dat and a LevelDB block index (blocks/index) for num_blocks blocks.
+    Returns the list of (height, file, data_pos, undo_pos) written to the index.
+    If chainstate is set, the unspent outputs of the last block (plus some P2PK coins) are also written to a chainstate LevelDB (chainstate),
+    and they are returned together with the list.
+    If a list is given as transactions, (height, transactions of the block) are appended to it, each transaction being (spent outputs, (value, script) of the outputs).
+    """
+    rng = random.Random(seed)
+    dir_blocks = os.path.join(dir_output, 'blocks')
+    os.makedirs(os.path.join(dir_blocks, 'index'), exist_ok=True)
+
+    # initial outputs to be spent by the first blocks
+    utxos = []
+    for index in range(max(txs_per_block * 2, 100)):
+        script, key = output_script(rng, OUTPUT_TYPES[index % 6])
+        utxos.append({'txid': rng.randbytes(32), 'index': index, 'value': rng.randint(10000, 10 ** 9), 'script': script, 'type': OUTPUT_TYPES[index % 6], 'key': key, 'height': start_height - 1, 'coinbase': False})
+
+    entries = []
+    prev_hash = rng.randbytes(32)
+
+    with plyvel.DB(os.path.join(dir_blocks, 'index'), create_if_missing=True, compression=None) as db:
+        blk_file = rev_file = None
+        file_info = {}
+
+        for number in range(num_blocks):
+            height = start_height + number
+            file = number // blocks_per_file
+
+            if number % blocks_per_file == 0:
+                if blk_file:
+                    blk_file.close()
+                    rev_file.close()
+                blk_file = open(os.path.join(dir_blocks, f'blk{file:05d}.dat'), 'wb')
+                rev_file = open(os.path.join(dir_blocks, f'rev{file:05d}.dat'), 'wb')
+
+            block, block_hash, header, undo, num_txs, contents = build_block(rng, height, prev_hash, utxos, txs_per_block)
+            if transactions is not None:
+                transactions.append((height, contents))
+
+            blk_file.write(BITCOIN_CONSTANT + struct.pack('<I', len(block)))
+            data_pos = blk_file.tell()
+            blk_file.write(block)
+
+            rev_file.write(BITCOIN_CONSTANT + struct.pack('<I', len(undo)))
+            undo_pos = rev_file.tell()
+            rev_file.write(undo + sha256d(prev_hash + undo))
+
+            status = BLOCK_VALID_SCRIPTS | BLOCK_HAVE_DATA | BLOCK_HAVE_UNDO
+            value = core_varint(CLIENT_VERSION) + core_varint(height) + core_varint(status) + core_varint(num_txs) + core_varint(file) + core_varint(data_pos) + core_varint(undo_pos) + header
+            db.put(b'b' + block_hash, value)
+
+            info = file_info.setdefault(file, {'blocks': 0, 'size': 0, 'undo_size': 0, 'first': height, 'last': height, 'time_first': 0, 'time_last': 0})
+            info['blocks'] += 1
+            info['size'] = blk_file.tell()
+            info['undo_size'] = rev_file.tell()
+            info['last'] = height
+
+            entries.append((height, file, data_pos, undo_pos))
+            prev_hash = block_hash
+
+        blk_file.close()
+        rev_file.close()
+
+        # block file information and last block file, as written by bitcoin core
+        for file, info in file_info.items():
+            db.put(b'f' + struct.pack('<i', file), b''.join(core_varint(info[key]) for key in ('blocks', 'size', 'undo_size', 'first', 'last', 'time_first', 'time_last')))
+        db.put(b'l', struct.pack('<i', max(file_info)))
+
+    if chainstate:
+        # P2PK coins (never spent by the blocks) are added only to the chainstate
+        p2pk_rng = random.Random(seed + 1)
+        for index in range(40):
+            utxos.append({'txid': p2pk_rng.randbytes(32), 'index': index, 'value': p2pk_rng.randint(1, 5 * 10 ** 9), 'script': p2pk_script(p2pk_rng, index % 2 == 0), 'type': 'P2PK', 'key': None, 'height': p2pk_rng.randint(1, start_height + num_blocks - 1), 'coinbase': True})
+        write_chainstate(os.path.join(dir_output, 'chainstate'), utxos, prev_hash, seed)
+        return entries, utxos
+
+    return entries
@@ -1,94 +1,336 @@
 import os
+import mmap
+import time
+import shutil
+import tempfile
 import plyvel
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from file_parsing.rev_parser import block_undo, get_block
-from file_parsing.index_parser import block_index, format_hash
-from file_parsing.blk_parser import block_parsing
-from file_parsing.blk_parser_utxo import block_parsing_utxo
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from file_parsing.rev_parser import parse_undo_block, undo_transaction_offsets, parse_undo_range
+from file_parsing.index_parser import update_block_index, blocks_in_range, main_chain_blocks
+from file_parsing.blk_parser import parse_block, read_compactsize, transaction_offsets, parse_transaction_range
+from file_parsing.blk_parser_utxo import parse_block as parse_block_utxo
+from file_parsing.block_stream import BlockStream, merge_undo_transaction, merge_undo_block
+from utils.utils import set_address_cache_size, address_cache_stats
+from storage.columnar_blocks import block_to_columns, columnar_block_bytes, intern_block_addresses
+from storage.extraction_manifest import ExtractionManifest, write_atomically
+from storage.block_archive import pack_blocks
+from storage.block_deltas import build_block_deltas
+from storage.address_table import AddressTable, DEFAULT_ADDRESS_TABLE
 from tqdm import tqdm
 
 dir_blocks = '/home/carlo/.bitcoin/blocks/' # Directory where blk*.dat files are stored
 dir_indexes = '/home/carlo/.bitcoin/blocks/index'
 dir_results_blocks = './result/blocks/' # Directory where to save blocks results
 dir_results_utxos = './result/utxos/' # Directory where to save utxos results
+dir_archive_blocks = './result/archive/' # Directory where the segments packed from dir_results_blocks are saved
+dir_deltas = './result/deltas/' # Directory where the net amounts per address of the blocks of dir_results_blocks are saved
+block_index_cache = './result/block_index.npy' # File where the decoded block index is cached between runs
+address_table_file = DEFAULT_ADDRESS_TABLE # File where the ids of the addresses referenced by the 'npz' blocks are stored
 
 EXTRACT_BLOCKS = True  # Flag to determine whether blocks should be extracted by the parser to be be processed
 EXTRACT_TRANSACTIONS = False  # Flag to determine whether transactions should be extracted by the parser to be used to revert utxos up to a selected block
 LIST_BLOCKS = False  # Flag to determine whether blocks' general information should be displayed
+VERIFY_BLOCKS = False  # Flag to determine whether the blocks recorded in the manifests of dir_results_blocks and dir_results_utxos should be checked, extracting again only the corrupted ones
+FOLLOW_TIP = False  # Flag to determine whether the blocks after the last one already extracted (from start_block onwards) should be extracted up to the tip of the node (end_block is ignored)
+POLL_INTERVAL = None  # used only by FOLLOW_TIP: seconds between two checks of the block index for new blocks (None to stop once the tip is reached)
+BLOCK_FORMAT = 'npz'  # Format of the extracted blocks: 'npz' (columnar arrays, read without any text parsing) or 'txt' (python representation of the block)
+PACK_BLOCKS = False  # Flag to determine whether the blocks recorded in the manifest of dir_results_blocks should be packed into the zstd compressed segments of dir_archive_blocks (see storage/block_archive.py)
+BUILD_DELTAS = False  # Flag to determine whether the blocks recorded in the manifest of dir_results_blocks should be collapsed into the memory-mapped net amounts per address of dir_deltas (see storage/block_deltas.py)
+LAZY_RECEIVERS = False  # used only by the 'npz' format: outputs store their script instead of their address, which is encoded only when the block is read (addresses are then not interned in address_table_file)
 start_block = 856000  # used by EXTRACT_BLOCKS, EXTRACT_TRANSACTIONS, LIST_BLOCKS
 end_block = 866000  # used only by EXTRACT_BLOCKS (EXTRACT_TRANSACTIONS automatically sets the end block to te last block available, LIST_BLOCKS' purpose is to list all subsequent values)
 
-def parse_block(block):
-    block_path = dir_results_blocks + f'block_{block[0]}.txt'
-
-    if not os.path.exists(block_path):
-        blk_path = os.path.join(dir_blocks, f'blk0{block[1]}.dat')
-        rev_path = os.path.join(dir_blocks, f'rev0{block[1]}.dat')
-        actual_block = block_parsing(blk_path, block[2] - 8)
-        undo_block = block_undo(get_block(rev_path, block[3] - 8))
-
-        for transaction_index in range(len(undo_block)):
-            for output_index in range(len(undo_block[transaction_index])):
-                # transaction_index + 1 because in the undo_block the coinbase transaction is not present
-                if actual_block['Transactions'][transaction_index + 1]['Inputs'][output_index]['Sender'] == None and undo_block[transaction_index][output_index]['Script'] != 'Unknown':
-                    actual_block['Transactions'][transaction_index + 1]['Inputs'][output_index]['Sender'] = undo_block[transaction_index][output_index]['Address']
-                # always set the value
-                actual_block['Transactions'][transaction_index + 1]['Inputs'][output_index]['Value'] = undo_block[transaction_index][output_index]['Amount']
-        
-        with open(block_path,'w+') as f:
-            f.write(str(actual_block))
+num_processors = os.cpu_count() or 1  # number of worker processes used for the extraction
+batch_size = 64  # maximum number of blocks (all from the same blk/rev file pair) decoded by a worker in a single task
+max_pending_batches = 2 * num_processors  # maximum number of batches submitted and not yet completed
+address_cache_size = 1000000  # maximum number of encoded addresses cached by each worker process (0 to disable the cache)
+segment_size = 1000  # used only by PACK_BLOCKS: number of consecutive heights stored in a segment
+large_block_transactions = 2000  # blocks with at least this many transactions are split in ranges of transactions decoded by different workers (None to disable)
+
+def blk_file_path(file):
+    return os.path.join(dir_blocks, f'blk{file:05d}.dat')
+
+def rev_file_path(file):
+    return os.path.join(dir_blocks, f'rev{file:05d}.dat')
+
+def write_block(dir_results, block, block_format, data):
+    # the returned entry is recorded in the manifest (see storage/extraction_manifest.py) only once the file has been written
+    name = f'block_{block[0]}.{block_format}'
+    length, data_checksum = write_atomically(os.path.join(dir_results, name), data)
+    return (block[0], block_format, block[1], block[2], block[3], name, length, data_checksum)
+
+def parse_blocks(file, blocks, dir_results, block_parser, block_format, lazy_receivers=False):
+    # all the blocks belong to the same file, so both blk*.dat and rev*.dat are opened and mapped only once
+    # manifest entries of the 'txt' blocks, which are written by the worker
+    entries = []
+    # (block, columns) of the 'npz' blocks, they are written by the main process once their addresses have a global id
+    columnar_blocks = []
+    stats = address_cache_stats()
+    hits_before, misses_before = stats['hits'], stats['misses']
+
+    with open(blk_file_path(file), 'rb') as blk_f, open(rev_file_path(file), 'rb') as rev_f, \
+            mmap.mmap(blk_f.fileno(), 0, prot=mmap.PROT_READ) as blk_data, mmap.mmap(rev_f.fileno(), 0, prot=mmap.PROT_READ) as rev_data:
+
+        # block = (height, file, data_pos, undo_pos)
+        for block in blocks:
+            actual_block = block_parser(blk_data, block[2] - 8, lazy_receivers=True) if lazy_receivers else block_parser(blk_data, block[2] - 8)
+            undo_block = parse_undo_block(rev_data, block[3] - 8)
+            actual_block = merge_undo_block(actual_block, undo_block)
+
+            if block_format == 'npz':
+                columnar_blocks.append((block, block_to_columns(actual_block)))
+            else:
+                entries.append(write_block(dir_results, block, block_format, str(actual_block).encode('utf-8')))
+
+    # the counters of the worker are cumulative, so only the ones of this batch are returned
+    stats = address_cache_stats()
+    return len(blocks), entries, columnar_blocks, stats['hits'] - hits_before, stats['misses'] - misses_before
+
+def parse_block_range(file, tx_start, undo_start, first_index, count, lazy_receivers=False):
+    # transactions from first_index to first_index + count - 1 of a large block, merged with their spent outputs
+    stats = address_cache_stats()
+    hits_before, misses_before = stats['hits'], stats['misses']
+
+    with open(blk_file_path(file), 'rb') as blk_f, open(rev_file_path(file), 'rb') as rev_f, \
+            mmap.mmap(blk_f.fileno(), 0, prot=mmap.PROT_READ) as blk_data, mmap.mmap(rev_f.fileno(), 0, prot=mmap.PROT_READ) as rev_data:
+        transactions = parse_transaction_range(blk_data, tx_start, count, lazy_receivers)
+        # the coinbase transaction has no spent outputs in the undo data
+        first_spending = 1 if first_index == 0 else 0
+        undo_transactions = parse_undo_range(rev_data, undo_start, count - first_spending)
+
+    for transaction, spent_outputs in zip(transactions[first_spending:], undo_transactions):
+        merge_undo_transaction(transaction, spent_outputs)
+
+    stats = address_cache_stats()
+    return transactions, stats['hits'] - hits_before, stats['misses'] - misses_before
+
+def split_large_block(file, block, num_ranges):
+    # first pass: only the boundaries of the transactions (in blk*.dat) and of their spent outputs (in rev*.dat) are found
+    with open(blk_file_path(file), 'rb') as blk_f, open(rev_file_path(file), 'rb') as rev_f, \
+            mmap.mmap(blk_f.fileno(), 0, prot=mmap.PROT_READ) as blk_data, mmap.mmap(rev_f.fileno(), 0, prot=mmap.PROT_READ) as rev_data:
+        block_hash, previous_block_hash, offsets = transaction_offsets(blk_data, block[2] - 8)
+        undo_offsets = undo_transaction_offsets(rev_data, block[3] - 8)
+
+    tx_count = len(offsets) - 1
+    range_size = -(-tx_count // num_ranges)
+
+    # (tx_start, undo_start, first_index, count), transaction i (i >= 1) spends the outputs at undo_offsets[i - 1]
+    ranges = []
+    for first_index in range(0, tx_count, range_size):
+        count = min(range_size, tx_count - first_index)
+        ranges.append((offsets[first_index], undo_offsets[max(first_index - 1, 0)], first_index, count))
+
+    return block_hash, previous_block_hash, ranges
+
+def find_large_blocks(file, file_blocks):
+    # only the transaction count, right after the 80 bytes of the header, is read
+    large_blocks = []
+    with open(blk_file_path(file), 'rb') as blk_f, mmap.mmap(blk_f.fileno(), 0, prot=mmap.PROT_READ) as blk_data:
+        for block in file_blocks:
+            tx_count, _ = read_compactsize(blk_data, block[2] + 80)
+            if tx_count >= large_block_transactions:
+                large_blocks.append(block)
+
+    return large_blocks
+
+def extract_blocks(blocks, dir_results, block_parser, block_format, desc):
+    manifest = ExtractionManifest(dir_results)
+    # a block is extracted again unless it is in the manifest, even if its file exists (it may have been truncated by a crash)
+    blocks = [block for block in blocks if not manifest.contains(block[0], block_format)]
+
+    # group the blocks by file (block[1]) and sort them by their position in the file, so that each file is read sequentially
+    blocks_per_file = {}
+    for block in blocks:
+        blocks_per_file.setdefault(block[1], []).append(block)
+
+    batches = []
+    # (file, block) of the blocks whose transactions are decoded in parallel (the two-pass decoding is implemented only by parse_block)
+    large_blocks = []
+    for file, file_blocks in sorted(blocks_per_file.items()):
+        file_blocks.sort(key=lambda x: x[2])
+        if block_parser is parse_block and large_block_transactions is not None:
+            file_large_blocks = find_large_blocks(file, file_blocks)
+            large_blocks.extend((file, block) for block in file_large_blocks)
+            file_blocks = [block for block in file_blocks if block not in file_large_blocks]
+
+        for i in range(0, len(file_blocks), batch_size):
+            batches.append((file, file_blocks[i:i + batch_size]))
+
+    # hits and misses of the address caches of all the workers
+    cache_counters = [0, 0]
+    # the outputs of blocks with lazy receivers have no address to be interned (the option is implemented only by parse_block)
+    lazy_receivers = LAZY_RECEIVERS and block_format == 'npz' and block_parser is parse_block
+    address_table = AddressTable(address_table_file) if block_format == 'npz' and not lazy_receivers else None
+
+    def blocks_completed(num_blocks, entries, columnar_blocks, hits, misses):
+        # the new addresses are saved before the blocks referencing them
+        if address_table is not None:
+            columnar_blocks = [(block, intern_block_addresses(columns, address_table)) for block, columns in columnar_blocks]
+            address_table.save()
+        entries = entries + [write_block(dir_results, block, block_format, columnar_block_bytes(columns)) for block, columns in columnar_blocks]
+        manifest.record(entries)
+
+        cache_counters[0] += hits
+        cache_counters[1] += misses
+        lookups = cache_counters[0] + cache_counters[1]
+        pbar.set_postfix(address_cache_hit_rate=f'{cache_counters[0] / lookups:.2%}' if lookups > 0 else '-')
+        pbar.update(num_blocks)
+
+    def batch_completed(future):
+        blocks_completed(*future.result())
+
+    def extract_large_block(file, block):
+        block_hash, previous_block_hash, ranges = split_large_block(file, block, num_processors)
+        futures = [processors.submit(parse_block_range, file, *block_range, lazy_receivers) for block_range in ranges]
+
+        transactions = []
+        hits, misses = 0, 0
+        # the ranges are concatenated in the order of the transactions
+        for future in futures:
+            range_transactions, range_hits, range_misses = future.result()
+            transactions.extend(range_transactions)
+            hits += range_hits
+            misses += range_misses
+
+        # same keys, in the same order, of the blocks decoded by parse_block
+        actual_block = {'Block Hash': block_hash, 'Previous Block Hash': previous_block_hash, 'Reward': transactions[0].pop('Reward'), 'Fees': transactions[0].pop('Fees'), 'Transactions': transactions}
+
+        if block_format == 'npz':
+            blocks_completed(1, [], [(block, block_to_columns(actual_block))], hits, misses)
+        else:
+            blocks_completed(1, [write_block(dir_results, block, block_format, str(actual_block).encode('utf-8'))], [], hits, misses)
+
+    with ProcessPoolExecutor(max_workers=num_processors, initializer=set_address_cache_size, initargs=(address_cache_size,)) as processors, tqdm(total=len(blocks), desc=desc) as pbar:
+        # large blocks are decoded one at a time, each of them using all the workers
+        for file, block in large_blocks:
+            extract_large_block(file, block)
+
+        # only a bounded number of batches is in flight, so that memory does not grow with the number of blocks
+        pending = set()
+        for file, file_blocks in batches:
+            if len(pending) >= max_pending_batches:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch_completed(future)
+
+            pending.add(processors.submit(parse_blocks, file, file_blocks, dir_results, block_parser, block_format, lazy_receivers))
+
+        for future in as_completed(pending):
+            batch_completed(future)
+
+    manifest.close()
+    print(f'Address cache: {cache_counters[0]} hits, {cache_counters[1]} misses')
+
+@contextmanager
+def open_block_index():
+    try:
+        db = plyvel.DB(dir_indexes, compression=None)
+    except plyvel.IOError:
+        db = None
+
+    if db is not None:
+        with db:
+            yield db
+    else:
+        # the leveldb is locked by the running node, so a copy of it is opened instead
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dir_copy = os.path.join(tmp_dir, 'index')
+            shutil.copytree(dir_indexes, dir_copy, ignore=shutil.ignore_patterns('LOCK'))
+            with plyvel.DB(dir_copy, compression=None) as db:
+                yield db
+
+def load_block_indexes():
+    with open_block_index() as db:
+        # Block index entries are stored with keys prefixed by 'b', only the ones not yet cached are decoded
+        return update_block_index(db, block_index_cache)
+
+def stream_blocks(first_height, last_height=None):
+    # blocks decoded on the fly, to be fed to the engines without being written to dir_results_blocks (see file_parsing/block_stream.py)
+    return BlockStream(dir_blocks, blocks_in_range(load_block_indexes(), first_height, last_height), num_processors, max_pending_batches=max_pending_batches)
+
+def last_extracted_height(dir_results, first_height):
+    # only the blocks completely written (i.e. recorded in the manifest) are considered
+    with ExtractionManifest(dir_results) as manifest:
+        heights = manifest.recorded_heights()
+
+    # last height of the contiguous sequence of blocks extracted from first_height, so that gaps left by an interrupted run are filled
+    height = first_height - 1
+    while height + 1 in heights:
+        height += 1
+
+    return height
+
+def verify_blocks(dir_results, block_parser, block_format):
+    with ExtractionManifest(dir_results) as manifest:
+        corrupted = manifest.verify(block_format)
+        # once removed from the manifest, the blocks are extracted again by extract_blocks
+        manifest.remove([block[0] for block in corrupted], block_format)
+
+    print(f'{len(corrupted)} corrupted blocks in {dir_results}')
+    if len(corrupted) > 0:
+        extract_blocks(corrupted, dir_results, block_parser, block_format, 'Extracting corrupted blocks')
+
+def follow_tip():
+    os.makedirs(dir_results_blocks, exist_ok=True)
+    last_height = last_extracted_height(dir_results_blocks, start_block)
+
+    while True:
+        blockIndexes = load_block_indexes()
+
+        # block = (height, file, data_pos, undo_pos)
+        blocks = main_chain_blocks(blockIndexes, last_height + 1)
+        if len(blocks) > 0:
+            extract_blocks(blocks, dir_results_blocks, parse_block, BLOCK_FORMAT, 'Writing new blocks')
+            last_height = blocks[-1][0]
+
+        if POLL_INTERVAL is None:
+            break
+        time.sleep(POLL_INTERVAL)
 
 def main():
-    with plyvel.DB(dir_indexes, compression=None) as db:
-        # Block index entries are stored with keys prefixed by 'b'
-        with db.iterator(prefix=b'b') as iterator:
-            blockIndexes = [block_index(format_hash(k[1:]), v) for k, v in iterator]
-            blockIndexes.sort(key=lambda x: x[0])
+    if VERIFY_BLOCKS:
+        verify_blocks(dir_results_blocks, parse_block, BLOCK_FORMAT)
+        if os.path.exists(dir_results_utxos):
+            verify_blocks(dir_results_utxos, parse_block_utxo, 'txt')
+        return
+
+    if FOLLOW_TIP:
+        follow_tip()
+        return
+
+    blockIndexes = load_block_indexes()
 
     # blocks are extracted by the parser
     if EXTRACT_BLOCKS:
+        # block = (height, file, data_pos, undo_pos)
+        blocks = blocks_in_range(blockIndexes, start_block, end_block)
+        extract_blocks(blocks, dir_results_blocks, parse_block, BLOCK_FORMAT, 'Writing blocks')
+
+    # extracted blocks are packed into segments, which are read by the simulations in place of the single files
+    if PACK_BLOCKS:
+        with ExtractionManifest(dir_results_blocks) as manifest:
+            heights = manifest.heights.get(BLOCK_FORMAT, set())
+        packed = pack_blocks(dir_results_blocks, dir_archive_blocks, BLOCK_FORMAT, heights, segment_size)
+        print(f'{packed} segments written in {dir_archive_blocks}')
 
-        with ProcessPoolExecutor() as processors, tqdm(range(start_block, end_block + 1), desc='Writing blocks') as pbar:
-            # block = (height, file, data_pos, undo_pos)
-            futures_processors = [processors.submit(parse_block, block) for block in blockIndexes if start_block <= block[0] <= end_block]
+    # extracted blocks are collapsed once into net amounts per address, shared by all the simulations
+    if BUILD_DELTAS:
+        with ExtractionManifest(dir_results_blocks) as manifest:
+            heights = manifest.heights.get(BLOCK_FORMAT, set())
+        built = build_block_deltas(dir_results_blocks, dir_deltas, AddressTable(address_table_file), [f'block_{height}.{BLOCK_FORMAT}' for height in sorted(heights)])
+        print(f'{built} blocks collapsed in {dir_deltas}')
 
-            for _ in as_completed(futures_processors):
-                pbar.update(1)
-    
     # blocks' general information are displayed
     if LIST_BLOCKS:
-        for block in blockIndexes:
-            if start_block <= block[0]:
-                print(block)
+        for block in blocks_in_range(blockIndexes, start_block):
+            print(block)
 
     # transactions are extracted by the parser to be used to revert utxos up to a selected block
     if EXTRACT_TRANSACTIONS:
-        # height of the last block
-        last_block = blockIndexes[-1][0]
-        with tqdm(range(start_block, last_block + 1), desc='Writing blocks') as pbar:
-            for block in blockIndexes:
-                # block = (height, file, data_pos, undo_pos)
-                if 856000 <= block[0]:
-                    block_path = dir_results_utxos + f'block_{block[0]}.txt'
-
-                    if not os.path.exists(block_path):
-                        blk_path = os.path.join(dir_blocks, f'blk0{block[1]}.dat')
-                        rev_path = os.path.join(dir_blocks, f'rev0{block[1]}.dat')
-                        actual_block = block_parsing_utxo(blk_path, block[2] - 8)
-                        undo_block = block_undo(get_block(rev_path, block[3] - 8))
-
-                        for transaction_index in range(len(undo_block)):
-                            for output_index in range(len(undo_block[transaction_index])):
-                                # transaction_index + 1 because in the undo_block the coinbase transaction is not present
-                                if actual_block['Transactions'][transaction_index + 1]['Inputs'][output_index]['Sender'] == None and undo_block[transaction_index][output_index]['Script'] != 'Unknown':
-                                    actual_block['Transactions'][transaction_index + 1]['Inputs'][output_index]['Sender'] = undo_block[transaction_index][output_index]['Address']
-                                # always set the value
-                                actual_block['Transactions'][transaction_index + 1]['Inputs'][output_index]['Value'] = undo_block[transaction_index][output_index]['Amount']
-                        
-                        with open(block_path,'w+') as f:
-                            f.write(str(actual_block))
-
-                    pbar.update(1)
+        # from start_block up to the last block available
+        blocks = blocks_in_range(blockIndexes, start_block)
+        extract_blocks(blocks, dir_results_utxos, parse_block_utxo, 'txt', 'Writing blocks')
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,16 +1,20 @@
 import sqlite3
 
+DB_NAME = "./result/utxo/accounts.db"
+# accounts keyed by the ids of the address table (see storage/address_table.py)
+ADDRESS_IDS_DB_NAME = "./result/utxo/accounts_ids.db"
+
 # Connect to SQLite database (or create it if it doesn't exist)
-def create_connection(db_name="./result/utxo/accounts.db"):
+def create_connection(db_name=DB_NAME):
     conn = sqlite3.connect(db_name)
     return conn
 
-# Create the accounts table
-def create_table(conn):
+# Create the accounts table (address_type is INTEGER if addresses are stored by id)
+def create_table(conn, address_type='TEXT'):
     with conn:
-        conn.execute("""
+        conn.execute(f"""
             CREATE TABLE IF NOT EXISTS accounts (
-                address TEXT PRIMARY KEY,
+                address {address_type} PRIMARY KEY,
                 balance REAL
             );
         """)
@@ -46,4 +50,19 @@ def retrieve_all_accounts(conn):
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM accounts;")
     rows = cursor.fetchall()
-    return rows
\ No newline at end of file
+    return rows
+# Add the amounts (address: amount) to the balances of the accounts, creating the missing ones and deleting the emptied ones
+def add_to_balances(conn, amounts):
+    with conn:
+        # no type is given to the address, so that it matches both TEXT addresses and INTEGER ids
+        conn.execute("CREATE TEMP TABLE amounts (address PRIMARY KEY, amount INTEGER);")
+        conn.executemany("INSERT INTO amounts (address, amount) VALUES (?, ?);", amounts.items())
+        conn.execute("INSERT INTO accounts (address, balance) SELECT address, amount FROM amounts WHERE true ON CONFLICT (address) DO UPDATE SET balance = balance + excluded.balance;")
+        conn.execute("DELETE FROM accounts WHERE balance = 0 AND address IN (SELECT address FROM amounts);")
+        conn.execute("DROP TABLE amounts;")
+
+# Count the accounts with a negative balance
+def count_negative_accounts(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM accounts WHERE balance < 0;")
+    return cursor.fetchone()[0]
@@ -1,16 +1,20 @@
 import sqlite3
 
+DB_NAME = "./result/utxo/multi_input_accounts.db"
+# accounts keyed by the ids of the address table (see storage/address_table.py)
+ADDRESS_IDS_DB_NAME = "./result/utxo/multi_input_accounts_ids.db"
+
 # Connect to SQLite database (or create it if it doesn't exist)
-def create_connection(db_name="./result/utxo/multi_input_accounts.db"):
+def create_connection(db_name=DB_NAME):
     conn = sqlite3.connect(db_name)
     return conn
 
-# Create the accounts table
-def create_tables(conn):
+# Create the accounts table (address_type is INTEGER if addresses are stored by id)
+def create_tables(conn, address_type='TEXT'):
     with conn:
-        conn.execute("""
+        conn.execute(f"""
             CREATE TABLE IF NOT EXISTS addresses (
-                address TEXT PRIMARY KEY,
+                address {address_type} PRIMARY KEY,
                 user REAL
             );
         """)
@@ -1,249 +1,294 @@
 import mmap
-from binascii import unhexlify, hexlify
-from utils.utils import reverse, p2wpkh_to_address, sha256
-from utils.parse_transaction_output import parse_transaction_output
-from utils.parse_transaction_input import parse_transaction_input
-from utils.parse_witness import public_key_to_hash160
-from utils.address_conversion import input_script_to_addr
+import struct
+from utils.utils import sha256
+from utils.parse_transaction_output import parse_script
+from utils.parse_transaction_input import parse_input_script
+from utils.batch_address_encoding import classify_output_script, classify_script, encode_addresses, encode_public_keys
 
 COINBASE_REWARD = 312500000 # expressed in satoshis
-IS_COINBASE = False
-
-def read_bytes_from_str(str, pos, n, byte_order = 'L'):
-    data = str[pos:pos+n]
-    if len(data) < n:
-        return None
-    if byte_order == 'L':
-        data = data[::-1]
-    data = data.hex().upper()
-    return data
-
-def read_varint_from_str(str, pos):
-    b = str[pos:pos+1]
-    bInt = int(b.hex(), 16)
-    c = 0
-    data = ''
-
-    if bInt < 253:
-        c = 1
-        data = b.hex().upper()
-    if bInt == 253: c = 3
-    if bInt == 254: c = 5
-    if bInt == 255: c = 9
-
-    new_pos = pos + 1
-    for _ in range(1,c):
-        b = str[new_pos:new_pos+1]
-        b = b.hex().upper()
-        data = b + data
-        new_pos += 1
-
-    return data, new_pos - pos
-
-def parse_transaction(mmap_obj, pos):
-    global IS_COINBASE
-    global COINBASE_REWARD
+# Constant separating blocks in the .blk files
+BITCOIN_CONSTANT = b"\xf9\xbe\xb4\xd9"
+NULL_HASH = b'\x00' * 32
+
+# input script type: (public key type used by the address cache, prefix of the public key)
+# (same conversion as address_conversion.input_script_bytes_to_addr)
+INPUT_KEY_TYPES = {
+    'P2PKH Input': ('P2PKH Input', b''),
+    'P2SH-P2WPKH Input': ('P2SH Input', b'\x00\x14'),
+}
+
+# Dynamic representation of integers based on their length:
+# - first byte < 253 ---> the integer is represented as a single byte (the first one)
+# - first byte = 253 ---> the integer is represented as two bytes (the subsequent ones)
+# - first byte = 254 ---> the integer is represented as four bytes (the subsequent ones)
+# - first byte = 255 ---> the integer is represented as eight bytes (the subsequent ones)
+def read_compactsize(buffer, pos):
+    """Reads the integer starting at pos, returns it together with the position of the following byte."""
+    size = buffer[pos]
+    if size < 253:
+        return size, pos + 1
+    if size == 253:
+        return struct.unpack_from('<H', buffer, pos + 1)[0], pos + 3
+    if size == 254:
+        return struct.unpack_from('<I', buffer, pos + 1)[0], pos + 5
+    return struct.unpack_from('<Q', buffer, pos + 1)[0], pos + 9
+
+def output_script_to_receiver(script):
+    script_type, address = parse_script(script)
+    if isinstance(address, bytes):
+        address = address.decode('utf-8')
+    elif isinstance(address, list):
+        address = 'UNKNOWN'
+    # if the first two elements of the address are 6a (= OP_RETURN), then it means that the output is invalid
+    if address[:2] == '6a':
+        address = 'INVALID'
+    return address
+
+def parse_transaction(buffer, pos, pending, lazy_receivers=False):
+    """
+    Parses the transaction starting at pos of buffer (a memoryview), returns it together with the position of the following byte.
+    Standard addresses are not encoded here, but added to pending (see _encode_pending_addresses) to be encoded together with the rest of the block.
+    With lazy_receivers, outputs are not encoded at all: their 'Receiver' is None and their 'Script' is the (script class, payload)
+    returned by classify_script, to be converted by receiver_from_script only when needed.
+    """
     transaction = {}
-
-    tmpHex = ''
+    is_coinbase = False
 
     # Version Number
     pos += 4
 
     # Check if there is the optional two-byte array flag for witness data
-    Witness = False
-    b = read_bytes_from_str(mmap_obj, pos, 1)
-    bInt = int(b, 16)
-    pos += 1
-    
-    if bInt == 0:
-        pos += 1  # Skip the witness flag
-        c = 0
-        c = read_bytes_from_str(mmap_obj, pos, 1)
-        bInt = int(c, 16)
-        pos += 1
-        Witness = True
+    witness = buffer[pos] == 0
+    if witness:
+        pos += 2  # Skip the marker and the witness flag
 
     # Inputs count
-    c = 0
-    if bInt < 253:
-        c = 1
-        tmpHex = hex(bInt)[2:].upper().zfill(2)
-    if bInt == 253: c = 3
-    elif bInt == 254: c = 5
-    elif bInt == 255: c = 9
-    for j in range(1, c):
-        b = read_bytes_from_str(mmap_obj, pos, 1).upper()
-        tmpHex = b + tmpHex
-        pos += 1
-
-    inCount = int(tmpHex, 16)
+    in_count, pos = read_compactsize(buffer, pos)
 
     inputs = []
 
     # Inputs
-    for m in range(inCount):
-        input = {}
+    for _ in range(in_count):
+        # Previous Transaction Hash
+        if buffer[pos:pos+32] == NULL_HASH:
+            is_coinbase = True
+        # Skip Previous Transaction Hash and Previous Transaction Output Index
+        pos += 36
 
-        tmpHex = read_bytes_from_str(mmap_obj, pos, 32)  # Previous Transaction Hash
-        pos += 32
-        if tmpHex == '00' * 32:
-            IS_COINBASE = True
-
-        # Previous Transaction Output Index
-        pos += 4
-
-        tmpHex, offset = read_varint_from_str(mmap_obj, pos)  # Input script length
-        scriptLength = int(tmpHex, 16)
-        pos += offset
-
-        tmpHex = read_bytes_from_str(mmap_obj, pos, scriptLength, 'B')  # Input script
-        pos += scriptLength
-        script_type, public_key = parse_transaction_input(tmpHex)
-        addr = input_script_to_addr(script_type, public_key)
-        input['Sender'] = addr
-        input['Value'] = 0
+        script_length, pos = read_compactsize(buffer, pos)  # Input script length
+        script_type, payload = parse_input_script(bytes(buffer[pos:pos+script_length]))  # Input script
+        pos += script_length
 
         # Sequence number
         pos += 4
 
+        input = {'Sender': None, 'Value': 0}
+        if script_type in INPUT_KEY_TYPES:
+            key_type, prefix = INPUT_KEY_TYPES[script_type]
+            input['Sender'] = ''  # placeholder, the address is set by _encode_pending_addresses
+            pending['keys'].append((input, key_type, prefix + payload))
         inputs.append(input)
 
     transaction['Inputs'] = inputs
 
     # Outputs count
-    tmpHex, offset = read_varint_from_str(mmap_obj, pos)
-    outputCount = int(tmpHex, 16)
-    pos += offset
+    output_count, pos = read_compactsize(buffer, pos)
 
     reward = 0
     outputs = []
 
     # Outputs
-    for m in range(outputCount):
-        output = {}
-
-        tmpHex = read_bytes_from_str(mmap_obj, pos, 8)  # Value
-        value = int(tmpHex, 16)
+    for _ in range(output_count):
+        value = struct.unpack_from('<Q', buffer, pos)[0]  # Value
         pos += 8
-        if IS_COINBASE:
+        if is_coinbase:
             reward += value
 
-        tmpHex, offset = read_varint_from_str(mmap_obj, pos)  # Output script length
-        scriptLength = int(tmpHex, 16)
-        pos += offset
-
-        tmpHex = read_bytes_from_str(mmap_obj, pos, scriptLength, 'B')  # Output script
-        script_type, address = parse_transaction_output(tmpHex)
-        if isinstance(address, bytes):
-            address = address.decode('utf-8')
-        elif isinstance(address, list):
-            address = 'UNKNOWN'
-        # if the first two elements of the address are 6a (= OP_RETURN), then it means that the output is invalid
-        if address[:2] == '6a':
-            address = 'INVALID'
-        pos += scriptLength
-        output['Receiver'] = address
-        output['Value'] = value
-
+        script_length, pos = read_compactsize(buffer, pos)  # Output script length
+        script = bytes(buffer[pos:pos+script_length])  # Output script
+        pos += script_length
+
+        output = {'Receiver': None, 'Value': value}
+        if lazy_receivers:
+            output['Script'] = classify_script(script)
+        else:
+            output_type, output_payload = classify_output_script(script)
+            if output_type is None:
+                output['Receiver'] = output_script_to_receiver(script)
+            else:
+                pending['outputs'].append((output, output_type, output_payload))
         outputs.append(output)
 
     transaction['Outputs'] = outputs
 
-    if IS_COINBASE:
-        fees = reward - COINBASE_REWARD
+    if is_coinbase:
         transaction['Reward'] = reward
-        transaction['Fees'] = fees
-        IS_COINBASE = False
-
-    if Witness:
-        for m in range(inCount):
-            tmpHex, offset = read_varint_from_str(mmap_obj, pos)
-            WitnessLength = int(tmpHex, 16)
-            pos += offset
-
-            witnesses = []
-
-            for j in range(WitnessLength):
-                tmpHex, offset = read_varint_from_str(mmap_obj, pos)
-                WitnessItemLength = int(tmpHex, 16)
-                pos += offset
-                tmpHex = read_bytes_from_str(mmap_obj, pos, WitnessItemLength)
-                pos += WitnessItemLength
-
-                # save both the length and the value
-                witnesses.append(WitnessItemLength)
-                witnesses.append(tmpHex)
-            
-            if len(witnesses) == 4:
-                # addresses can be retrieved by witnesses if the transaction is either P2WPKH or P2SH-P2WPKH
-                if witnesses[0] == 72 and witnesses[2] == 33 and transaction['Inputs'][m]['Sender'] == None:
-                    public_key = reverse(witnesses[3])
-                    public_key_hash = public_key_to_hash160(public_key)
-                    address = p2wpkh_to_address(bytes.fromhex(public_key_hash))
-
-                    transaction['Inputs'][m]['Sender'] = address
-    
-    Witness = False
+        transaction['Fees'] = reward - COINBASE_REWARD
+
+    if witness:
+        for m in range(in_count):
+            witness_count, pos = read_compactsize(buffer, pos)
+
+            # length and position of each item
+            items = []
+            for _ in range(witness_count):
+                item_length, pos = read_compactsize(buffer, pos)
+                items.append((item_length, pos))
+                pos += item_length
+
+            # addresses can be retrieved by witnesses if the transaction is either P2WPKH or P2SH-P2WPKH
+            if len(items) == 2 and items[0][0] == 72 and items[1][0] == 33 and inputs[m]['Sender'] == None:
+                inputs[m]['Sender'] = ''  # placeholder, the address is set by _encode_pending_addresses
+                pending['keys'].append((inputs[m], 'P2WPKH Input', bytes(buffer[items[1][1]:items[1][1]+33])))
 
     # Locktime
     pos += 4
 
     return transaction, pos
 
-def parse_block(mmap_obj, start_pos=0):
-    """Parses a block starting from the specified position."""
-    block = {}
+def _encode_pending_addresses(pending):
+    # all the standard addresses of the block are encoded in a single batch
+    if pending['outputs']:
+        outputs, script_types, payloads = zip(*pending['outputs'])
+        for output, address in zip(outputs, encode_addresses(payloads, script_types)):
+            output['Receiver'] = address
+
+    if pending['keys']:
+        inputs, key_types, public_keys = zip(*pending['keys'])
+        for input, address in zip(inputs, encode_public_keys(public_keys, key_types)):
+            input['Sender'] = address
+
+def parse_block(mmap_obj, start_pos=0, lazy_receivers=False):
+    """Parses a block starting from the specified position (see parse_transaction for lazy_receivers)."""
+    with memoryview(mmap_obj) as buffer:
+        return _parse_block(buffer, start_pos, lazy_receivers)
+
+def parse_block_header(buffer, start_pos):
+    """
+    Returns the hash, the previous block hash and the number of transactions of the block starting at start_pos,
+    together with the position of its first transaction (None if there are no more blocks).
+    """
     pos = start_pos
-    tmpHex = ''
 
-    while tmpHex != 'D9B4BEF9':  # Magic number
-        tmpHex = read_bytes_from_str(mmap_obj, pos, 4)
+    while buffer[pos:pos+4] != BITCOIN_CONSTANT:  # Magic number
         pos += 4
-        if tmpHex == None:
+        if pos + 4 > len(buffer):
             return None
+    pos += 4
 
     # Block Size
     pos += 4
 
     # Block Header
-    block_header = read_bytes_from_str(mmap_obj, pos, 80, 'B')
-    block_header_bytes = unhexlify(block_header)
-    hash = sha256(sha256(block_header_bytes))
-    block_hash = hexlify(hash[::-1]).decode('utf-8').upper()
+    block_hash = sha256(sha256(buffer[pos:pos+80]))[::-1].hex().upper()
 
     pos += 4 # Skip version number
-    previous_block_hash = read_bytes_from_str(mmap_obj, pos, 32)
+    previous_block_hash = bytes(buffer[pos:pos+32])[::-1].hex().upper()
     pos += 32
     pos += 32 + 4 + 4 + 4  # Skip merkle root, timestamp, bits, nonce
 
     # Transaction count
-    tx_count_bytes, offset = read_varint_from_str(mmap_obj, pos)
-    tx_count = int(tx_count_bytes, 16)
-    pos += offset
+    tx_count, pos = read_compactsize(buffer, pos)
+
+    return block_hash, previous_block_hash, tx_count, pos
+
+def _parse_block(buffer, start_pos, lazy_receivers=False):
+    block = {}
+
+    header = parse_block_header(buffer, start_pos)
+    if header is None:
+        return None
+    block_hash, previous_block_hash, tx_count, pos = header
 
     block['Block Hash'] = block_hash
     block['Previous Block Hash'] = previous_block_hash
     transactions = []
+    # inputs and outputs whose address still has to be encoded
+    pending = {'outputs': [], 'keys': []}
 
     for index in range(tx_count):
-        transaction, new_pos = parse_transaction(mmap_obj, pos)
-        pos = new_pos
+        transaction, pos = parse_transaction(buffer, pos, pending, lazy_receivers)
 
         # if it is 0, then the transaction is a coinbase transaction
         if index == 0:
-            reward = transaction.pop('Reward')
-            fees = transaction.pop('Fees')
-            block['Reward'] = reward
-            block['Fees'] = fees
+            block['Reward'] = transaction.pop('Reward')
+            block['Fees'] = transaction.pop('Fees')
 
         transactions.append(transaction)
 
+    _encode_pending_addresses(pending)
     block['Transactions'] = transactions
 
     return block
 
+# -------------------------------------------------------
+# Two-pass decoding (used for very large blocks)
+# -------------------------------------------------------
+
+def skip_transaction(buffer, pos):
+    """Returns the position of the byte following the transaction starting at pos, without decoding it."""
+    # Version Number
+    pos += 4
+
+    witness = buffer[pos] == 0
+    if witness:
+        pos += 2  # Skip the marker and the witness flag
+
+    in_count, pos = read_compactsize(buffer, pos)
+    for _ in range(in_count):
+        pos += 36  # Previous Transaction Hash and Previous Transaction Output Index
+        script_length, pos = read_compactsize(buffer, pos)
+        pos += script_length + 4  # Input script and sequence number
+
+    output_count, pos = read_compactsize(buffer, pos)
+    for _ in range(output_count):
+        pos += 8  # Value
+        script_length, pos = read_compactsize(buffer, pos)
+        pos += script_length
+
+    if witness:
+        for _ in range(in_count):
+            witness_count, pos = read_compactsize(buffer, pos)
+            for _ in range(witness_count):
+                item_length, pos = read_compactsize(buffer, pos)
+                pos += item_length
+
+    # Locktime
+    return pos + 4
+
+def transaction_offsets(mmap_obj, start_pos=0):
+    """
+    First pass: returns the hash and the previous block hash of the block starting at start_pos,
+    together with the position of each of its transactions (plus the position of the end of the last one).
+    """
+    with memoryview(mmap_obj) as buffer:
+        header = parse_block_header(buffer, start_pos)
+        if header is None:
+            return None
+        block_hash, previous_block_hash, tx_count, pos = header
+
+        offsets = [pos]
+        for _ in range(tx_count):
+            pos = skip_transaction(buffer, pos)
+            offsets.append(pos)
+
+    return block_hash, previous_block_hash, offsets
+
+def parse_transaction_range(mmap_obj, start_pos, count, lazy_receivers=False):
+    """Second pass: parses count consecutive transactions starting at start_pos (the coinbase one keeps its 'Reward' and 'Fees')."""
+    with memoryview(mmap_obj) as buffer:
+        transactions = []
+        pending = {'outputs': [], 'keys': []}
+
+        pos = start_pos
+        for _ in range(count):
+            transaction, pos = parse_transaction(buffer, pos, pending, lazy_receivers)
+            transactions.append(transaction)
+
+        _encode_pending_addresses(pending)
+
+    return transactions
+
 def block_parsing(file_path, start_pos=0):
-    with open(file_path, "rb") as f:
-        mm = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
-        return parse_block(mm, start_pos)
\ No newline at end of file
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ) as mm:
+        return parse_block(mm, start_pos)
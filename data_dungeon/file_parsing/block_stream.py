@@ -0,0 +1,83 @@
+import os
+import mmap
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from file_parsing.blk_parser import parse_block
+from file_parsing.rev_parser import parse_undo_block
+
+def merge_undo_transaction(transaction, spent_outputs):
+    for output_index in range(len(spent_outputs)):
+        if transaction['Inputs'][output_index]['Sender'] == None and spent_outputs[output_index]['Script'] != 'Unknown':
+            transaction['Inputs'][output_index]['Sender'] = spent_outputs[output_index]['Address']
+        # always set the value
+        transaction['Inputs'][output_index]['Value'] = spent_outputs[output_index]['Amount']
+
+def merge_undo_block(actual_block, undo_block):
+    for transaction_index in range(len(undo_block)):
+        # transaction_index + 1 because in the undo_block the coinbase transaction is not present
+        merge_undo_transaction(actual_block['Transactions'][transaction_index + 1], undo_block[transaction_index])
+
+    return actual_block
+
+def decode_blocks(dir_blocks, file, blocks):
+    # all the blocks belong to the same file, so both blk*.dat and rev*.dat are opened and mapped only once
+    decoded = []
+    with open(os.path.join(dir_blocks, f'blk{file:05d}.dat'), 'rb') as blk_f, open(os.path.join(dir_blocks, f'rev{file:05d}.dat'), 'rb') as rev_f, \
+            mmap.mmap(blk_f.fileno(), 0, prot=mmap.PROT_READ) as blk_data, mmap.mmap(rev_f.fileno(), 0, prot=mmap.PROT_READ) as rev_data:
+
+        # block = (height, file, data_pos, undo_pos)
+        for block in blocks:
+            actual_block = parse_block(blk_data, block[2] - 8)
+            undo_block = parse_undo_block(rev_data, block[3] - 8)
+            decoded.append((block[0], merge_undo_block(actual_block, undo_block)))
+
+    return decoded
+
+class BlockStream:
+    """
+    Blocks decoded straight from the blk*.dat and rev*.dat files, without writing them to ./result/blocks/.
+    It replaces the reader threads of the engines (like storage.block_archive.BlockArchive): feed puts (height, block) items in their file_queue in height order.
+    """
+    def __init__(self, dir_blocks, blocks, num_processors=None, batch_size=16, max_pending_batches=None):
+        self.dir_blocks = dir_blocks
+        # block = (height, file, data_pos, undo_pos)
+        self.blocks = sorted(blocks)
+        self.num_processors = num_processors or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.max_pending_batches = max_pending_batches or 2 * self.num_processors
+        # decoded blocks reference addresses as strings
+        self.uses_address_ids = False
+
+    def __len__(self):
+        return len(self.blocks)
+
+    @property
+    def first_height(self):
+        return self.blocks[0][0]
+
+    def batches(self):
+        # consecutive blocks stored in the same file are decoded together (the order of the heights is kept)
+        batch = []
+        for block in self.blocks:
+            if batch and (block[1] != batch[0][1] or len(batch) == self.batch_size):
+                yield batch[0][1], batch
+                batch = []
+            batch.append(block)
+        if batch:
+            yield batch[0][1], batch
+
+    def feed(self, block_queue):
+        """Decodes the blocks with a pool of processes and puts them in block_queue in height order, waiting whenever it is full."""
+        with ProcessPoolExecutor(max_workers=self.num_processors) as processors:
+            # batches are submitted in height order and consumed in the same order, at most max_pending_batches at a time,
+            # so when the engine is slower than the decoding, block_queue.put stops the submission of new batches
+            pending = deque()
+            for file, batch in self.batches():
+                if len(pending) >= self.max_pending_batches:
+                    for item in pending.popleft().result():
+                        block_queue.put(item)
+                pending.append(processors.submit(decode_blocks, self.dir_blocks, file, batch))
+
+            while pending:
+                for item in pending.popleft().result():
+                    block_queue.put(item)
@@ -1,7 +1,11 @@
+import os
 import struct
+import numpy as np
 
 BLOCK_HAVE_DATA = 8
 BLOCK_HAVE_UNDO = 16
+# entries without undo data more than FINAL_DEPTH blocks below the highest block with undo data are not refreshed anymore
+FINAL_DEPTH = 100
 
 def _read_varint(raw_hex):
     """
@@ -59,4 +63,133 @@ def block_index(blk_hash, raw_hex):
     prev_hash = format_hash(p)
     merkle_root = format_hash(m)
 
-    return (height, file, data_pos, undo_pos)
\ No newline at end of file
+    return (height, file, data_pos, undo_pos)
+
+# -------------------------------------------------------
+# Block index cache
+# -------------------------------------------------------
+
+# one record per block index entry, sorted by height
+BLOCK_INDEX_DTYPE = np.dtype([
+    ('height', '<i8'),
+    ('file', '<i8'),
+    ('data_pos', '<i8'),
+    ('undo_pos', '<i8'),
+    ('hash', 'S32'),  # key of the entry in the leveldb (without the 'b' prefix)
+    ('prev_hash', 'S32'),  # previous block hash as stored in the header (same byte order as hash)
+])
+
+def _read_file_info_last_height(raw_hex):
+    # CBlockFileInfo: nBlocks, nSize, nUndoSize, nHeightFirst, nHeightLast, nTimeFirst, nTimeLast
+    pos = 0
+    for _ in range(4):
+        _, i = _read_varint(raw_hex[pos:])
+        pos += i
+    height_last, _ = _read_varint(raw_hex[pos:])
+    return height_last
+
+def indexed_tip_height(db):
+    """Returns the highest height stored in the blk*.dat files according to the block file information, None if not available."""
+    last_file = db.get(b'l')
+    if last_file is None:
+        return None
+    last_file = struct.unpack('<i', last_file)[0]
+
+    tip_height = None
+    # heights are not strictly increasing across files (blocks may be downloaded out of order), so the last files are all checked
+    for file in range(max(last_file - 2, 0), last_file + 1):
+        raw_hex = db.get(b'f' + struct.pack('<i', file))
+        if raw_hex is not None:
+            height_last = _read_file_info_last_height(raw_hex)
+            if tip_height is None or height_last > tip_height:
+                tip_height = height_last
+
+    return tip_height
+
+def load_block_index_cache(cache_path):
+    if os.path.exists(cache_path):
+        block_indexes = np.load(cache_path, allow_pickle=False)
+        # caches written with a different layout are rebuilt from scratch
+        if block_indexes.dtype == BLOCK_INDEX_DTYPE:
+            return block_indexes
+    return np.empty(0, dtype=BLOCK_INDEX_DTYPE)
+
+def save_block_index_cache(cache_path, block_indexes):
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    # the cache is first written to a temporary file, so that an interrupted run never leaves a truncated cache
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, block_indexes)
+    os.replace(tmp_path, cache_path)
+
+def update_block_index(db, cache_path):
+    """
+    Returns all the block index entries (as a BLOCK_INDEX_DTYPE array sorted by height).
+    Only the entries that are not already in the cache (or whose undo data was not yet available near the tip) are decoded,
+    and the leveldb is not scanned at all if the cache already contains the tip.
+    """
+    cached = load_block_index_cache(cache_path)
+
+    # entries without undo data may still be completed by the node while they are near the tip, so they are refreshed,
+    # the deeper ones (stale branches, pruned blocks) are never completed, since blocks are connected in height order
+    with_undo = cached['undo_pos'] != -1
+    undo_tip = cached['height'][with_undo].max() if np.any(with_undo) else -1
+    complete = cached[with_undo | (cached['height'] < undo_tip - FINAL_DEPTH)]
+
+    tip_height = indexed_tip_height(db)
+    if len(complete) > 0 and tip_height is not None and len(complete) == len(cached) and complete['height'][-1] >= tip_height:
+        return cached
+
+    known_hashes = set(complete['hash'].tolist())
+
+    new_entries = []
+    # only the keys are iterated, values are read just for the new entries
+    with db.iterator(prefix=b'b', include_value=False) as iterator:
+        for k in iterator:
+            blk_hash = k[1:]
+            # NumPy strips the trailing null bytes of 'S' values (and block hashes end with zeros in this byte order)
+            if blk_hash.rstrip(b'\x00') not in known_hashes:
+                raw_hex = db.get(k)
+                height, file, data_pos, undo_pos = block_index(format_hash(blk_hash), raw_hex)
+                # the header is stored in the last 80 bytes: version (4 bytes), previous block hash (32 bytes), ...
+                new_entries.append((height, file, data_pos, undo_pos, blk_hash, raw_hex[-76:-44]))
+
+    block_indexes = np.concatenate((complete, np.array(new_entries, dtype=BLOCK_INDEX_DTYPE)))
+    block_indexes = block_indexes[np.argsort(block_indexes['height'], kind='stable')]
+
+    save_block_index_cache(cache_path, block_indexes)
+
+    return block_indexes
+
+def blocks_in_range(block_indexes, start_height, end_height=None):
+    """Returns the (height, file, data_pos, undo_pos) tuples of the blocks with start_height <= height <= end_height."""
+    heights = block_indexes['height']
+    # block_indexes is sorted by height, so the boundaries are found by binary search
+    start = np.searchsorted(heights, start_height, side='left')
+    end = len(heights) if end_height is None else np.searchsorted(heights, end_height, side='right')
+
+    selected = block_indexes[start:end]
+    return list(zip(selected['height'].tolist(), selected['file'].tolist(), selected['data_pos'].tolist(), selected['undo_pos'].tolist()))
+
+def main_chain_blocks(block_indexes, start_height):
+    """
+    Returns the (height, file, data_pos, undo_pos) tuples of the blocks from start_height up to the highest block with undo data,
+    following the previous block hashes, so that blocks of stale branches are left out.
+    """
+    start = np.searchsorted(block_indexes['height'], start_height, side='left')
+    candidates = block_indexes[start:]
+    # only blocks whose undo data is available can be merged with their inputs
+    candidates = candidates[candidates['undo_pos'] != -1]
+    if len(candidates) == 0:
+        return []
+
+    by_hash = {candidate['hash']: candidate for candidate in candidates}
+
+    chain = []
+    entry = candidates[-1]
+    while entry is not None:
+        chain.append((int(entry['height']), int(entry['file']), int(entry['data_pos']), int(entry['undo_pos'])))
+        entry = by_hash.get(entry['prev_hash'])
+    chain.reverse()
+
+    return chain
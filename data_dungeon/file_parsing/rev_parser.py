@@ -2,11 +2,21 @@ import struct
 import mmap
 from utils.utils import decode_varint, decode_compactsize, decompress_txout_amt, p2pkh_to_address, p2sh_to_address
 from utils.parse_transaction_output import parse_transaction_output
-from utils.address_conversion import input_script_to_addr
 
 NSPECIALSCRIPTS = 6
 # Constant separating blocks in the .blk files
 BITCOIN_CONSTANT = b"\xf9\xbe\xb4\xd9"
+# Prime of the field of secp256k1, used to recover the uncompressed public keys of P2PK scripts
+SECP256K1_P = 2**256 - 2**32 - 977
+
+def decompress_public_key(prefix, x):
+    # the points of secp256k1 satisfy y^2 = x^3 + 7 (mod p), the parity of y is given by the prefix (2 even, 3 odd)
+    # since p % 4 == 3, the square root is computed as (x^3 + 7)^((p + 1) / 4)
+    x_int = int.from_bytes(x, 'big')
+    y = pow((pow(x_int, 3, SECP256K1_P) + 7) % SECP256K1_P, (SECP256K1_P + 1) // 4, SECP256K1_P)
+    if y % 2 != prefix % 2:
+        y = SECP256K1_P - y
+    return b'\x04' + bytes(x) + y.to_bytes(32, 'big')
 
 def decompress_script(raw_hex):
     script_type = raw_hex[0]
@@ -33,28 +43,29 @@ def decompress_script(raw_hex):
         address = p2sh_to_address(compressed_script)
 
     elif script_type in [2, 3]:
-        if len(compressed_script) != 33:
+        if len(compressed_script) != 32:
             print('Compressed script has wrong size:')
             print(f'actual size: {len(compressed_script)}')
-            print('expected size: 33')
+            print('expected size: 32')
             return None, None
+        # P2PK outputs are referenced by their script, as blk_parser does for their receivers
         script_type_str = 'P2PK'
-        address = input_script_to_addr('P2PKH Input', compressed_script)
-        
+        address = (b'\x21' + bytes([script_type]) + compressed_script + b'\xac').hex()
+
     elif script_type in [4, 5]:
-        if len(compressed_script) != 33:
+        if len(compressed_script) != 32:
             print('Compressed script has wrong size:')
             print(f'actual size: {len(compressed_script)}')
-            print('expected size: 33')
+            print('expected size: 32')
             return None, None
-        prefix = format(script_type - 2, '02')
-        compressed_script = prefix + compressed_script[2:]
-
+        # the script contained the uncompressed public key, whose y coordinate has to be recovered
         script_type_str = 'P2PK'
-        address = input_script_to_addr('P2PKH Input', compressed_script)
-    
+        address = (b'\x41' + decompress_public_key(script_type - 2, compressed_script) + b'\xac').hex()
+
     else:
-        compressed_script = compressed_script.hex()
+        # the size of the script (plus NSPECIALSCRIPTS) is a varint, which takes more than one byte for long scripts
+        _, script_start = decode_varint(raw_hex, 0)
+        compressed_script = raw_hex[script_start:].hex()
         script_type_str, address = parse_transaction_output(compressed_script)
 
     if isinstance(address, bytes):
@@ -64,35 +75,37 @@ def decompress_script(raw_hex):
 
     return script_type_str, address
 
-def block_undo(raw_hex):
+def block_undo(raw_hex, pos=0):
+    """Decodes the undo data starting at pos of raw_hex (bytes, mmap or memoryview) without copying it."""
+    with memoryview(raw_hex) as buffer:
+        return _block_undo(buffer, pos)
+
+def _block_undo(buffer, pos):
     spends = []
     # num_txs is the actual number of transactions inside the block
-    # pos is the bytes read by decode_compactsize
-    num_txs, pos = decode_compactsize(raw_hex)
+    # pos is moved after the bytes read by decode_compactsize
+    num_txs, pos = decode_compactsize(buffer, pos)
     for i in range(num_txs):
-        txn, tx_len = spent_transaction(raw_hex=raw_hex[pos:])
+        txn, pos = spent_transaction(buffer, pos)
         spends.append(txn)
-        pos += tx_len
 
     return spends
 
-def spent_transaction(raw_hex):
+def spent_transaction(buffer, pos):
+    """Decodes the spent outputs of the transaction starting at pos, returns them together with the position of the following byte."""
     outputs = []
-    # output_len is the length of the output
-    output_len, pos = decode_compactsize(raw_hex)
+    # output_len is the number of outputs
+    output_len, pos = decode_compactsize(buffer, pos)
     for i in range(output_len):
-        output, output_len = spent_output(raw_hex=raw_hex[pos:])
+        output, pos = spent_output(buffer, pos)
         outputs.append(output)
-        pos += output_len
-    tx_len = pos
-
-    return outputs, tx_len
 
-def spent_output(raw_hex):
-    pos = 0
+    return outputs, pos
 
+def spent_output(buffer, pos):
+    """Decodes the spent output starting at pos, returns it together with the position of the following byte."""
     # decode height code
-    height_code, height_code_len = decode_varint(raw_hex[pos:])
+    height_code, pos = decode_varint(buffer, pos)
     if height_code % 2 == 1:
         is_coinbase = True
         height_code -= 1
@@ -101,17 +114,15 @@ def spent_output(raw_hex):
     height = height_code // 2
 
     # skip byte reserved only for backwards compatibility, should always be 0x00
-    pos += height_code_len + 1
+    pos += 1
 
     # decode compressed txout amount
-    compressed_amt, compressed_amt_len = decode_varint(raw_hex[pos:])
+    compressed_amt, pos = decode_varint(buffer, pos)
     amt = decompress_txout_amt(compressed_amt)
-    pos += compressed_amt_len
 
-    script_hex, script_pub_key_compressed_len = extract_from_hex(raw_hex[pos:])
-    script_hex_len = len(script_hex)
-    script_type, address = decompress_script(script_hex)
-    output_len = pos + script_hex_len
+    script_end = extract_from_hex(buffer, pos)
+    # only the (compressed) script is copied
+    script_type, address = decompress_script(bytes(buffer[pos:script_end]))
 
     output = {
         'Address': address,
@@ -119,36 +130,95 @@ def spent_output(raw_hex):
         'Amount': amt,
         # 'Height': height
     }
-    return output, output_len
-
-def extract_from_hex(raw_hex):
-    if raw_hex[0] in (0x00, 0x01):
-        return (raw_hex[:21], 21)
-    elif raw_hex[0] in (0x02, 0x03):
-        return (raw_hex[:33], 33)
-    elif raw_hex[0] in (0x04, 0x05):
-        return (raw_hex[:33], 33)
+    return output, script_end
+
+def extract_from_hex(buffer, pos):
+    """Returns the position of the byte following the compressed script starting at pos."""
+    if buffer[pos] in (0x00, 0x01):
+        return pos + 21
+    elif buffer[pos] in (0x02, 0x03):
+        return pos + 33
+    elif buffer[pos] in (0x04, 0x05):
+        return pos + 33
     else:
-        script_len_code, script_len_code_len = decode_varint(raw_hex)
+        script_len_code, script_start = decode_varint(buffer, pos)
         real_script_len = script_len_code - NSPECIALSCRIPTS
-        return (raw_hex[:script_len_code_len+real_script_len], real_script_len)
+        return script_start + real_script_len
 
-def get_block(blockfile, start_pos=0):
+def _find_undo_block(raw_data, start_pos):
+    # returns the position and the size of the undo data of the block starting at start_pos, None if there are no more blocks
     pos = start_pos
+    length = len(raw_data)
+    magic_number = ''
+    while magic_number != BITCOIN_CONSTANT:
+        if pos + 4 > length:
+            return None
+        magic_number = raw_data[pos:pos+4]
+        pos += 4
+        
+    # size of the block (4 bytes)
+    size = struct.unpack_from("<I", raw_data, pos)[0]
+    return pos + 4, size
+
+def read_undo_block(raw_data, start_pos=0):
+    """Returns the undo data of the block starting at start_pos of an already mapped rev*.dat file."""
+    found = _find_undo_block(raw_data, start_pos)
+    if found is None:
+        return None
+    pos, size = found
+    return raw_data[pos:pos+size]
+
+def parse_undo_block(mmap_obj, start_pos=0):
+    """Decodes the undo data of the block starting at start_pos of an already mapped rev*.dat file, reading it in place."""
+    with memoryview(mmap_obj) as buffer:
+        found = _find_undo_block(buffer, start_pos)
+        if found is None:
+            return None
+        return _block_undo(buffer, found[0])
+
+# -------------------------------------------------------
+# Two-pass decoding (used for very large blocks)
+# -------------------------------------------------------
+
+def skip_spent_transaction(buffer, pos):
+    """Returns the position of the byte following the spent outputs of the transaction starting at pos, without decoding them."""
+    output_len, pos = decode_compactsize(buffer, pos)
+    for i in range(output_len):
+        # height code, reserved byte, compressed amount, compressed script
+        _, pos = decode_varint(buffer, pos)
+        _, pos = decode_varint(buffer, pos + 1)
+        pos = extract_from_hex(buffer, pos)
+
+    return pos
+
+def undo_transaction_offsets(mmap_obj, start_pos=0):
+    """First pass: returns the position of the spent outputs of each transaction in the undo data of the block starting at start_pos."""
+    with memoryview(mmap_obj) as buffer:
+        found = _find_undo_block(buffer, start_pos)
+        if found is None:
+            return None
+
+        num_txs, pos = decode_compactsize(buffer, found[0])
+        offsets = [pos]
+        for i in range(num_txs):
+            pos = skip_spent_transaction(buffer, pos)
+            offsets.append(pos)
+
+    return offsets
+
+def parse_undo_range(mmap_obj, start_pos, count):
+    """Second pass: decodes the spent outputs of count consecutive transactions starting at start_pos."""
+    with memoryview(mmap_obj) as buffer:
+        spends = []
+        pos = start_pos
+        for i in range(count):
+            txn, pos = spent_transaction(buffer, pos)
+            spends.append(txn)
 
+    return spends
+
+def get_block(blockfile, start_pos=0):
     with open(blockfile, "rb") as f:
         # mmap.mmap is a way to access large files without loading them into memory as they were byte arrays
-        raw_data = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
-        length = len(raw_data)
-        magic_number = ''
-        while magic_number != BITCOIN_CONSTANT:
-            magic_number = raw_data[pos:pos+4]
-            pos += 4
-            if magic_number == None:
-                return None                
-            
-        # size of the block (4 bytes)
-        size = struct.unpack("<I", raw_data[pos:pos+4])[0]
-        # go to the next block (skip both size of the block (4 bytes) and the actual size of it)
-        pos += 4 + size
-        return raw_data[pos-size:pos]
\ No newline at end of file
+        with mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ) as raw_data:
+            return read_undo_block(raw_data, start_pos)
@@ -1,5 +1,7 @@
+import os
 import numpy as np
 from database import accounts_database as ad
+from storage.address_table import find_address_ids
 from wealth_metrics.gini_coefficient import gini
 from wealth_metrics.nakamoto_coefficient import nakamoto
 
@@ -33,11 +35,17 @@ def main():
     minimum = 100000
     maximum = 2100000000000000
 
-    conn = ad.create_connection()
+    # accounts stored by address id (see storage/address_table.py) are used if available
+    if os.path.exists(ad.ADDRESS_IDS_DB_NAME):
+        conn = ad.create_connection(ad.ADDRESS_IDS_DB_NAME)
+        excluded_wallets = set(find_address_ids(known_wallets).values())
+    else:
+        conn = ad.create_connection()
+        excluded_wallets = known_wallets
 
     eligible_balances_list = []
     for address, balance in ad.retrieve_eligible_accounts(conn, minimum, maximum):
-        if address not in known_wallets:
+        if address not in excluded_wallets:
             eligible_balances_list.append(balance)
 
     eligible_balances = np.array(eligible_balances_list)
@@ -1,6 +1,6 @@
 from wealth_metrics.gini_coefficient import gini
 from wealth_metrics.nakamoto_coefficient import nakamoto
-from utils import read_redistribution_csv_file, read_multi_input_redistribution_csv_file
+from result_utils import read_redistribution_csv_file, read_multi_input_redistribution_csv_file
 
 metric_type = 'normal'
 address_grouping = 'single_input'
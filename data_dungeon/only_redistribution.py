@@ -1,9 +1,18 @@
 import yaml
+from storage.block_archive import BlockArchive
+from storage.block_deltas import BlockDeltas, DELTA_REDISTRIBUTION_TYPES
 from only_redistribution_space.only_redistribution_paradise import only_redistribution_paradise
 from only_redistribution_space.multi_input_only_redistribution_paradise import multi_input_only_redistribution_paradise
 
 dir_sorted_blocks = './result/blocks/' # Directory where sorted blocks are saved
+dir_archive_blocks = './result/archive/' # Directory where the segments packed by data_main.py (PACK_BLOCKS) are stored
+dir_deltas = './result/deltas/' # Directory where the net amounts per address built by data_main.py (BUILD_DELTAS) are stored
 dir_results = './result/WorkstationResults' # Directory where to store the results
+STREAM_BLOCKS = False  # Flag to determine whether blocks should be decoded from the blk/rev files of the node (see data_main.py) while they are processed, instead of being read from dir_sorted_blocks
+USE_ARCHIVE = False  # Flag to determine whether blocks should be read from dir_archive_blocks instead of dir_sorted_blocks
+USE_DELTAS = False  # Flag to determine whether the net amounts per address of dir_deltas should be applied instead of the transactions of the blocks (single_input and DELTA_REDISTRIBUTION_TYPES only)
+first_block = 856003  # used by STREAM_BLOCKS, USE_ARCHIVE and USE_DELTAS: first block processed (the previous ones must be already included in the utxo)
+last_block = 866000  # used by STREAM_BLOCKS, USE_ARCHIVE and USE_DELTAS: last block processed (None to process all the blocks available)
 config_file = './data_dungeon/only_redistribution_space/config.yaml'
 
 def main():
@@ -20,10 +29,25 @@ def main():
     redistribution_maximum = cfg['redistribution']['to']['maximum']
     redistribution_user_percentage = cfg['redistribution']['to']['percentage']
 
+    if USE_DELTAS and addresses == 'multi_input':
+        raise ValueError('USE_DELTAS can only be used with single_input addresses')
+    if USE_DELTAS and redistribution_type not in DELTA_REDISTRIBUTION_TYPES:
+        raise ValueError(f'USE_DELTAS can only be used with the redistribution types {DELTA_REDISTRIBUTION_TYPES}')
+
+    block_stream = None
+    if STREAM_BLOCKS:
+        # data_main needs the LevelDB bindings (plyvel), which are not needed otherwise
+        from data_main import stream_blocks
+        block_stream = stream_blocks(first_block, last_block)
+    elif USE_ARCHIVE:
+        block_stream = BlockArchive(dir_archive_blocks, first_block, last_block)
+    elif USE_DELTAS:
+        block_stream = BlockDeltas(dir_deltas, first_block, last_block)
+
     if addresses == 'single_input':
-        only_redistribution_paradise(dir_sorted_blocks, dir_results, redistribution_type, redistribution_percentage, redistribution_amount, redistribution_minimum, redistribution_maximum, redistribution_user_percentage, extra_fee_amount, extra_fee_percentage)
+        only_redistribution_paradise(dir_sorted_blocks, dir_results, redistribution_type, redistribution_percentage, redistribution_amount, redistribution_minimum, redistribution_maximum, redistribution_user_percentage, extra_fee_amount, extra_fee_percentage, block_stream)
     elif addresses == 'multi_input':
-        multi_input_only_redistribution_paradise(dir_sorted_blocks, dir_results, redistribution_type, redistribution_percentage, redistribution_amount, redistribution_minimum, redistribution_maximum, redistribution_user_percentage, extra_fee_amount, extra_fee_percentage)
+        multi_input_only_redistribution_paradise(dir_sorted_blocks, dir_results, redistribution_type, redistribution_percentage, redistribution_amount, redistribution_minimum, redistribution_maximum, redistribution_user_percentage, extra_fee_amount, extra_fee_percentage, block_stream)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -4,7 +4,7 @@ from wealth_metrics.nakamoto_coefficient import nakamoto
 from wealth_metrics.charts import plot_gini_coefficient, plot_nakamoto_coefficient
 from only_redistribution_space.only_redistribution_paradise import only_redistribution_paradise
 from only_redistribution_space.multi_input_only_redistribution_paradise import multi_input_only_redistribution_paradise
-from utils import read_only_redistribution_csv_file
+from result_utils import read_only_redistribution_csv_file
 
 dir_sorted_blocks = './result/blocks/' # Directory where sorted blocks are saved
 dir_results = './result/WorkstationResults' # Directory where to store the results
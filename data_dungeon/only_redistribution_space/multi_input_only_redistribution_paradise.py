@@ -1,23 +1,20 @@
 import os
 import csv
 import queue
-import time
 import math
 import numpy_minmax
 import numpy as np
 from concurrent.futures import ThreadPoolExecutor, wait, as_completed
 from tqdm import tqdm
 from only_redistribution_space.utils import DictionaryDoubleList, DoubleDictionaryDoubleList, plot_balance_line
-from redistribution_space.utils import get_block, extract_height_from_name, distribute
-from database.multi_input_accounts_database import create_connection, retrieve_eligible_accounts, retrieve_non_eligible_accounts
+from redistribution_space.utils import list_block_files, blocks_use_address_ids, distribute
+from storage.block_prefetcher import BlockPrefetcher
+from storage.block_deltas import BlockDeltas
+from database.multi_input_accounts_database import create_connection, DB_NAME, ADDRESS_IDS_DB_NAME, retrieve_eligible_accounts, retrieve_non_eligible_accounts
 
 METRICS = True
 
-# number of readers for blocks
-num_readers = 2
-
 file_queue = queue.Queue(maxsize=10)
-lock = 0
 # index used to give a different number to all the new users discovered
 user_index = 0
 
@@ -425,32 +422,14 @@ def process_blocks(address_to_user, eligible_accounts, non_eligible_accounts,
 
     return eligible_accounts, non_eligible_accounts
 
-def read_files(files, thread_number, dir_sorted_blocks):
-    global file_queue
-    global lock
-
-    with tqdm(total=len(files) // num_readers, desc=f'Reader Thread {thread_number}') as reading_pbar:
-        for i in range(thread_number, len(files), num_readers):
-            height = extract_height_from_name(files[i])
-            path_file = os.path.join(dir_sorted_blocks, files[i])
-
-            block = get_block(path_file)
-
-            # wait until the previous block is inserted in the queue
-            while height - 1 != lock:
-                time.sleep(0.1)
-
-            file_queue.put((height, block))
-            
-            lock = height
-
-            reading_pbar.update(1)
-
-def multi_input_only_redistribution_paradise(dir_sorted_blocks, dir_results, redistribution_type, redistribution_percentage, redistribution_amount, redistribution_minimum, redistribution_maximum, redistribution_user_percentage, extra_fee_amount, extra_fee_percentage):
+def multi_input_only_redistribution_paradise(dir_sorted_blocks, dir_results, redistribution_type, redistribution_percentage, redistribution_amount, redistribution_minimum, redistribution_maximum, redistribution_user_percentage, extra_fee_amount, extra_fee_percentage, block_stream=None):
     global file_queue
-    global lock
     global user_index
 
+    # the deltas keep only the net amounts per address, not the transactions the multi-input simulations go through
+    if isinstance(block_stream, BlockDeltas):
+        raise ValueError('Block deltas cannot be used by the multi-input simulations')
+
     folder = f'{redistribution_minimum}_{redistribution_maximum}_{redistribution_user_percentage}_{extra_fee_amount}_{extra_fee_percentage}'
     dir_results_folder = os.path.join(dir_results, 'only_redistribution', 'multi_input', redistribution_type, redistribution_amount, folder)
     if not os.path.exists(dir_results_folder):
@@ -460,15 +439,18 @@ def multi_input_only_redistribution_paradise(dir_sorted_blocks, dir_results, red
 
     if not os.path.exists(path_accounts):
 
-        conn = create_connection()
-
-        files = os.listdir(dir_sorted_blocks)
-        files = [x for x in files if (x.endswith('.txt') and x.startswith('block_'))]
-        files.sort()
-        # delete the first 3 files (000, 001, 002) because the utxo has already them
-        files = files[3:]
+        if block_stream is None:
+            files = list_block_files(dir_sorted_blocks)
+            # blocks referencing addresses by id (see storage/address_table.py) need the accounts keyed by id
+            conn = create_connection(ADDRESS_IDS_DB_NAME if blocks_use_address_ids(dir_sorted_blocks, files) else DB_NAME)
+            # delete the first 3 files (000, 001, 002) because the utxo has already them
+            files = files[3:]
 
-        len_files = len(files)
+            len_files = len(files)
+        else:
+            # blocks decoded on the fly from blk*.dat and rev*.dat (see file_parsing/block_stream.py) or read from an archive (see storage/block_archive.py)
+            conn = create_connection(ADDRESS_IDS_DB_NAME if block_stream.uses_address_ids else DB_NAME)
+            len_files = len(block_stream)
 
         address_to_user = {}
 
@@ -526,13 +508,13 @@ def multi_input_only_redistribution_paradise(dir_sorted_blocks, dir_results, red
         # set the user_index to the identifier of the user with the highest number of eligible_balances + 1
         user_index = max(address_to_user.values()) + 1
 
-        # initialize the lock set to make the reader threads coordinate on the order of files
-        prev_height = extract_height_from_name(files[0]) - 1
-        lock = prev_height
+        # block files are decoded ahead of the processing by a pool of processes (see storage/block_prefetcher.py)
+        block_reader = BlockPrefetcher(dir_sorted_blocks, files) if block_stream is None else block_stream
 
-        with ThreadPoolExecutor(max_workers=num_readers) as readers, ThreadPoolExecutor(max_workers=1) as processors:
+        with ThreadPoolExecutor(max_workers=1) as readers, ThreadPoolExecutor(max_workers=1) as processors:
 
-            futures_readers = [readers.submit(read_files, files, i, dir_sorted_blocks) for i in range(num_readers)]
+            # a single producer puts the decoded blocks in the queue, already in height order
+            futures_readers = [readers.submit(block_reader.feed, file_queue)]
 
             futures_processors = [processors.submit(process_blocks, address_to_user, eligible_accounts, non_eligible_accounts, len_files, redistribution_minimum, redistribution_maximum, redistribution_percentage, redistribution_type, redistribution_amount, redistribution_user_percentage, extra_fee_amount, extra_fee_percentage)]
 
@@ -1,22 +1,19 @@
 import os
 import csv
 import queue
-import time
 import math
 import numpy as np
 from concurrent.futures import ThreadPoolExecutor, wait, as_completed
 from tqdm import tqdm
-from only_redistribution_space.utils import DictionaryDoubleList, DoubleDictionaryDoubleList, plot_balance_line
-from redistribution_space.utils import get_block, extract_height_from_name, distribute
-from database.accounts_database import create_connection, retrieve_eligible_accounts, retrieve_non_eligible_accounts
+from only_redistribution_space.utils import DictionaryDoubleList, DoubleDictionaryDoubleList, apply_delta_payments, plot_balance_line
+from redistribution_space.utils import list_block_files, blocks_use_address_ids, distribute, block_delta_payments
+from storage.block_prefetcher import BlockPrefetcher
+from storage.block_deltas import BlockDelta, BlockDeltas, DELTA_REDISTRIBUTION_TYPES
+from database.accounts_database import create_connection, DB_NAME, ADDRESS_IDS_DB_NAME, retrieve_eligible_accounts, retrieve_non_eligible_accounts
 
 METRICS = True
 
-# number of readers for blocks
-num_readers = 2
-
 file_queue = queue.Queue(maxsize=10)
-lock = 0
 
 def perform_input_output(address, payment, input_output, 
                          eligible_accounts, non_eligible_accounts,
@@ -84,6 +81,14 @@ def perform_block_transactions(eligible_accounts, non_eligible_accounts,
     # extra fee computed for each output if the fee is a percentage
     extra_fee_percentage_per_output = 0
 
+    # blocks collapsed by storage/block_deltas.py: a single update for each address touched by the block
+    if isinstance(block, BlockDelta):
+        addresses, payments, total_extra_fee_percentage = block_delta_payments(block, extra_fee_amount, extra_fee_percentage)
+        eligible_accounts, non_eligible_accounts = apply_delta_payments(
+            eligible_accounts, non_eligible_accounts, addresses, payments, redistribution_minimum, redistribution_maximum)
+
+        return eligible_accounts, non_eligible_accounts, total_extra_fee_percentage
+
     for index, transaction in enumerate(block['Transactions']):
         # skip coinbase transaction
         if index == 0:
@@ -406,30 +411,12 @@ def process_blocks(eligible_accounts, non_eligible_accounts,
 
     return eligible_accounts, non_eligible_accounts
 
-def read_files(files, thread_number, dir_sorted_blocks):
+def only_redistribution_paradise(dir_sorted_blocks, dir_results, redistribution_type, redistribution_percentage, redistribution_amount, redistribution_minimum, redistribution_maximum, redistribution_user_percentage, extra_fee_amount, extra_fee_percentage, block_stream=None):
     global file_queue
-    global lock
-
-    with tqdm(total=len(files) // num_readers, desc=f'Reader Thread {thread_number}') as reading_pbar:
-        for i in range(thread_number, len(files), num_readers):
-            height = extract_height_from_name(files[i])
-            path_file = os.path.join(dir_sorted_blocks, files[i])
-
-            block = get_block(path_file)
-
-            # wait until the previous block is inserted in the queue
-            while height - 1 != lock:
-                time.sleep(0.1)
 
-            file_queue.put((height, block))
-            
-            lock = height
-
-            reading_pbar.update(1)
-
-def only_redistribution_paradise(dir_sorted_blocks, dir_results, redistribution_type, redistribution_percentage, redistribution_amount, redistribution_minimum, redistribution_maximum, redistribution_user_percentage, extra_fee_amount, extra_fee_percentage):
-    global file_queue
-    global lock
+    # the deltas keep only the net amounts per address, the other redistributions depend on the slots the accounts take within a block
+    if isinstance(block_stream, BlockDeltas) and redistribution_type not in DELTA_REDISTRIBUTION_TYPES:
+        raise ValueError(f'Block deltas can only be used with the redistribution types {DELTA_REDISTRIBUTION_TYPES}')
 
     folder = f'{redistribution_minimum}_{redistribution_maximum}_{redistribution_user_percentage}_{extra_fee_amount}_{extra_fee_percentage}'
     dir_results_folder = os.path.join(dir_results, 'only_redistribution', 'single_input', redistribution_type, redistribution_amount, folder)
@@ -440,15 +427,18 @@ def only_redistribution_paradise(dir_sorted_blocks, dir_results, redistribution_
 
     if not os.path.exists(path_accounts):
 
-        conn = create_connection()
-
-        files = os.listdir(dir_sorted_blocks)
-        files = [x for x in files if (x.endswith('.txt') and x.startswith('block_'))]
-        files.sort()
-        # delete the first 3 files (000, 001, 002) because the utxo has already them
-        files = files[3:]
+        if block_stream is None:
+            files = list_block_files(dir_sorted_blocks)
+            # blocks referencing addresses by id (see storage/address_table.py) need the accounts keyed by id
+            conn = create_connection(ADDRESS_IDS_DB_NAME if blocks_use_address_ids(dir_sorted_blocks, files) else DB_NAME)
+            # delete the first 3 files (000, 001, 002) because the utxo has already them
+            files = files[3:]
 
-        len_files = len(files)
+            len_files = len(files)
+        else:
+            # blocks decoded on the fly from blk*.dat and rev*.dat (see file_parsing/block_stream.py) or read from an archive (see storage/block_archive.py)
+            conn = create_connection(ADDRESS_IDS_DB_NAME if block_stream.uses_address_ids else DB_NAME)
+            len_files = len(block_stream)
 
         def retrieve_eligible_accounts_object(conn, redistribution_minimum, redistribution_maximum):
             print('Retrieving eligible accounts from database...')
@@ -494,13 +484,13 @@ def only_redistribution_paradise(dir_sorted_blocks, dir_results, redistribution_
 
         non_eligible_accounts = retrieve_non_eligible_accounts_object(conn, redistribution_minimum, redistribution_maximum)
 
-        # initialize the lock set to make the reader threads coordinate on the order of files
-        prev_height = extract_height_from_name(files[0]) - 1
-        lock = prev_height
+        # block files are decoded ahead of the processing by a pool of processes (see storage/block_prefetcher.py)
+        block_reader = BlockPrefetcher(dir_sorted_blocks, files) if block_stream is None else block_stream
 
-        with ThreadPoolExecutor(max_workers=num_readers) as readers, ThreadPoolExecutor(max_workers=1) as processors:
+        with ThreadPoolExecutor(max_workers=1) as readers, ThreadPoolExecutor(max_workers=1) as processors:
 
-            futures_readers = [readers.submit(read_files, files, i, dir_sorted_blocks) for i in range(num_readers)]
+            # a single producer puts the decoded blocks in the queue, already in height order
+            futures_readers = [readers.submit(block_reader.feed, file_queue)]
 
             futures_processors = [processors.submit(process_blocks, eligible_accounts, non_eligible_accounts, len_files, redistribution_minimum, redistribution_maximum, redistribution_percentage, redistribution_type, redistribution_amount, redistribution_user_percentage, extra_fee_amount, extra_fee_percentage)]
 
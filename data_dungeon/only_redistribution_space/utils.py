@@ -59,6 +59,15 @@ class DictionaryDoubleList:
         else:
             self.first_list[index] = balance
 
+    def update_balances(self, addresses, balances):
+        indices = np.array([self.dictionary[address] for address in addresses], dtype=np.int64)
+        balances = np.asarray(balances)
+        # balances of the elements still to be added are updated one at a time
+        stored = indices < self.len_first_list
+        self.first_list[indices[stored]] = balances[stored]
+        for index, balance in zip(indices[~stored].tolist(), balances[~stored].tolist()):
+            self.elements_to_add_first_list[index - self.len_first_list] = balance
+
     def update_redistribution(self, address, redistribution):
         index = self.dictionary[address]
         
@@ -163,6 +172,15 @@ class DoubleDictionaryDoubleList:
         else:
             self.first_list[index] = balance
 
+    def update_balances(self, addresses, balances):
+        indices = np.array([self.dictionary[address] for address in addresses], dtype=np.int64)
+        balances = np.asarray(balances)
+        # balances of the elements still to be added are updated one at a time
+        stored = indices < self.len_first_list
+        self.first_list[indices[stored]] = balances[stored]
+        for index, balance in zip(indices[~stored].tolist(), balances[~stored].tolist()):
+            self.elements_to_add_first_list[index - self.len_first_list] = balance
+
     def update_redistribution(self, address, redistribution):
         index = self.dictionary[address]
         
@@ -205,6 +223,52 @@ class DoubleDictionaryDoubleList:
 
         return redistribution
     
+def apply_delta_payments(eligible_accounts, non_eligible_accounts, addresses, payments, redistribution_minimum, redistribution_maximum):
+    """
+    Adds the payments returned by block_delta_payments (one for each address) to the accounts, with the same result of perform_input_output:
+    the balances of the addresses staying in the same accounts are updated at once, the others are moved (with their redistribution) in their order.
+    """
+    if len(addresses) == 0:
+        return eligible_accounts, non_eligible_accounts
+
+    # balance before the block and state of each address: 2 eligible, 1 non eligible, 0 never seen
+    initial_balances = []
+    states = np.zeros(len(addresses), dtype=np.int8)
+    for position, address in enumerate(addresses):
+        if eligible_accounts.contains_key(address):
+            initial_balances.append(eligible_accounts.get_balance(address))
+            states[position] = 2
+        elif non_eligible_accounts.contains_key(address):
+            initial_balances.append(non_eligible_accounts.get_balance(address))
+            states[position] = 1
+        else:
+            initial_balances.append(0)
+
+    balances = np.asarray(initial_balances) + payments
+    eligible_after = (redistribution_minimum <= balances) & (balances <= redistribution_maximum)
+
+    stay_eligible = (states == 2) & eligible_after
+    stay_non_eligible = (states == 1) & ~eligible_after
+    eligible_accounts.update_balances([addresses[position] for position in np.flatnonzero(stay_eligible).tolist()], balances[stay_eligible])
+    non_eligible_accounts.update_balances([addresses[position] for position in np.flatnonzero(stay_non_eligible).tolist()], balances[stay_non_eligible])
+
+    balances = balances.tolist()
+    for position in np.flatnonzero(~(stay_eligible | stay_non_eligible)).tolist():
+        address, balance = addresses[position], balances[position]
+        # the redistribution up until now follows the address
+        redistribution = 0
+        if states[position] == 2:
+            _, redistribution = eligible_accounts.remove(address)
+        elif states[position] == 1:
+            _, redistribution = non_eligible_accounts.remove(address)
+
+        if eligible_after[position]:
+            eligible_accounts.add(address, balance, redistribution)
+        else:
+            non_eligible_accounts.add(address, balance, redistribution)
+
+    return eligible_accounts, non_eligible_accounts
+
 def _process_redistribution_chunk(chunk):
     local_redistributions = []
 
@@ -2,7 +2,7 @@ import os
 from wealth_metrics.gini_coefficient import gini
 from wealth_metrics.nakamoto_coefficient import nakamoto
 from wealth_metrics.charts import plot_multiple_gini_coefficients, plot_multiple_nakamoto_coefficients
-from utils import read_redistribution_csv_file
+from result_utils import read_redistribution_csv_file
 
 dir_results = './result/WorkstationResults' # Directory where to store the results
 
@@ -6,7 +6,7 @@ from redistribution_space.redistribution_paradise import redistribution_paradise
 from redistribution_space.no_redistribution import no_redistribution
 from redistribution_space.multi_input_no_redistribution import multi_input_no_redistribution
 from redistribution_space.multi_input_redistribution_paradise import multi_input_redistribution_paradise
-from utils import read_redistribution_csv_file, read_multi_input_redistribution_csv_file
+from result_utils import read_redistribution_csv_file, read_multi_input_redistribution_csv_file
 
 dir_sorted_blocks = './result/blocks/' # Directory where sorted blocks are saved
 dir_results = './result/WorkstationResults' # Directory where to store the results
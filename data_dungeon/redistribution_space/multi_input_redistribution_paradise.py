@@ -1,22 +1,25 @@
 import os
 import csv
 import queue
-import time
 import math
 import numpy_minmax
 import numpy as np
 from concurrent.futures import ThreadPoolExecutor, wait, as_completed
 from tqdm import tqdm
-from redistribution_space.utils import DoubleDictionaryList, get_block, extract_height_from_name, distribute, plot_balance_histogram, plot_linear_redistribution_histogram, plot_weight_based_metrics, plot_almost_equal_metrics
-from database.multi_input_accounts_database import create_connection, retrieve_eligible_accounts, retrieve_non_eligible_accounts
+from redistribution_space.utils import AccountStore, LazyAccountStore, WeightedAccountStore, LAZY_REDISTRIBUTION_TYPES, lazy_redistribution, list_block_files, blocks_use_address_ids, distribute, block_operations, apply_block_operations, plot_balance_histogram, plot_linear_redistribution_histogram, plot_weight_based_metrics, plot_almost_equal_metrics
+from storage.block_prefetcher import BlockPrefetcher
+from storage.block_deltas import BlockDeltas
+from database.multi_input_accounts_database import create_connection, DB_NAME, ADDRESS_IDS_DB_NAME, retrieve_eligible_accounts, retrieve_non_eligible_accounts
 
 METRICS = False
-
-# number of readers for blocks
-num_readers = 2
+# Flag to credit equal-style redistributions lazily (see redistribution_space/utils.py LazyAccountStore)
+LAZY_REDISTRIBUTION = True
+# Flag to credit weight_based redistributions incrementally, with all the balances resynchronized every WEIGHT_BASED_RESYNC_INTERVAL blocks
+# (the balances differ slightly from those of weight_based, see redistribution_space/utils.py WeightedAccountStore)
+INCREMENTAL_WEIGHT_BASED = False
+WEIGHT_BASED_RESYNC_INTERVAL = 100
 
 file_queue = queue.Queue(maxsize=10)
-lock = 0
 # index used to give a different number to all the new users discovered
 user_index = 0
 
@@ -89,11 +92,31 @@ def perform_input_output(address, payment, input_output,
 
 def perform_block_transactions(address_to_user, eligible_accounts, non_eligible_accounts, 
                                redistribution_minimum, redistribution_maximum, block, extra_fee_amount, extra_fee_percentage):
+    global user_index
 
     total_extra_fee_percentage = 0
     # extra fee computed for each output if the fee is a percentage
     extra_fee_percentage_per_output = 0
 
+    # integer balances are updated for the whole block at once, float balances depend on the order of the additions
+    if eligible_accounts.balances.dtype.kind != 'f':
+        codes, addresses, amounts, total_extra_fee_percentage = block_operations(block, extra_fee_amount, extra_fee_percentage)
+
+        # addresses never seen become new users in the order of their first operation, as in perform_input_output
+        first_operations = np.full(len(addresses), len(codes))
+        np.minimum.at(first_operations, codes, np.arange(len(codes)))
+        for code in np.argsort(first_operations, kind='stable').tolist():
+            if addresses[code] not in address_to_user:
+                address_to_user[addresses[code]] = user_index
+                user_index += 1
+
+        # the operations of addresses of the same user are applied to the same account
+        users, user_codes = np.unique(np.array([address_to_user[address] for address in addresses], dtype=np.int64), return_inverse=True)
+        eligible_accounts, non_eligible_accounts = apply_block_operations(
+            eligible_accounts, non_eligible_accounts, user_codes[codes], users.tolist(), amounts, redistribution_minimum, redistribution_maximum)
+
+        return address_to_user, eligible_accounts, non_eligible_accounts, total_extra_fee_percentage
+
     for index, transaction in enumerate(block['Transactions']):
         # skip coinbase transaction
         if index == 0:
@@ -193,16 +216,35 @@ def perform_redistribution(redistribution_type, redistribution_amount, redistrib
     
     eligible_accounts.perform_addition()
 
-    eligible_balances = eligible_accounts.list
-    invalid_eligible_balances = eligible_accounts.invalid_elements
+    # the redistribution is credited to all the users at once, the balances are settled only when they are read (see LazyAccountStore and WeightedAccountStore)
+    if isinstance(eligible_accounts, (LazyAccountStore, WeightedAccountStore)):
+        if isinstance(eligible_accounts, LazyAccountStore):
+            block_redistribution, max_block_redistribution, redistribution_extra_fee, circular_queue_index = lazy_redistribution(
+                eligible_accounts, redistribution_type, max_redistribution, max_block_redistribution, total_extra_fee, circular_queue_index)
+        else:
+            # the metrics go through all the balances, they are computed only if they are kept
+            if METRICS:
+                block_redistribution = eligible_accounts.redistribution_metrics(max_redistribution)
+            eligible_accounts.redistribute(max_redistribution)
+            redistribution_extra_fee = total_extra_fee
+        if METRICS:
+            redistribution[number_of_file] = block_redistribution
+
+        # it cannot happen that an account becomes non-eligible through redistribution by having a balance lower than the minimum
+        for address in eligible_accounts.accounts_above(redistribution_maximum):
+            balance = eligible_accounts.remove(address)
+            non_eligible_accounts[address] = balance
 
-    len_eligible_balances = len(eligible_balances)
+        remaining_from_extra_fee = total_extra_fee - redistribution_extra_fee
 
-    # mask array to select only the valid balances (not all of them are valid)
-    mask = np.ones(len_eligible_balances, dtype=bool)
-    mask[invalid_eligible_balances] = False
+        return redistribution, eligible_accounts, non_eligible_accounts, max_block_redistribution, remaining_from_extra_fee, circular_queue_index
 
-    num_users = len_eligible_balances - len(invalid_eligible_balances)
+    eligible_balances = eligible_accounts.list
+
+    # mask array to select only the valid balances (not all of them are valid), kept up to date by the account store
+    mask = eligible_accounts.valid_mask()
+
+    num_users = eligible_accounts.num_users
     # if the percentage of users is less than 100%, then update the mask to exclude the top (1 - redistribution_user_percentage)%
     if redistribution_user_percentage < 1.0:
         valid_balances = eligible_balances[mask]
@@ -213,7 +255,10 @@ def perform_redistribution(redistribution_type, redistribution_amount, redistrib
 
         num_users = np.count_nonzero(mask)
 
-    indices = np.flatnonzero(mask)
+        indices = np.flatnonzero(mask)
+    else:
+        # the positions of the valid balances are computed again only if some account has been added or removed
+        indices = eligible_accounts.valid_indices()
 
     if redistribution_type == 'equal':
 
@@ -403,36 +448,25 @@ def process_blocks(address_to_user, eligible_accounts, non_eligible_accounts, re
 
             file_queue.task_done()
 
+    # the units still in the pool of the incremental weight_based are given before the balances are written
+    if isinstance(eligible_accounts, WeightedAccountStore):
+        eligible_accounts.resync()
+        for address in eligible_accounts.accounts_above(redistribution_maximum):
+            balance = eligible_accounts.remove(address)
+            non_eligible_accounts[address] = balance
+
     eligible_accounts.perform_addition()
 
     return eligible_accounts, non_eligible_accounts, redistribution
 
-def read_files(files, thread_number, dir_sorted_blocks):
+def multi_input_redistribution_paradise(dir_sorted_blocks, dir_results, redistribution_type, redistribution_percentage, redistribution_amount, redistribution_minimum, redistribution_maximum, redistribution_user_percentage, extra_fee_amount, extra_fee_percentage, block_stream=None):
     global file_queue
-    global lock
-
-    with tqdm(total=len(files) // num_readers, desc=f'Reader Thread {thread_number}') as reading_pbar:
-        for i in range(thread_number, len(files), num_readers):
-            height = extract_height_from_name(files[i])
-            path_file = os.path.join(dir_sorted_blocks, files[i])
-
-            block = get_block(path_file)
-
-            # wait until the previous block is inserted in the queue
-            while height - 1 != lock:
-                time.sleep(0.1)
-
-            file_queue.put((height, block))
-            
-            lock = height
-
-            reading_pbar.update(1)
-
-def multi_input_redistribution_paradise(dir_sorted_blocks, dir_results, redistribution_type, redistribution_percentage, redistribution_amount, redistribution_minimum, redistribution_maximum, redistribution_user_percentage, extra_fee_amount, extra_fee_percentage):
-    global file_queue
-    global lock
     global user_index
 
+    # the deltas keep only the net amounts per address, not the transactions the multi-input simulations go through
+    if isinstance(block_stream, BlockDeltas):
+        raise ValueError('Block deltas cannot be used by the multi-input simulations')
+
     folder = f'{redistribution_minimum}_{redistribution_maximum}_{redistribution_user_percentage}_{extra_fee_amount}_{extra_fee_percentage}'
     dir_results_folder = os.path.join(dir_results, 'normal', 'multi_input', redistribution_type, redistribution_amount, folder)
     if not os.path.exists(dir_results_folder):
@@ -444,15 +478,18 @@ def multi_input_redistribution_paradise(dir_sorted_blocks, dir_results, redistri
 
     if not os.path.exists(path_accounts) or not os.path.exists(path_balances):
 
-        conn = create_connection()
+        if block_stream is None:
+            files = list_block_files(dir_sorted_blocks)
+            # blocks referencing addresses by id (see storage/address_table.py) need the accounts keyed by id
+            conn = create_connection(ADDRESS_IDS_DB_NAME if blocks_use_address_ids(dir_sorted_blocks, files) else DB_NAME)
+            # delete the first 3 files (000, 001, 002) because the utxo has already them
+            files = files[3:]
 
-        files = os.listdir(dir_sorted_blocks)
-        files = [x for x in files if (x.endswith('.txt') and x.startswith('block_'))]
-        files.sort()
-        # delete the first 3 files (000, 001, 002) because the utxo has already them
-        files = files[3:]
-
-        len_files = len(files)
+            len_files = len(files)
+        else:
+            # blocks decoded on the fly from blk*.dat and rev*.dat (see file_parsing/block_stream.py) or read from an archive (see storage/block_archive.py)
+            conn = create_connection(ADDRESS_IDS_DB_NAME if block_stream.uses_address_ids else DB_NAME)
+            len_files = len(block_stream)
 
         def retrieve_eligible_accounts_object(conn, redistribution_minimum, redistribution_maximum):
             print('Retrieving eligible accounts from database...')
@@ -470,7 +507,13 @@ def multi_input_redistribution_paradise(dir_sorted_blocks, dir_results, redistri
             # transform the eligible_balances into an array for faster computations
             eligible_balances = np.array(eligible_balances)
 
-            eligible_accounts = DoubleDictionaryList(eligible_addresses, eligible_balances)
+            # without a threshold on the users, equal-style redistributions are credited lazily (and weight_based ones incrementally, if enabled)
+            if LAZY_REDISTRIBUTION and redistribution_type in LAZY_REDISTRIBUTION_TYPES and redistribution_user_percentage == 1.0:
+                eligible_accounts = LazyAccountStore(eligible_addresses, eligible_balances)
+            elif INCREMENTAL_WEIGHT_BASED and redistribution_type == 'weight_based' and redistribution_user_percentage == 1.0 and redistribution_minimum > 0:
+                eligible_accounts = WeightedAccountStore(eligible_addresses, eligible_balances, redistribution_maximum, WEIGHT_BASED_RESYNC_INTERVAL)
+            else:
+                eligible_accounts = AccountStore(eligible_addresses, eligible_balances)
             return eligible_accounts, address_to_user
         
         eligible_accounts, address_to_user = retrieve_eligible_accounts_object(conn, redistribution_minimum, redistribution_maximum)
@@ -488,13 +531,13 @@ def multi_input_redistribution_paradise(dir_sorted_blocks, dir_results, redistri
         # pre-allocate a fixed size redistribution list
         redistribution = [0] * len_files
 
-        # initialize the lock set to make the reader threads coordinate on the order of files
-        prev_height = extract_height_from_name(files[0]) - 1
-        lock = prev_height
+        # block files are decoded ahead of the processing by a pool of processes (see storage/block_prefetcher.py)
+        block_reader = BlockPrefetcher(dir_sorted_blocks, files) if block_stream is None else block_stream
 
-        with ThreadPoolExecutor(max_workers=num_readers) as readers, ThreadPoolExecutor(max_workers=1) as processors:
+        with ThreadPoolExecutor(max_workers=1) as readers, ThreadPoolExecutor(max_workers=1) as processors:
 
-            futures_readers = [readers.submit(read_files, files, i, dir_sorted_blocks) for i in range(num_readers)]
+            # a single producer puts the decoded blocks in the queue, already in height order
+            futures_readers = [readers.submit(block_reader.feed, file_queue)]
 
             futures_processors = [processors.submit(process_blocks, address_to_user, eligible_accounts, non_eligible_accounts, redistribution, len_files, redistribution_minimum, redistribution_maximum, redistribution_percentage, redistribution_type, redistribution_amount, redistribution_user_percentage, extra_fee_amount, extra_fee_percentage)]
 
@@ -514,7 +557,7 @@ def multi_input_redistribution_paradise(dir_sorted_blocks, dir_results, redistri
                 with tqdm(total=len(redistribution), desc=f'Writing redistribution per block') as pbar:
                     for index, red in enumerate(redistribution):
                         # the first file is 856003
-                        csv_out.writerow([index + 856003, red])
+                        csv_out.writerow([index + (856003 if block_stream is None else block_stream.first_height), red])
 
                         pbar.update(1)
 
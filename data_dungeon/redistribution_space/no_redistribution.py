@@ -1,17 +1,13 @@
 import os
 import csv
 import queue
-import time
 from concurrent.futures import ThreadPoolExecutor, wait, as_completed
 from tqdm import tqdm
-from redistribution_space.utils import get_block, extract_height_from_name, plot_linear_redistribution_histogram, plot_almost_equal_metrics, plot_weight_based_metrics
-from database.accounts_database import create_connection, retrieve_all_accounts
-
-# number of readers for blocks
-num_readers = 2
+from redistribution_space.utils import list_block_files, blocks_use_address_ids, plot_linear_redistribution_histogram, plot_almost_equal_metrics, plot_weight_based_metrics
+from storage.block_prefetcher import BlockPrefetcher
+from database.accounts_database import create_connection, DB_NAME, ADDRESS_IDS_DB_NAME, retrieve_all_accounts
 
 file_queue = queue.Queue(maxsize=10)
-lock = 0
 
 def perform_input_output(address, payment, input_output, accounts):
     
@@ -98,30 +94,8 @@ def process_blocks(accounts, len_files):
 
     return accounts
 
-def read_files(files, thread_number, dir_sorted_blocks):
-    global file_queue
-    global lock
-
-    with tqdm(total=len(files) // num_readers, desc=f'Reader Thread {thread_number}') as reading_pbar:
-        for i in range(thread_number, len(files), num_readers):
-            height = extract_height_from_name(files[i])
-            path_file = os.path.join(dir_sorted_blocks, files[i])
-
-            block = get_block(path_file)
-
-            # wait until the previous block is inserted in the queue
-            while height - 1 != lock:
-                time.sleep(0.1)
-
-            file_queue.put((height, block))
-            
-            lock = height
-
-            reading_pbar.update(1)
-
 def no_redistribution(dir_sorted_blocks, dir_results, metric_type):
     global file_queue
-    global lock
 
     dir_results_folder = os.path.join(dir_results, metric_type, 'single_input')
     if not os.path.exists(dir_results_folder):
@@ -131,11 +105,9 @@ def no_redistribution(dir_sorted_blocks, dir_results, metric_type):
 
     if not os.path.exists(path_accounts):
 
-        conn = create_connection()
-
-        files = os.listdir(dir_sorted_blocks)
-        files = [x for x in files if (x.endswith('.txt') and x.startswith('block_'))]
-        files.sort()
+        files = list_block_files(dir_sorted_blocks)
+        # blocks referencing addresses by id (see storage/address_table.py) need the accounts keyed by id
+        conn = create_connection(ADDRESS_IDS_DB_NAME if blocks_use_address_ids(dir_sorted_blocks, files) else DB_NAME)
         # delete the first 3 files (000, 001, 002) because the utxo has already them
         files = files[3:]
 
@@ -144,13 +116,13 @@ def no_redistribution(dir_sorted_blocks, dir_results, metric_type):
         print('Retrieving all accounts...')
         accounts = dict(retrieve_all_accounts(conn))
 
-        # initialize the lock set to make the reader threads coordinate on the order of files
-        prev_height = extract_height_from_name(files[0]) - 1
-        lock = prev_height
+        # block files are decoded ahead of the processing by a pool of processes (see storage/block_prefetcher.py)
+        block_reader = BlockPrefetcher(dir_sorted_blocks, files)
 
-        with ThreadPoolExecutor(max_workers=num_readers) as readers, ThreadPoolExecutor(max_workers=1) as processors:
+        with ThreadPoolExecutor(max_workers=1) as readers, ThreadPoolExecutor(max_workers=1) as processors:
 
-            futures_readers = [readers.submit(read_files, files, i, dir_sorted_blocks) for i in range(num_readers)]
+            # a single producer puts the decoded blocks in the queue, already in height order
+            futures_readers = [readers.submit(block_reader.feed, file_queue)]
 
             futures_processors = [processors.submit(process_blocks, accounts, len_files)]
 
@@ -1,22 +1,18 @@
 import os
 import csv
 import queue
-import time
 import math
 import numpy as np
 import numpy_minmax
 from concurrent.futures import ThreadPoolExecutor, wait, as_completed
 from tqdm import tqdm
-from redistribution_space.utils import DoubleDictionaryList, get_block, extract_height_from_name, distribute, plot_balance_histogram, plot_linear_redistribution_histogram, plot_almost_equal_metrics, plot_weight_based_metrics, plot_stacked_histogram
-from database.accounts_database import create_connection, retrieve_eligible_accounts, retrieve_non_eligible_accounts
+from redistribution_space.utils import AccountStore, list_block_files, blocks_use_address_ids, distribute, plot_balance_histogram, plot_linear_redistribution_histogram, plot_almost_equal_metrics, plot_weight_based_metrics, plot_stacked_histogram
+from storage.block_prefetcher import BlockPrefetcher
+from database.accounts_database import create_connection, DB_NAME, ADDRESS_IDS_DB_NAME, retrieve_eligible_accounts, retrieve_non_eligible_accounts
 
 METRICS = False
 
-# number of readers for blocks
-num_readers = 2
-
 file_queue = queue.Queue(maxsize=10)
-lock = 0
 
 def perform_input_output(address, payment, input_output, 
                          eligible_accounts, non_eligible_accounts, 
@@ -186,15 +182,11 @@ def perform_redistribution(redistribution_type, redistribution_amount, redistrib
     eligible_accounts.perform_addition()
     
     eligible_balances = eligible_accounts.list
-    invalid_eligible_balances = eligible_accounts.invalid_elements
-
-    len_eligible_balances = len(eligible_balances)
 
-    # mask array to select only the valid balances (not all of them are valid)
-    mask = np.ones(len_eligible_balances, dtype=bool)
-    mask[invalid_eligible_balances] = False
+    # mask array to select only the valid balances (not all of them are valid), kept up to date by the account store
+    mask = eligible_accounts.valid_mask()
 
-    num_users = len_eligible_balances - len(invalid_eligible_balances)
+    num_users = eligible_accounts.num_users
     # if the percentage of users is less than 100%, then update the mask to exclude the top (1 - redistribution_user_percentage)%
     if redistribution_user_percentage < 1.0:
         valid_balances = eligible_balances[mask]
@@ -205,7 +197,10 @@ def perform_redistribution(redistribution_type, redistribution_amount, redistrib
 
         num_users = np.count_nonzero(mask)
 
-    indices = np.flatnonzero(mask)
+        indices = np.flatnonzero(mask)
+    else:
+        # the positions of the valid balances are computed again only if some account has been added or removed
+        indices = eligible_accounts.valid_indices()
 
     if redistribution_type == 'equal':
 
@@ -399,30 +394,8 @@ def process_blocks(eligible_accounts, non_eligible_accounts, redistribution,
 
     return eligible_accounts, non_eligible_accounts, redistribution
 
-def read_files(files, thread_number, dir_sorted_blocks):
-    global file_queue
-    global lock
-
-    with tqdm(total=len(files) // num_readers, desc=f'Reader Thread {thread_number}') as reading_pbar:
-        for i in range(thread_number, len(files), num_readers):
-            height = extract_height_from_name(files[i])
-            path_file = os.path.join(dir_sorted_blocks, files[i])
-
-            block = get_block(path_file)
-
-            # wait until the previous block is inserted in the queue
-            while height - 1 != lock:
-                time.sleep(0.1)
-
-            file_queue.put((height, block))
-            
-            lock = height
-
-            reading_pbar.update(1)
-
 def redistribution_for_taxation(dir_sorted_blocks, dir_results, redistribution_type, redistribution_percentage, redistribution_amount, redistribution_minimum, redistribution_maximum, redistribution_user_percentage, extra_fee_amount, extra_fee_percentage):
     global file_queue
-    global lock
 
     folder = f'{redistribution_percentage}_{redistribution_minimum}_{redistribution_maximum}_{redistribution_user_percentage}'
     dir_results_folder = os.path.join(dir_results, 'normal', 'single_input', redistribution_type, redistribution_amount, folder)
@@ -434,11 +407,9 @@ def redistribution_for_taxation(dir_sorted_blocks, dir_results, redistribution_t
 
     if not os.path.exists(path_accounts):
 
-        conn = create_connection()
-
-        files = os.listdir(dir_sorted_blocks)
-        files = [x for x in files if (x.endswith('.txt') and x.startswith('block_'))]
-        files.sort()
+        files = list_block_files(dir_sorted_blocks)
+        # blocks referencing addresses by id (see storage/address_table.py) need the accounts keyed by id
+        conn = create_connection(ADDRESS_IDS_DB_NAME if blocks_use_address_ids(dir_sorted_blocks, files) else DB_NAME)
         # delete the first 3 files (000, 001, 002) because the utxo has already them
         files = files[3:]
 
@@ -459,7 +430,7 @@ def redistribution_for_taxation(dir_sorted_blocks, dir_results, redistribution_t
             if redistribution_type == 'no_minimum_equal':
                 eligible_balances = eligible_balances.astype(float)
 
-            eligible_accounts = DoubleDictionaryList(eligible_addresses, eligible_balances)
+            eligible_accounts = AccountStore(eligible_addresses, eligible_balances)
             return eligible_accounts
         
         eligible_accounts = retrieve_eligible_accounts_object(conn, redistribution_minimum, redistribution_maximum)
@@ -473,13 +444,13 @@ def redistribution_for_taxation(dir_sorted_blocks, dir_results, redistribution_t
         # pre-allocate a fixed size redistribution list
         redistribution = [0] * len_files
 
-        # initialize the lock set to make the reader threads coordinate on the order of files
-        prev_height = extract_height_from_name(files[0]) - 1
-        lock = prev_height
+        # block files are decoded ahead of the processing by a pool of processes (see storage/block_prefetcher.py)
+        block_reader = BlockPrefetcher(dir_sorted_blocks, files)
 
-        with ThreadPoolExecutor(max_workers=num_readers) as readers, ThreadPoolExecutor(max_workers=1) as processors:
+        with ThreadPoolExecutor(max_workers=1) as readers, ThreadPoolExecutor(max_workers=1) as processors:
 
-            futures_readers = [readers.submit(read_files, files, i, dir_sorted_blocks) for i in range(num_readers)]
+            # a single producer puts the decoded blocks in the queue, already in height order
+            futures_readers = [readers.submit(block_reader.feed, file_queue)]
 
             futures_processors = [processors.submit(process_blocks, eligible_accounts, non_eligible_accounts, redistribution, len_files, redistribution_minimum, redistribution_maximum, redistribution_percentage, redistribution_type, redistribution_amount, redistribution_user_percentage, extra_fee_amount, extra_fee_percentage)]
 
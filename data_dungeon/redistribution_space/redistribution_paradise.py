@@ -1,22 +1,25 @@
 import os
 import csv
 import queue
-import time
 import math
 import numpy as np
 import numpy_minmax
 from concurrent.futures import ThreadPoolExecutor, wait, as_completed
 from tqdm import tqdm
-from redistribution_space.utils import DoubleDictionaryList, get_block, extract_height_from_name, distribute, plot_balance_histogram, plot_linear_redistribution_histogram, plot_almost_equal_metrics, plot_weight_based_metrics, plot_stacked_histogram
-from database.accounts_database import create_connection, retrieve_eligible_accounts, retrieve_non_eligible_accounts
+from redistribution_space.utils import AccountStore, LazyAccountStore, WeightedAccountStore, LAZY_REDISTRIBUTION_TYPES, lazy_redistribution, list_block_files, blocks_use_address_ids, distribute, block_delta_payments, block_operations, apply_block_operations, plot_balance_histogram, plot_linear_redistribution_histogram, plot_almost_equal_metrics, plot_weight_based_metrics, plot_stacked_histogram
+from storage.block_prefetcher import BlockPrefetcher
+from storage.block_deltas import BlockDelta, BlockDeltas, DELTA_REDISTRIBUTION_TYPES
+from database.accounts_database import create_connection, DB_NAME, ADDRESS_IDS_DB_NAME, retrieve_eligible_accounts, retrieve_non_eligible_accounts
 
 METRICS = True
-
-# number of readers for blocks
-num_readers = 2
+# Flag to credit equal-style redistributions lazily (see redistribution_space/utils.py LazyAccountStore)
+LAZY_REDISTRIBUTION = True
+# Flag to credit weight_based redistributions incrementally, with all the balances resynchronized every WEIGHT_BASED_RESYNC_INTERVAL blocks
+# (the balances differ slightly from those of weight_based, see redistribution_space/utils.py WeightedAccountStore)
+INCREMENTAL_WEIGHT_BASED = False
+WEIGHT_BASED_RESYNC_INTERVAL = 100
 
 file_queue = queue.Queue(maxsize=10)
-lock = 0
 
 def perform_input_output(address, payment, input_output, 
                          eligible_accounts, non_eligible_accounts, 
@@ -86,6 +89,30 @@ def perform_block_transactions(eligible_accounts, non_eligible_accounts,
     # extra fee computed for each output if the fee is a percentage
     extra_fee_percentage_per_output = 0
 
+    # blocks collapsed by storage/block_deltas.py: a single update for each address touched by the block
+    if isinstance(block, BlockDelta):
+        addresses, payments, total_extra_fee_percentage = block_delta_payments(block, extra_fee_amount, extra_fee_percentage)
+        # integer balances go through the block kernel, with one operation for each address
+        if eligible_accounts.balances.dtype.kind != 'f':
+            eligible_accounts, non_eligible_accounts = apply_block_operations(
+                eligible_accounts, non_eligible_accounts, np.arange(len(addresses)), addresses, payments, redistribution_minimum, redistribution_maximum)
+        else:
+            for address, payment in zip(addresses, payments.tolist()):
+                eligible_accounts, non_eligible_accounts = perform_input_output(
+                    address, payment, 1, 
+                    eligible_accounts, non_eligible_accounts, 
+                    redistribution_minimum, redistribution_maximum, 0, 0)
+
+        return eligible_accounts, non_eligible_accounts, total_extra_fee_percentage
+
+    # integer balances are updated for the whole block at once, float balances (no_minimum_equal) depend on the order of the additions
+    if eligible_accounts.balances.dtype.kind != 'f':
+        codes, accounts, amounts, total_extra_fee_percentage = block_operations(block, extra_fee_amount, extra_fee_percentage)
+        eligible_accounts, non_eligible_accounts = apply_block_operations(
+            eligible_accounts, non_eligible_accounts, codes, accounts, amounts, redistribution_minimum, redistribution_maximum)
+
+        return eligible_accounts, non_eligible_accounts, total_extra_fee_percentage
+
     for index, transaction in enumerate(block['Transactions']):
         # skip coinbase transaction
         if index == 0:
@@ -184,17 +211,36 @@ def perform_redistribution(redistribution_type, redistribution_amount, redistrib
     max_redistribution = max_block_redistribution + total_extra_fee
     
     eligible_accounts.perform_addition()
-    
-    eligible_balances = eligible_accounts.list
-    invalid_eligible_balances = eligible_accounts.invalid_elements
 
-    len_eligible_balances = len(eligible_balances)
+    # the redistribution is credited to all the users at once, the balances are settled only when they are read (see LazyAccountStore and WeightedAccountStore)
+    if isinstance(eligible_accounts, (LazyAccountStore, WeightedAccountStore)):
+        if isinstance(eligible_accounts, LazyAccountStore):
+            block_redistribution, max_block_redistribution, redistribution_extra_fee, circular_queue_index = lazy_redistribution(
+                eligible_accounts, redistribution_type, max_redistribution, max_block_redistribution, total_extra_fee, circular_queue_index)
+        else:
+            # the metrics go through all the balances, they are computed only if they are kept
+            if METRICS:
+                block_redistribution = eligible_accounts.redistribution_metrics(max_redistribution)
+            eligible_accounts.redistribute(max_redistribution)
+            redistribution_extra_fee = total_extra_fee
+        if METRICS:
+            redistribution[number_of_file] = block_redistribution
+
+        # it cannot happen that an account becomes non-eligible through redistribution by having a balance lower than the minimum
+        for address in eligible_accounts.accounts_above(redistribution_maximum):
+            balance = eligible_accounts.remove(address)
+            non_eligible_accounts[address] = balance
+
+        remaining_from_extra_fee = total_extra_fee - redistribution_extra_fee
 
-    # mask array to select only the valid balances (not all of them are valid)
-    mask = np.ones(len_eligible_balances, dtype=bool)
-    mask[invalid_eligible_balances] = False
+        return redistribution, eligible_accounts, non_eligible_accounts, max_block_redistribution, remaining_from_extra_fee, circular_queue_index
+
+    eligible_balances = eligible_accounts.list
 
-    num_users = len_eligible_balances - len(invalid_eligible_balances)
+    # mask array to select only the valid balances (not all of them are valid), kept up to date by the account store
+    mask = eligible_accounts.valid_mask()
+
+    num_users = eligible_accounts.num_users
     # if the percentage of users is less than 100%, then update the mask to exclude the top (1 - redistribution_user_percentage)%
     if redistribution_user_percentage < 1.0:
         valid_balances = eligible_balances[mask]
@@ -205,7 +251,10 @@ def perform_redistribution(redistribution_type, redistribution_amount, redistrib
 
         num_users = np.count_nonzero(mask)
 
-    indices = np.flatnonzero(mask)
+        indices = np.flatnonzero(mask)
+    else:
+        # the positions of the valid balances are computed again only if some account has been added or removed
+        indices = eligible_accounts.valid_indices()
 
     if redistribution_type == 'equal':
 
@@ -395,34 +444,23 @@ def process_blocks(eligible_accounts, non_eligible_accounts, redistribution,
 
             file_queue.task_done()
     
+    # the units still in the pool of the incremental weight_based are given before the balances are written
+    if isinstance(eligible_accounts, WeightedAccountStore):
+        eligible_accounts.resync()
+        for address in eligible_accounts.accounts_above(redistribution_maximum):
+            balance = eligible_accounts.remove(address)
+            non_eligible_accounts[address] = balance
+
     eligible_accounts.perform_addition()
 
     return eligible_accounts, non_eligible_accounts, redistribution
 
-def read_files(files, thread_number, dir_sorted_blocks):
+def redistribution_paradise(dir_sorted_blocks, dir_results, redistribution_type, redistribution_percentage, redistribution_amount, redistribution_minimum, redistribution_maximum, redistribution_user_percentage, extra_fee_amount, extra_fee_percentage, block_stream=None):
     global file_queue
-    global lock
-
-    with tqdm(total=len(files) // num_readers, desc=f'Reader Thread {thread_number}') as reading_pbar:
-        for i in range(thread_number, len(files), num_readers):
-            height = extract_height_from_name(files[i])
-            path_file = os.path.join(dir_sorted_blocks, files[i])
 
-            block = get_block(path_file)
-
-            # wait until the previous block is inserted in the queue
-            while height - 1 != lock:
-                time.sleep(0.1)
-
-            file_queue.put((height, block))
-            
-            lock = height
-
-            reading_pbar.update(1)
-
-def redistribution_paradise(dir_sorted_blocks, dir_results, redistribution_type, redistribution_percentage, redistribution_amount, redistribution_minimum, redistribution_maximum, redistribution_user_percentage, extra_fee_amount, extra_fee_percentage):
-    global file_queue
-    global lock
+    # the deltas keep only the net amounts per address, the other redistributions depend on the slots the accounts take within a block
+    if isinstance(block_stream, BlockDeltas) and redistribution_type not in DELTA_REDISTRIBUTION_TYPES:
+        raise ValueError(f'Block deltas can only be used with the redistribution types {DELTA_REDISTRIBUTION_TYPES}')
 
     folder = f'{redistribution_minimum}_{redistribution_maximum}_{redistribution_user_percentage}_{extra_fee_amount}_{extra_fee_percentage}'
     dir_results_folder = os.path.join(dir_results, 'normal', 'single_input', redistribution_type, redistribution_amount, folder)
@@ -434,15 +472,18 @@ def redistribution_paradise(dir_sorted_blocks, dir_results, redistribution_type,
 
     if not os.path.exists(path_accounts):
 
-        conn = create_connection()
+        if block_stream is None:
+            files = list_block_files(dir_sorted_blocks)
+            # blocks referencing addresses by id (see storage/address_table.py) need the accounts keyed by id
+            conn = create_connection(ADDRESS_IDS_DB_NAME if blocks_use_address_ids(dir_sorted_blocks, files) else DB_NAME)
+            # delete the first 3 files (000, 001, 002) because the utxo has already them
+            files = files[3:]
 
-        files = os.listdir(dir_sorted_blocks)
-        files = [x for x in files if (x.endswith('.txt') and x.startswith('block_'))]
-        files.sort()
-        # delete the first 3 files (000, 001, 002) because the utxo has already them
-        files = files[3:]
-
-        len_files = len(files)
+            len_files = len(files)
+        else:
+            # blocks decoded on the fly from blk*.dat and rev*.dat (see file_parsing/block_stream.py) or read from an archive (see storage/block_archive.py)
+            conn = create_connection(ADDRESS_IDS_DB_NAME if block_stream.uses_address_ids else DB_NAME)
+            len_files = len(block_stream)
 
         def retrieve_eligible_accounts_object(conn, redistribution_minimum, redistribution_maximum):
             print('Retrieving eligible accounts from database...')
@@ -459,7 +500,13 @@ def redistribution_paradise(dir_sorted_blocks, dir_results, redistribution_type,
             if redistribution_type == 'no_minimum_equal':
                 eligible_balances = eligible_balances.astype(float)
 
-            eligible_accounts = DoubleDictionaryList(eligible_addresses, eligible_balances)
+            # without a threshold on the users, equal-style redistributions are credited lazily (and weight_based ones incrementally, if enabled)
+            if LAZY_REDISTRIBUTION and redistribution_type in LAZY_REDISTRIBUTION_TYPES and redistribution_user_percentage == 1.0:
+                eligible_accounts = LazyAccountStore(eligible_addresses, eligible_balances)
+            elif INCREMENTAL_WEIGHT_BASED and redistribution_type == 'weight_based' and redistribution_user_percentage == 1.0 and redistribution_minimum > 0:
+                eligible_accounts = WeightedAccountStore(eligible_addresses, eligible_balances, redistribution_maximum, WEIGHT_BASED_RESYNC_INTERVAL)
+            else:
+                eligible_accounts = AccountStore(eligible_addresses, eligible_balances)
             return eligible_accounts
         
         eligible_accounts = retrieve_eligible_accounts_object(conn, redistribution_minimum, redistribution_maximum)
@@ -473,13 +520,13 @@ def redistribution_paradise(dir_sorted_blocks, dir_results, redistribution_type,
         # pre-allocate a fixed size redistribution list
         redistribution = [0] * len_files
 
-        # initialize the lock set to make the reader threads coordinate on the order of files
-        prev_height = extract_height_from_name(files[0]) - 1
-        lock = prev_height
+        # block files are decoded ahead of the processing by a pool of processes (see storage/block_prefetcher.py)
+        block_reader = BlockPrefetcher(dir_sorted_blocks, files) if block_stream is None else block_stream
 
-        with ThreadPoolExecutor(max_workers=num_readers) as readers, ThreadPoolExecutor(max_workers=1) as processors:
+        with ThreadPoolExecutor(max_workers=1) as readers, ThreadPoolExecutor(max_workers=1) as processors:
 
-            futures_readers = [readers.submit(read_files, files, i, dir_sorted_blocks) for i in range(num_readers)]
+            # a single producer puts the decoded blocks in the queue, already in height order
+            futures_readers = [readers.submit(block_reader.feed, file_queue)]
 
             futures_processors = [processors.submit(process_blocks, eligible_accounts, non_eligible_accounts, redistribution, len_files, redistribution_minimum, redistribution_maximum, redistribution_percentage, redistribution_type, redistribution_amount, redistribution_user_percentage, extra_fee_amount, extra_fee_percentage)]
 
@@ -499,7 +546,7 @@ def redistribution_paradise(dir_sorted_blocks, dir_results, redistribution_type,
                 with tqdm(total=len(redistribution), desc=f'Writing redistribution per block') as pbar:
                     for index, red in enumerate(redistribution):
                         # the first file is 856003
-                        csv_out.writerow([index + 856003, red])
+                        csv_out.writerow([index + (856003 if block_stream is None else block_stream.first_height), red])
 
                         pbar.update(1)
 
@@ -1,99 +1,571 @@
+import os
 import json
-import re
+import heapq
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
 from queue import Queue
+from collections import deque
 from tqdm import tqdm
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
-
-class DoubleDictionaryList:
+from storage.block_archive import decode_block
+from storage.columnar_blocks import ColumnarBlock
+
+class AccountStore:
+    """
+    Balances of the eligible accounts: key -> slot (dictionary), slot -> key (reverse_dictionary) and slot -> balance (list).
+    The balances are kept in an array whose capacity is doubled when it is full, so adding an account never copies them all,
+    and the slots of the removed accounts (invalid_elements) are reused in the order in which they were freed.
+    The slots of the eligible accounts (valid_mask), their number (num_users) and their positions (valid_indices) are kept up to date as well.
+    """
     def __init__(self, dictionary={}, list=[]):
         self.dictionary = dictionary
-        self.reverse_dictionary = {value: key for key, value in self.dictionary.items()}
-
-        # lists have the same length
-        self.list = np.array(list)
-        self.len_list = len(self.list)
 
-        self.invalid_elements = []
-        self.elements_to_add = []
+        balances = np.array(list)
+        self.len_list = len(balances)
+        self.balances = np.zeros(max(self.len_list, 1), dtype=balances.dtype)
+        self.balances[:self.len_list] = balances
+
+        self.reverse_dictionary = [None] * self.len_list
+        for key, index in self.dictionary.items():
+            self.reverse_dictionary[index] = key
+
+        self.invalid_elements = deque()
+
+        # slot -> True if it belongs to an account
+        self.valid = np.zeros(len(self.balances), dtype=bool)
+        self.valid[np.fromiter(self.dictionary.values(), dtype=np.int64, count=len(self.dictionary))] = True
+        self.num_users = len(self.dictionary)
+        # positions of the valid slots, computed again only after an account has been added or removed
+        self.indices = None
+
+    @property
+    def list(self):
+        # slots in use (the removed ones included), changes made through this view are made to the balances
+        return self.balances[:self.len_list]
+
+    @list.setter
+    def list(self, balances):
+        # in-place operations (eligible_accounts.list += amount) assign the view they have already modified
+        if balances.base is not self.balances:
+            self.balances[:self.len_list] = balances
+
+    def _new_slot(self):
+        if self.len_list == len(self.balances):
+            balances = np.zeros(2 * len(self.balances), dtype=self.balances.dtype)
+            balances[:self.len_list] = self.balances[:self.len_list]
+            self.balances = balances
+
+            valid = np.zeros(len(self.balances), dtype=bool)
+            valid[:self.len_list] = self.valid[:self.len_list]
+            self.valid = valid
+
+        self.reverse_dictionary.append(None)
+        self.len_list += 1
+        return self.len_list - 1
 
     def remove(self, key):
-        # remove it from both dictionary and reverse dictionary
         index = self.dictionary.pop(key)
-        self.reverse_dictionary.pop(index)
+        self.reverse_dictionary[index] = None
 
         self.invalid_elements.append(index)
+        self.valid[index] = False
+        self.num_users -= 1
+        self.indices = None
 
-        if index >= self.len_list:
-            balance = self.elements_to_add[index - self.len_list]
-        else:
-            balance = self.list[index]
-
-        return balance
+        return self.balances[index]
 
     def add(self, address, balance):
+        index = self.invalid_elements.popleft() if len(self.invalid_elements) > 0 else self._new_slot()
 
-        if len(self.invalid_elements) > 0:
-            free_index = self.invalid_elements[0]
-
-            if free_index >= self.len_list:
-                self.elements_to_add[free_index - self.len_list] = balance
-            else:
-                self.list[free_index] = balance
-
-            self.dictionary[address] = free_index
-            self.reverse_dictionary[free_index] = address
-            self.invalid_elements.pop(0)
-        else:
-            self.elements_to_add.append(balance)
-
-            index = self.len_list + len(self.elements_to_add) - 1
-            self.dictionary[address] = index
-            self.reverse_dictionary[index] = address
+        self.balances[index] = balance
+        self.dictionary[address] = index
+        self.reverse_dictionary[index] = address
+        self.valid[index] = True
+        self.num_users += 1
+        self.indices = None
 
     def update_balance(self, address, balance):
-        index = self.dictionary[address]
+        self.balances[self.dictionary[address]] = balance
 
-        if index >= self.len_list:
-            self.elements_to_add[index - self.len_list] = balance
-        else:
-            self.list[index] = balance
+    def update_balances(self, addresses, balances):
+        self.balances[[self.dictionary[address] for address in addresses]] = balances
 
     def perform_addition(self):
-        if len(self.elements_to_add) > 0:
-            # add elements to first list, recompute the length of the first list, clear all elements added from list
-            self.list = np.append(self.list, self.elements_to_add)
-            self.len_list = len(self.list)
-            self.elements_to_add.clear()
+        # accounts are added to the balances directly, nothing is left to be added
+        pass
 
     def contains_key(self, key):
         return key in self.dictionary
     
     def get_balance(self, address):
+        return self.balances[self.dictionary[address]]
+
+    def valid_mask(self):
+        # read-only: the slots of list that belong to an account
+        return self.valid[:self.len_list]
+
+    def valid_indices(self):
+        # read-only: positions of the slots of list that belong to an account, in increasing order
+        if self.indices is None:
+            self.indices = np.flatnonzero(self.valid_mask())
+        return self.indices
+
+# redistribution types whose amounts can be credited lazily by LazyAccountStore (when all the users receive them)
+# no_minimum_equal is left out: its float credits added at once would change the last digits of the balances
+LAZY_REDISTRIBUTION_TYPES = ('equal', 'almost_equal', 'circular_queue_equal')
+
+def _fenwick_tree(values):
+    # 1-indexed tree of the prefix sums of values: tree[i] is the sum of values[i - lowbit(i):i]
+    positions = np.arange(len(values) + 1)
+    sums = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(values, out=sums[1:])
+    return sums - sums[positions - (positions & -positions)]
+
+def _fenwick_add(tree, index, delta):
+    index += 1
+    while index < len(tree):
+        tree[index] += delta
+        index += index & -index
+
+def _fenwick_prefix(tree, index):
+    # sum of values[:index + 1]
+    total = 0
+    index += 1
+    while index > 0:
+        total += tree[index]
+        index -= index & -index
+    return int(total)
+
+class LazyAccountStore(AccountStore):
+    """
+    AccountStore whose redistributions are not added to all the balances at every block.
+    The amount received by every user (credit_all) is accumulated in credit, and the units given to a range of users by their position among
+    the valid slots (credit_ranks, as eligible_accounts.list[indices[start:end]] += 1) are accumulated in a tree of the slots.
+    Each slot keeps the credits at the time its balance was last settled, so its balance is settled (get_balance, remove, settle) by adding
+    only the credits received since then, and a block costs as much as the accounts it touches.
+    The accounts that may exceed a maximum (accounts_above) are found through an upper bound of their balances, kept in a sorted array and a heap.
+    The balances are the same of AccountStore (the credits are integers, see LAZY_REDISTRIBUTION_TYPES).
+    """
+    def __init__(self, dictionary={}, list=[]):
+        super().__init__(dictionary, list)
+
+        self.credit = self.balances.dtype.type(0)
+        # number of calls of credit_ranks: no slot received more units than rounds
+        self.rounds = 0
+        self.credit_at_entry = np.zeros(len(self.balances), dtype=self.balances.dtype)
+        self.rank_credit_at_entry = np.zeros(len(self.balances), dtype=np.int64)
+        # slot -> units received by the slot through credit_ranks (as differences between consecutive slots)
+        self.rank_differences = np.zeros(len(self.balances), dtype=np.int64)
+        self.rank_tree = _fenwick_tree(self.rank_differences)
+        # slot -> 1 if valid, to find the slot of the account in a given position
+        self.valid_tree = _fenwick_tree(self.valid)
+
+        # incremented whenever the bound of the balance of the slot changes, to recognize outdated entries of the candidates
+        self.stamps = np.zeros(len(self.balances), dtype=np.int64)
+        self._rebuild_candidates()
+
+    @property
+    def list(self):
+        # the balances are settled before they are read
+        self.settle()
+        return self.balances[:self.len_list]
+
+    @list.setter
+    def list(self, balances):
+        AccountStore.list.fset(self, balances)
+
+    def _new_slot(self):
+        capacity = len(self.balances)
+        index = super()._new_slot()
+        if len(self.balances) != capacity:
+            for name in ('credit_at_entry', 'rank_credit_at_entry', 'rank_differences', 'stamps'):
+                array = getattr(self, name)
+                grown = np.zeros(len(self.balances), dtype=array.dtype)
+                grown[:capacity] = array
+                setattr(self, name, grown)
+            self.rank_tree = _fenwick_tree(self.rank_differences)
+            self.valid_tree = _fenwick_tree(self.valid)
+        return index
+
+    def _settle(self, index):
+        rank_credit = _fenwick_prefix(self.rank_tree, index)
+        self.balances[index] += (self.credit - self.credit_at_entry[index]) + (rank_credit - self.rank_credit_at_entry[index])
+        self.credit_at_entry[index] = self.credit
+        self.rank_credit_at_entry[index] = rank_credit
+        return self.balances[index]
+
+    def settle(self):
+        """Settles the balances of all the slots."""
+        rank_credits = np.cumsum(self.rank_differences[:self.len_list])
+        self.balances[:self.len_list] += (self.credit - self.credit_at_entry[:self.len_list]) + (rank_credits - self.rank_credit_at_entry[:self.len_list])
+        self.credit_at_entry[:self.len_list] = self.credit
+        self.rank_credit_at_entry[:self.len_list] = rank_credits
+
+    def _rebuild_candidates(self):
+        # the balances of all the accounts are the bounds (sorted in decreasing order), the heap keeps those changed afterwards
+        self.settle()
+        indices = self.valid_indices()
+        keys = self.balances[indices] - self.credit - self.rounds
+        order = np.argsort(-keys, kind='stable')
+        self.sorted_indices = indices[order]
+        self.sorted_negative_keys = -keys[order]
+        self.sorted_stamps = self.stamps[self.sorted_indices]
+        self.position = 0
+        self.heap = []
+
+    def _push(self, index):
+        # the balance of the slot (already settled) grows at most by the credits and the rounds to come
+        self.stamps[index] += 1
+        heapq.heappush(self.heap, ((self.credit + self.rounds - self.balances[index]).item(), index, int(self.stamps[index])))
+        if len(self.heap) > max(self.num_users, 1024):
+            self._rebuild_candidates()
+
+    def _enter(self, index, balance):
+        self.balances[index] = balance
+        self.credit_at_entry[index] = self.credit
+        self.rank_credit_at_entry[index] = _fenwick_prefix(self.rank_tree, index)
+        self._push(index)
+
+    def remove(self, key):
+        index = self.dictionary[key]
+        self._settle(index)
+        balance = super().remove(key)
+        self.stamps[index] += 1
+        _fenwick_add(self.valid_tree, index, -1)
+        return balance
+
+    def add(self, address, balance):
+        super().add(address, balance)
         index = self.dictionary[address]
+        _fenwick_add(self.valid_tree, index, 1)
+        self._enter(index, balance)
+
+    def update_balance(self, address, balance):
+        self._enter(self.dictionary[address], balance)
+
+    def update_balances(self, addresses, balances):
+        for address, balance in zip(addresses, balances.tolist()):
+            self._enter(self.dictionary[address], balance)
+
+    def get_balance(self, address):
+        return self._settle(self.dictionary[address])
+
+    def credit_all(self, amount):
+        """Adds amount to the balances of all the eligible accounts (as eligible_accounts.list += amount)."""
+        self.credit += amount
+
+    def _kth_valid(self, rank):
+        # slot of the valid slot in position rank (as valid_indices()[rank])
+        position, remaining = 0, rank + 1
+        step = 1 << ((len(self.valid_tree) - 1).bit_length() - 1)
+        while step > 0:
+            if position + step < len(self.valid_tree) and self.valid_tree[position + step] < remaining:
+                position += step
+                remaining -= self.valid_tree[position]
+            step >>= 1
+        return position
+
+    def credit_ranks(self, start, end):
+        """Adds 1 to the balances of the eligible accounts from position start to end (as eligible_accounts.list[valid_indices()[start:end]] += 1)."""
+        end = min(end, self.num_users)
+        if start >= end:
+            return
+        first, last = self._kth_valid(start), self._kth_valid(end - 1)
+        self.rank_differences[first] += 1
+        _fenwick_add(self.rank_tree, first, 1)
+        if last + 1 < len(self.rank_differences):
+            self.rank_differences[last + 1] -= 1
+            _fenwick_add(self.rank_tree, last + 1, -1)
+        self.rounds += 1
+
+    def accounts_above(self, maximum):
+        """Addresses of the eligible accounts whose balance is greater than maximum, in the order of their slots."""
+        bound = maximum - self.credit - self.rounds
+
+        end = np.searchsorted(self.sorted_negative_keys, -bound, side='left')
+        indices = self.sorted_indices[self.position:end]
+        candidates = indices[self.stamps[indices] == self.sorted_stamps[self.position:end]].tolist()
+        self.position = max(self.position, end)
+
+        while len(self.heap) > 0 and -self.heap[0][0] > bound:
+            _, index, stamp = heapq.heappop(self.heap)
+            if self.stamps[index] == stamp:
+                candidates.append(index)
+
+        above = []
+        for index in candidates:
+            if self._settle(index) > maximum:
+                above.append(index)
+            else:
+                # the bound is computed again from the settled balance
+                self._push(index)
+
+        return [self.reverse_dictionary[index] for index in sorted(above)]
+
+def lazy_redistribution(eligible_accounts, redistribution_type, max_redistribution, max_block_redistribution, total_extra_fee, circular_queue_index):
+    """
+    Redistribution of the equal-style types of perform_redistribution to all the users, credited to a LazyAccountStore.
+    Returns the metric of the block, max_block_redistribution, redistribution_extra_fee and circular_queue_index as perform_redistribution.
+    """
+    num_users = eligible_accounts.num_users
 
-        if index >= self.len_list:
-            balance = self.elements_to_add[index - self.len_list]
+    redistribution_per_user = max_redistribution // num_users if num_users > 0 else 0
+    if redistribution_per_user > 0:
+        eligible_accounts.credit_all(redistribution_per_user)
+
+    redistribution_extra_fee = total_extra_fee
+    metric = redistribution_per_user
+
+    if redistribution_type == 'equal':
+        actual_redistribution = redistribution_per_user * num_users
+        if actual_redistribution < max_block_redistribution:
+            max_block_redistribution = actual_redistribution
+        redistribution_extra_fee = actual_redistribution - max_block_redistribution if actual_redistribution > max_block_redistribution else 0
+
+    elif redistribution_type in ('almost_equal', 'circular_queue_equal'):
+        remaining = max_redistribution - redistribution_per_user * num_users
+
+        if redistribution_type == 'almost_equal':
+            eligible_accounts.credit_ranks(0, remaining)
         else:
-            balance = self.list[index]
+            new_circular_queue_index = circular_queue_index + remaining
+            if new_circular_queue_index > eligible_accounts.len_list:
+                eligible_accounts.credit_ranks(circular_queue_index, num_users)
+                circular_queue_index = new_circular_queue_index % eligible_accounts.len_list
+                eligible_accounts.credit_ranks(0, circular_queue_index)
+            else:
+                eligible_accounts.credit_ranks(circular_queue_index, new_circular_queue_index)
+                circular_queue_index = new_circular_queue_index
+
+        percentiles = [25, 50, 75]
+        perc_indices = [int(np.ceil((p / 100) * num_users)) - 1 for p in percentiles]
+        metric = [redistribution_per_user + 1 if idx < remaining else redistribution_per_user for idx in perc_indices]
+
+    return metric, max_block_redistribution, redistribution_extra_fee, circular_queue_index
+
+class WeightedAccountStore(AccountStore):
+    """
+    AccountStore whose weight_based redistributions are not added to all the balances at every block.
+    An account receives amount / (balance * inverse_sum) of each redistribution, where inverse_sum (the sum of the inverse balances) is kept
+    up to date by the accounts touched: the amounts per inverse balance are accumulated in credit, and each slot keeps the credit at the time
+    its balance was last settled, so its balance is settled (get_balance, remove, settle) by adding floor((credit - credit at entry) / balance).
+    An account is settled as well (accounts_above) as soon as the units waiting for it exceed tolerance times its balance (at least one unit),
+    so the redistribution it receives changes its weight like in weight_based, and as soon as its balance exceeds maximum.
+    The fractions of units left by the settlements wait in pool until resync (every resync_interval blocks), which settles all the balances,
+    gives the units of pool to the accounts with the highest weights (as the rounding of weight_based) and computes inverse_sum again.
+    Compared to weight_based, the weight of an account is computed on a balance lower than its settled one by less than tolerance times
+    its value (one unit for balances below 1 / tolerance), so in each block an account receives between 1 / (1 + tolerance) and 1 + tolerance
+    times the amount of weight_based on the settled balances (plus one unit of rounding), and at most tolerance times the redistributed amount
+    goes to different accounts. The units left by the rounding (less than one per account and block) are given only at the resyncs,
+    where the total redistributed is the same again. The differences add up over the blocks through the weights: on a synthetic chain with
+    tolerance = 0.01, 0.05-0.24% of the redistributed amount went to different accounts, single balances were off by up to 2.2%
+    and a few accounts crossed maximum in different blocks.
+    With resync_interval = 1 the balances are those of weight_based but for ties in the rounding, with longer intervals the delayed units
+    change the weights of the lowest balances (a unit matters for balances of a few units), so the minimum should be far above resync_interval.
+    """
+    def __init__(self, dictionary={}, list=[], maximum=0, resync_interval=100, tolerance=0.01):
+        super().__init__(dictionary, list)
+
+        self.maximum = maximum
+        self.resync_interval = resync_interval
+        self.tolerance = tolerance
+        self.blocks = 0
+
+        self.credit = 0.0
+        self.credit_at_entry = np.zeros(len(self.balances))
+        # units redistributed and not yet added to the balances
+        self.pool = 0
+        # incremented whenever the trigger of the slot changes, to recognize outdated entries of the triggers
+        self.stamps = np.zeros(len(self.balances), dtype=np.int64)
+        self.resync()
+
+    @property
+    def list(self):
+        # the balances are settled before they are read
+        self.settle()
+        return self.balances[:self.len_list]
+
+    @list.setter
+    def list(self, balances):
+        AccountStore.list.fset(self, balances)
+
+    def _new_slot(self):
+        capacity = len(self.balances)
+        index = super()._new_slot()
+        if len(self.balances) != capacity:
+            for name in ('credit_at_entry', 'stamps'):
+                array = getattr(self, name)
+                grown = np.zeros(len(self.balances), dtype=array.dtype)
+                grown[:capacity] = array
+                setattr(self, name, grown)
+        return index
+
+    def _settle(self, index):
+        balance = self.balances[index]
+        units = int((self.credit - self.credit_at_entry[index]) // balance)
+        if units > 0:
+            self.balances[index] = balance + units
+            self.pool -= units
+            self.inverse_sum += 1 / self.balances[index] - 1 / balance
+        self.credit_at_entry[index] = self.credit
+        return self.balances[index]
+
+    def settle(self):
+        """Settles the balances of all the eligible accounts."""
+        indices = self.valid_indices()
+        units = ((self.credit - self.credit_at_entry[indices]) // self.balances[indices]).astype(self.balances.dtype)
+        self.balances[indices] += units
+        self.pool -= int(np.sum(units))
+        self.credit_at_entry[indices] = self.credit
+        self.inverse_sum = float(np.sum(1 / self.balances[indices]))
+
+    def resync(self):
+        """Settles all the balances, gives the units of pool to the accounts with the highest weights and computes inverse_sum again."""
+        indices = self.valid_indices()
+        # weights of the balances on which the units have been computed
+        inverse_weights = 1 / self.balances[indices]
+        self.settle()
+
+        if self.pool > 0 and len(indices) > 0:
+            amounts = np.full(len(indices), self.pool // len(indices), dtype=self.balances.dtype)
+            difference = self.pool % len(indices)
+            if difference > 0:
+                amounts[np.argpartition(-inverse_weights, difference)[:difference]] += 1
+            self.balances[indices] += amounts
+            self.pool = 0
+            self.inverse_sum = float(np.sum(1 / self.balances[indices]))
+
+        self._rebuild_triggers()
+
+    def _triggers(self, credit_at_entry, balances):
+        # credit at which the units waiting for the balances exceed the tolerance or make the balances exceed maximum
+        return credit_at_entry + balances * np.minimum(np.maximum(self.tolerance * balances, 1), self.maximum - balances + 1)
+
+    def _rebuild_triggers(self):
+        # the triggers of all the accounts are sorted in increasing order, the heap keeps those changed afterwards
+        indices = self.valid_indices()
+        triggers = self._triggers(self.credit_at_entry[indices], self.balances[indices].astype(float))
+        order = np.argsort(triggers, kind='stable')
+        self.sorted_indices = indices[order]
+        self.sorted_triggers = triggers[order]
+        self.sorted_stamps = self.stamps[self.sorted_indices]
+        self.position = 0
+        self.heap = []
+
+    def _push(self, index):
+        self.stamps[index] += 1
+        heapq.heappush(self.heap, (float(self._triggers(self.credit_at_entry[index], float(self.balances[index]))), index, int(self.stamps[index])))
+        if len(self.heap) > max(self.num_users, 1024):
+            self._rebuild_triggers()
+
+    def _enter(self, index, balance):
+        self.inverse_sum += 1 / balance - 1 / self.balances[index]
+        self.balances[index] = balance
+        self.credit_at_entry[index] = self.credit
+        self._push(index)
 
-        return balance
+    def remove(self, key):
+        index = self.dictionary[key]
+        self.inverse_sum -= 1 / self._settle(index)
+        self.stamps[index] += 1
+        return super().remove(key)
 
-def clean_string_for_json_conversion(str):
-    return re.sub(r'er\': \[.*?\]', 'er\': \'INVALID\'', str).replace('er\': None', 'er\': \'INVALID\'').replace(' b\'', ' \'').replace('\'', '\"')
+    def add(self, address, balance):
+        super().add(address, balance)
+        index = self.dictionary[address]
+        self.inverse_sum += 1 / balance
+        self.credit_at_entry[index] = self.credit
+        self._push(index)
 
-def get_block(filename):
-    with open(filename, 'r') as file:
-        block_str = file.readline()
-        cleaned_block_str = clean_string_for_json_conversion(block_str)
-        block = json.loads(cleaned_block_str)
+    def update_balance(self, address, balance):
+        self._enter(self.dictionary[address], balance)
+
+    def update_balances(self, addresses, balances):
+        for address, balance in zip(addresses, balances.tolist()):
+            self._enter(self.dictionary[address], balance)
+
+    def get_balance(self, address):
+        return self._settle(self.dictionary[address])
+
+    def redistribute(self, amount):
+        """Redistributes amount to the eligible accounts by their inverse balances (as weight_based), with a resync every resync_interval calls."""
+        if self.num_users > 0:
+            self.credit += amount / self.inverse_sum
+            self.pool += amount
+
+        self.blocks += 1
+        if self.blocks % self.resync_interval == 0:
+            self.resync()
+
+    def redistribution_metrics(self, amount):
+        """Metrics of weight_based for a redistribution of amount (units left by the rounding excluded), computed on the current balances."""
+        indices = self.valid_indices()
+        num_users = len(indices)
+        if num_users == 0:
+            return [amount, 0, 0, 0, 0, 0]
+
+        # balances as they would be settled now, without settling them (it would change the weights of the next redistributions)
+        balances = self.balances[indices]
+        balances = balances + (self.credit - self.credit_at_entry[indices]) // balances
+        # balances of the accounts receiving the highest and the lowest amounts and the percentiles of the amounts,
+        # which are sorted in the opposite order of the balances
+        perc_indices = [int(np.ceil((p / 100) * num_users)) - 1 for p in [25, 50, 75]]
+        positions = [0, num_users - 1] + [num_users - 1 - idx for idx in perc_indices]
+        partitioned_balances = np.partition(balances, np.unique(positions))
+        inverse_sum = float(np.sum(1 / balances))
+        return [amount] + [int(amount / (inverse_sum * partitioned_balances[position])) for position in positions]
+
+    def accounts_above(self, maximum):
+        """
+        Addresses of the eligible accounts whose balance is greater than maximum (the one of the triggers), in the order of their slots.
+        The accounts whose units exceed the tolerance are settled as well.
+        """
+        end = np.searchsorted(self.sorted_triggers, self.credit, side='right')
+        indices = self.sorted_indices[self.position:end]
+        candidates = indices[self.stamps[indices] == self.sorted_stamps[self.position:end]].tolist()
+        self.position = max(self.position, end)
+
+        while len(self.heap) > 0 and self.heap[0][0] <= self.credit:
+            _, index, stamp = heapq.heappop(self.heap)
+            if self.stamps[index] == stamp:
+                candidates.append(index)
+
+        above = []
+        for index in candidates:
+            if self._settle(index) > maximum:
+                above.append(index)
+            else:
+                # the trigger is computed again from the settled balance
+                self._push(index)
 
-    return block
+        return [self.reverse_dictionary[index] for index in sorted(above)]
+
+def get_block(filename):
+    # same decoding of the blocks stored in the archive segments (see storage/block_archive.py)
+    with open(filename, 'rb') as file:
+        return decode_block(file.read(), 'npz' if filename.endswith('.npz') else 'txt')
 
 def extract_height_from_name(file):
-    return int(file.replace('block_', '').replace('.txt', ''))
+    return int(os.path.splitext(file)[0].replace('block_', ''))
+
+def list_block_files(dir_sorted_blocks):
+    # height: name of the file, if both formats are available for the same height the columnar one is preferred
+    files = {}
+    for file in os.listdir(dir_sorted_blocks):
+        if not file.startswith('block_'):
+            continue
+        if file.endswith('.npz') or (file.endswith('.txt') and extract_height_from_name(file) not in files):
+            files[extract_height_from_name(file)] = file
+
+    return [files[height] for height in sorted(files)]
+
+def blocks_use_address_ids(dir_sorted_blocks, files):
+    # columnar blocks written together with the address table (see data_main.py) have no address table of their own
+    if len(files) == 0 or not files[0].endswith('.npz'):
+        return False
+    with np.load(os.path.join(dir_sorted_blocks, files[0]), allow_pickle=False) as data:
+        return 'addresses' not in data.files
 
 def distribute(extra_fee_amount, num_outputs):
     base, extra = divmod(extra_fee_amount, num_outputs)
@@ -104,6 +576,171 @@ def distribute(extra_fee_amount, num_outputs):
         result[:extra] += 1
     return result
 
+def output_extra_fees(output_value, tx_outputs, extra_fee_amount, extra_fee_percentage):
+    """
+    Returns the extra fee paid on each output (extra_fee_amount per transaction split among its outputs as distribute does,
+    plus extra_fee_percentage of the output) and the total extra fee computed as a percentage of the outputs.
+    """
+    extra_fees = np.zeros(len(output_value), dtype=np.int64)
+
+    if extra_fee_amount > 0:
+        # the first extra_fee_amount % num_outputs outputs of each transaction pay one more unit
+        base, extra = np.divmod(extra_fee_amount, tx_outputs)
+        output_index = np.arange(len(output_value)) - np.repeat(np.cumsum(tx_outputs) - tx_outputs, tx_outputs)
+        extra_fees += np.repeat(base, tx_outputs) + (output_index < np.repeat(extra, tx_outputs))
+
+    total_extra_fee_percentage = 0
+    if extra_fee_percentage > 0.0:
+        extra_fees_percentage = np.floor(extra_fee_percentage * output_value).astype(np.int64)
+        total_extra_fee_percentage = int(extra_fees_percentage.sum())
+        extra_fees += extra_fees_percentage
+
+    return extra_fees, total_extra_fee_percentage
+
+def block_delta_payments(block, extra_fee_amount, extra_fee_percentage):
+    """
+    Returns the addresses touched by a block collapsed by storage/block_deltas.py, the amounts to be added to them
+    (an int64 array, net of the extra fees paid on their outputs) and the total extra fee computed as a percentage of the outputs.
+    """
+    columns = block.columns
+    extra_fees, total_extra_fee_percentage = output_extra_fees(np.asarray(columns['output_value']), np.asarray(columns['tx_outputs']), extra_fee_amount, extra_fee_percentage)
+
+    payments = np.array(columns['delta_value'], dtype=np.int64)
+    output_delta = np.asarray(columns['output_delta'])
+    valid = output_delta >= 0
+    np.subtract.at(payments, output_delta[valid], extra_fees[valid])
+
+    return columns['delta_address'].tolist(), payments, total_extra_fee_percentage
+
+def block_operations(block, extra_fee_amount, extra_fee_percentage):
+    """
+    Returns the inputs and outputs of the block (coinbase excluded) in the order in which perform_block_transactions applies them:
+    the account of each operation (codes, positions in accounts), its signed amount (net of the extra fees paid on the outputs)
+    and the total extra fee computed as a percentage of the outputs. Inputs and outputs of 'INVALID' and 'UNKNOWN' are left out.
+    """
+    if isinstance(block, ColumnarBlock) and 'script_class' not in block.columns:
+        columns = block.columns
+        input_offsets, input_address, input_value = columns['input_offsets'], columns['input_address'], columns['input_value']
+        output_offsets, output_address, output_value = columns['output_offsets'], columns['output_address'], columns['output_value']
+        # keys are positions in the address table of the block, or global ids (see storage/address_table.py)
+        table = columns['addresses'] if 'addresses' in columns else None
+    else:
+        # same columns of block_to_columns, keys are positions in table
+        account_keys = {}
+        input_offsets, input_address, input_value = [0], [], []
+        output_offsets, output_address, output_value = [0], [], []
+        for transaction in block['Transactions']:
+            for input in transaction['Inputs']:
+                input_address.append(-1 if input['Sender'] == 'INVALID' or input['Sender'] == 'UNKNOWN' else account_keys.setdefault(input['Sender'], len(account_keys)))
+                input_value.append(input['Value'])
+            input_offsets.append(len(input_value))
+            for output in transaction['Outputs']:
+                output_address.append(-1 if output['Receiver'] == 'INVALID' or output['Receiver'] == 'UNKNOWN' else account_keys.setdefault(output['Receiver'], len(account_keys)))
+                output_value.append(output['Value'])
+            output_offsets.append(len(output_value))
+
+        input_offsets, input_address, input_value, output_offsets, output_address, output_value = (np.array(column, dtype=np.int64) for column in (
+            input_offsets, input_address, input_value, output_offsets, output_address, output_value))
+        table = list(account_keys)
+
+    # skip coinbase transaction
+    input_address, input_value = input_address[input_offsets[1]:], input_value[input_offsets[1]:]
+    output_address, output_value = output_address[output_offsets[1]:], output_value[output_offsets[1]:]
+    tx_inputs, tx_outputs = np.diff(input_offsets)[1:], np.diff(output_offsets)[1:]
+
+    # the inputs of a transaction are applied before its outputs, both after all the operations of the previous transactions
+    input_order = np.arange(len(input_value)) + np.repeat(np.cumsum(tx_outputs) - tx_outputs, tx_inputs)
+    output_order = np.arange(len(output_value)) + np.repeat(np.cumsum(tx_inputs), tx_outputs)
+    extra_fees, total_extra_fee_percentage = output_extra_fees(output_value, tx_outputs, extra_fee_amount, extra_fee_percentage)
+
+    keys = np.empty(len(input_value) + len(output_value), dtype=np.int64)
+    amounts = np.empty(len(keys), dtype=np.int64)
+    keys[input_order], amounts[input_order] = input_address, -input_value
+    keys[output_order], amounts[output_order] = output_address, output_value - extra_fees
+
+    # negative keys are INVALID_ADDRESS and UNKNOWN_ADDRESS
+    valid = keys >= 0
+    keys, codes = np.unique(keys[valid], return_inverse=True)
+    if table is None:
+        accounts = keys.tolist()
+    elif isinstance(table, np.ndarray):
+        accounts = table[keys].tolist()
+    else:
+        accounts = [table[key] for key in keys.tolist()]
+
+    return codes, accounts, amounts[valid], total_extra_fee_percentage
+
+def apply_block_operations(eligible_accounts, non_eligible_accounts, codes, accounts, amounts, redistribution_minimum, redistribution_maximum):
+    """
+    Applies the operations returned by block_operations to the accounts (an AccountStore and a dictionary of integer balances),
+    with the same result of applying them one at a time: the balance after each operation is computed for all of them at once,
+    and only the operations moving an account across redistribution_minimum or redistribution_maximum are replayed, in their order,
+    so that the accounts take the same slots.
+    """
+    if len(codes) == 0:
+        return eligible_accounts, non_eligible_accounts
+
+    # balance before the block and state of each account: 2 eligible, 1 non eligible, 0 never seen
+    initial_balances = np.zeros(len(accounts), dtype=np.int64)
+    initial_states = np.zeros(len(accounts), dtype=np.int8)
+    for code, account in enumerate(accounts):
+        if eligible_accounts.contains_key(account):
+            initial_balances[code] = eligible_accounts.get_balance(account)
+            initial_states[code] = 2
+        elif account in non_eligible_accounts:
+            initial_balances[code] = non_eligible_accounts[account]
+            initial_states[code] = 1
+
+    # operations grouped by account, in the order of the block within each account
+    order = np.argsort(codes, kind='stable')
+    codes, amounts = codes[order], amounts[order]
+    starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1])))
+    ends = np.concatenate((starts[1:], [len(codes)])) - 1
+
+    # balance after each operation: balance before the block plus the amounts of the account up to the operation
+    cumulative = np.cumsum(amounts)
+    cumulative_before_account = np.repeat(cumulative[starts] - amounts[starts], ends - starts + 1)
+    balances = initial_balances[codes] + cumulative - cumulative_before_account
+    eligible_after = (redistribution_minimum <= balances) & (balances <= redistribution_maximum)
+    eligible_before = np.empty(len(codes), dtype=bool)
+    eligible_before[1:] = eligible_after[:-1]
+    eligible_before[starts] = initial_states[codes[starts]] == 2
+
+    # operations moving an account into or out of eligible_accounts, and the first ones of the accounts never seen that are not eligible
+    first_unseen = np.zeros(len(codes), dtype=bool)
+    first_unseen[starts] = initial_states[codes[starts]] == 0
+    transitions = np.flatnonzero((eligible_before != eligible_after) | (first_unseen & ~eligible_after))
+
+    # balance before each operation
+    previous_balances = np.empty(len(codes), dtype=np.int64)
+    previous_balances[1:] = balances[:-1]
+    previous_balances[starts] = initial_balances[codes[starts]]
+
+    for position in transitions[np.argsort(order[transitions])].tolist():
+        account = accounts[codes[position]]
+        # the final balances are written once all the operations have been replayed
+        # (a removed account leaves in its slot the last balance it had while eligible)
+        if eligible_after[position]:
+            if account in non_eligible_accounts:
+                del non_eligible_accounts[account]
+            eligible_accounts.add(account, balances[position])
+        else:
+            if eligible_before[position]:
+                eligible_accounts.update_balance(account, previous_balances[position])
+                _ = eligible_accounts.remove(account)
+            non_eligible_accounts[account] = 0
+
+    final_balances = balances[ends]
+    final_eligible = eligible_after[ends]
+    final_accounts = [accounts[code] for code in codes[ends].tolist()]
+
+    eligible_accounts.update_balances([account for account, eligible in zip(final_accounts, final_eligible.tolist()) if eligible], final_balances[final_eligible])
+    for account, balance in zip(final_accounts, final_balances.tolist()):
+        if account in non_eligible_accounts:
+            non_eligible_accounts[account] = balance
+
+    return eligible_accounts, non_eligible_accounts
+
 def _process_balance_chunk(chunk):
     local_counts = {'= 0': 0, '0 ~ 10000': 0, '10000 ~ 1000000': 0, '1000000 ~ 100000000': 0, '> 100000000': 0}
 
@@ -3,7 +3,7 @@ from wealth_metrics.gini_coefficient import gini
 from wealth_metrics.nakamoto_coefficient import nakamoto
 from wealth_metrics.charts import plot_gini_coefficient_for_taxation, plot_nakamoto_coefficient_for_taxation
 from redistribution_space.redistribution_for_taxation import redistribution_for_taxation
-from utils import read_redistribution_csv_file
+from result_utils import read_redistribution_csv_file
 
 dir_sorted_blocks = './result/blocks/' # Directory where sorted blocks are saved
 dir_results = './result/WorkstationResults' # Directory where to store the results
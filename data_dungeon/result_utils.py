@@ -3,6 +3,7 @@ import pandas as pd
 from queue import Queue
 from tqdm import tqdm
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from storage.address_table import find_address_ids
 
 # Exchanges, ETF, Custodial Companies addresses in the top 500 holders (and two of Satoshi's addresses)
 known_wallets = set(['1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa', '12cbQLTFMXRnSzktFkuoG3eHoMeFtpTu3S',
@@ -30,10 +31,14 @@ known_wallets = set(['1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa', '12cbQLTFMXRnSzktFkuo
                      'bc1q7ramrn7krmgl8ja8vjm9g25a5t98l6kfyqgewe', '3L41yRzWATBFS3TSHGxFAJiTxahB94MpcQ', 'bc1q0dfgg0phamhxyntrenylv98epwn69fq9mwmaz0', 
                      '3E5EPMGRL5PC6YDCLcHLVu9ayC3DysMpau', 'bc1qs5vdqkusz4v7qac8ynx0vt9jrekwuupx2fl5udp9jql3sr03z3gsr2mf0f', 'bc1qmxcagqze2n4hr5rwflyfu35q90y22raxdgcp4p'])
 
-def _process_redistribution_balance_chunk(chunk):
+def known_wallet_keys():
+    # accounts may be stored by address id (see storage/address_table.py), so the ids of the known wallets are excluded as well
+    return known_wallets | set(find_address_ids(known_wallets).values())
+
+def _process_redistribution_balance_chunk(chunk, excluded_wallets):
     # save each chunk by selecting only addresses that satisfy the assumptions
     filtered_chunk = chunk[
-            (~chunk['address'].isin(known_wallets)) & (chunk['balance'] >= 100000)
+            (~chunk['address'].isin(excluded_wallets)) & (chunk['balance'] >= 100000)
         ]
         
     # Extract balances and calculate the total sum in a vectorized manner
@@ -45,6 +50,7 @@ def _process_redistribution_balance_chunk(chunk):
 def read_redistribution_csv_file(csv_file, percentage ,chunk_size=10000000):
     balances = []
     total_sum = 0
+    excluded_wallets = known_wallet_keys()
 
     aggregation_queue = Queue(maxsize=10)
 
@@ -68,7 +74,7 @@ def read_redistribution_csv_file(csv_file, percentage ,chunk_size=10000000):
         
         with ProcessPoolExecutor() as processors:
             for chunk in tqdm(pd.read_csv(csv_file, chunksize=chunk_size), desc=f'Reading accounts_{percentage} file in chunks'):
-                aggregation_queue.put(processors.submit(_process_redistribution_balance_chunk, chunk))
+                aggregation_queue.put(processors.submit(_process_redistribution_balance_chunk, chunk, excluded_wallets))
             
             aggregation_queue.put(None)
             
@@ -91,10 +97,10 @@ def _process_multi_input_redistribution_balance_chunk(chunk, users):
 
     return chunk_balances, chunk_total_sum
 
-def _process_multi_input_redistribution_account_chunk(chunk):
+def _process_multi_input_redistribution_account_chunk(chunk, excluded_wallets):
     # save each chunk by selecting only addresses that satisfy the assumptions
     filtered_chunk = chunk[
-            (chunk['address'].isin(known_wallets))
+            (chunk['address'].isin(excluded_wallets))
         ]
         
     to_be_deleted = filtered_chunk['user'].tolist()
@@ -104,6 +110,7 @@ def _process_multi_input_redistribution_account_chunk(chunk):
 
 def read_multi_input_redistribution_csv_file(csv_file_accounts, csv_file_balances, percentage ,chunk_size=10000000):
     aggregation_queue = Queue(maxsize=10)
+    excluded_wallets = known_wallet_keys()
 
     users = set([])
     to_be_deleted_users = set([])
@@ -128,7 +135,7 @@ def read_multi_input_redistribution_csv_file(csv_file_accounts, csv_file_balance
     
     with ProcessPoolExecutor() as processors:
         for chunk in tqdm(pd.read_csv(csv_file_accounts, chunksize=chunk_size), desc=f'Reading accounts_{percentage} file in chunks'):
-            future = processors.submit(_process_multi_input_redistribution_account_chunk, chunk)
+            future = processors.submit(_process_multi_input_redistribution_account_chunk, chunk, excluded_wallets)
             to_be_deleted, all_users = future.result()
 
             to_be_deleted_users.update(to_be_deleted)
@@ -0,0 +1,77 @@
+import os
+
+# file shared by the extractor (data_main.py) and the utxo importer (utxo.py)
+DEFAULT_ADDRESS_TABLE = './result/addresses.txt'
+
+class AddressTable:
+    """
+    Persistent dictionary address <---> dense id (0, 1, 2, ...).
+    Addresses are appended to a text file (one per line, the id is the line number), so ids never change once assigned.
+    Only one process at a time should add addresses to the same file.
+    """
+    def __init__(self, path=DEFAULT_ADDRESS_TABLE):
+        self.path = path
+        self.ids = {}
+        self.addresses = []
+
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    address = line.rstrip('\n')
+                    self.ids[address] = len(self.addresses)
+                    self.addresses.append(address)
+
+        # number of addresses already written to the file
+        self.saved = len(self.addresses)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __contains__(self, address):
+        return address in self.ids
+
+    def get_id(self, address):
+        """Returns the id of the address, assigning the next one if the address is new."""
+        id = self.ids.get(address)
+        if id is None:
+            id = len(self.addresses)
+            self.ids[address] = id
+            self.addresses.append(address)
+        return id
+
+    def get_ids(self, addresses):
+        return [self.get_id(address) for address in addresses]
+
+    def lookup(self, address):
+        """Returns the id of the address, None if it has never been added."""
+        return self.ids.get(address)
+
+    def get_address(self, id):
+        return self.addresses[id]
+
+    def save(self):
+        """Appends the addresses added since the last save to the file."""
+        if self.saved == len(self.addresses):
+            return
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(''.join(address + '\n' for address in self.addresses[self.saved:]))
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.saved = len(self.addresses)
+
+def find_address_ids(addresses, path=DEFAULT_ADDRESS_TABLE):
+    """Returns {address: id} for the given addresses that are in the table, without loading the whole table in memory."""
+    addresses = set(addresses)
+    ids = {}
+
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            for id, line in enumerate(f):
+                address = line.rstrip('\n')
+                if address in addresses:
+                    ids[address] = id
+
+    return ids
@@ -0,0 +1,214 @@
+import io
+import os
+import re
+import json
+import bisect
+import struct
+import numpy as np
+import zstandard
+from concurrent.futures import ThreadPoolExecutor
+from storage.columnar_blocks import ColumnarBlock, load_columnar_block
+
+# Segment layout:
+# - header: magic, format of the blocks ('txt' or 'npz'), number of blocks
+# - one zstd frame per block (the content of the block_<height>.<format> file written by data_main.py)
+# - index: heights (int64), followed by the offsets of the frames (int64, plus the end of the last frame)
+# - trailer: position of the index
+SEGMENT_MAGIC = b'BLKA'
+HEADER = struct.Struct('<4s3sI')
+TRAILER = struct.Struct('<Q')
+
+def segment_name(segment):
+    return f'segment_{segment:06d}.blka'
+
+# -------------------------------------------------------
+# Decoding of the blocks (shared with redistribution_space.utils.get_block)
+# -------------------------------------------------------
+
+def clean_string_for_json_conversion(str):
+    return re.sub(r'er\': \[.*?\]', 'er\': \'INVALID\'', str).replace('er\': None', 'er\': \'INVALID\'').replace(' b\'', ' \'').replace('\'', '\"')
+
+def decode_block(data, block_format):
+    """Returns the block stored in data, the content of a block_<height>.<block_format> file."""
+    # columnar blocks are loaded without any text parsing
+    if block_format == 'npz':
+        return ColumnarBlock(load_columnar_block(io.BytesIO(data)))
+
+    block_str = data.decode('utf-8').split('\n', 1)[0]
+    return json.loads(clean_string_for_json_conversion(block_str))
+
+# -------------------------------------------------------
+# Used by the extractor (data_main.py)
+# -------------------------------------------------------
+
+def write_segment(path, block_format, blocks, level=3):
+    """Writes the (height, data) pairs, sorted by height, in a single segment file."""
+    compressor = zstandard.ZstdCompressor(level=level)
+    heights = []
+    offsets = []
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(SEGMENT_MAGIC, block_format.encode('ascii'), len(blocks)))
+        for height, data in blocks:
+            heights.append(height)
+            offsets.append(f.tell())
+            f.write(compressor.compress(data))
+        offsets.append(f.tell())
+
+        index_pos = f.tell()
+        f.write(np.array(heights, dtype=np.int64).tobytes())
+        f.write(np.array(offsets, dtype=np.int64).tobytes())
+        f.write(TRAILER.pack(index_pos))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def pack_blocks(dir_blocks, dir_archive, block_format, heights, segment_size=1000, level=3):
+    """
+    Packs the block_<height>.<block_format> files of dir_blocks into segments of segment_size consecutive heights
+    (segment i holds the heights from i * segment_size to (i + 1) * segment_size - 1).
+    Segments already holding all the given heights of their range are not written again.
+    """
+    os.makedirs(dir_archive, exist_ok=True)
+
+    heights_per_segment = {}
+    for height in sorted(heights):
+        heights_per_segment.setdefault(height // segment_size, []).append(height)
+
+    packed = 0
+    for segment, segment_heights in sorted(heights_per_segment.items()):
+        path = os.path.join(dir_archive, segment_name(segment))
+        if os.path.exists(path) and read_segment_index(path)[1].tolist() == segment_heights:
+            continue
+
+        blocks = []
+        for height in segment_heights:
+            with open(os.path.join(dir_blocks, f'block_{height}.{block_format}'), 'rb') as f:
+                blocks.append((height, f.read()))
+        write_segment(path, block_format, blocks, level)
+        packed += 1
+
+    return packed
+
+# -------------------------------------------------------
+# Used by the simulations
+# -------------------------------------------------------
+
+def read_segment_index(path):
+    """Returns the format, the heights and the frame offsets of a segment."""
+    with open(path, 'rb') as f:
+        magic, block_format, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f'{path} is not a block archive segment')
+
+        f.seek(-TRAILER.size, os.SEEK_END)
+        index_pos = TRAILER.unpack(f.read(TRAILER.size))[0]
+        f.seek(index_pos)
+        index = np.frombuffer(f.read(8 * (2 * count + 1)), dtype=np.int64)
+
+    return block_format.decode('ascii'), index[:count], index[count:]
+
+class BlockArchive:
+    """
+    Reader of the segments written by pack_blocks, restricted to the heights from first_height to last_height (None for no limit).
+    Besides get_block and iter_blocks, it can replace the reader threads of the engines (see feed), like file_parsing.block_stream.BlockStream.
+    """
+    def __init__(self, dir_archive, first_height=None, last_height=None, readahead=1):
+        self.dir_archive = dir_archive
+        # number of segments read in advance by iter_blocks
+        self.readahead = readahead
+        self.decompressor = zstandard.ZstdDecompressor()
+
+        # only the indexes are read, each segment is opened when its blocks are needed
+        self.segments = []
+        self.block_format = None
+        for name in sorted(os.listdir(dir_archive)):
+            if not name.startswith('segment_') or not name.endswith('.blka'):
+                continue
+            path = os.path.join(dir_archive, name)
+            block_format, heights, offsets = read_segment_index(path)
+            selected = np.ones(len(heights), dtype=bool)
+            if first_height is not None:
+                selected &= heights >= first_height
+            if last_height is not None:
+                selected &= heights <= last_height
+            if not selected.any():
+                continue
+            if self.block_format is not None and block_format != self.block_format:
+                raise ValueError(f'{path} holds {block_format} blocks, the other segments {self.block_format} blocks')
+            self.block_format = block_format
+            self.segments.append((path, heights[selected], offsets[:-1][selected], offsets[1:][selected]))
+
+        self.segments.sort(key=lambda segment: segment[1][0])
+        self.first_heights = [segment[1][0] for segment in self.segments]
+
+    def __len__(self):
+        return sum(len(segment[1]) for segment in self.segments)
+
+    @property
+    def first_height(self):
+        return int(self.first_heights[0])
+
+    def heights(self):
+        return [int(height) for segment in self.segments for height in segment[1]]
+
+    @property
+    def uses_address_ids(self):
+        # columnar blocks interned in the address table (see storage/address_table.py) have no address table of their own
+        if self.block_format != 'npz' or len(self.segments) == 0:
+            return False
+        return 'addresses' not in self.get_block(self.first_height).columns
+
+    def _locate(self, height):
+        segment = bisect.bisect_right(self.first_heights, height) - 1
+        if segment >= 0:
+            heights = self.segments[segment][1]
+            index = np.searchsorted(heights, height)
+            if index < len(heights) and heights[index] == height:
+                return segment, index
+        raise KeyError(f'block {height} is not in the archive')
+
+    def get_block(self, height):
+        segment, index = self._locate(height)
+        path, _, starts, ends = self.segments[segment]
+        with open(path, 'rb') as f:
+            f.seek(starts[index])
+            frame = f.read(ends[index] - starts[index])
+
+        return decode_block(self.decompressor.decompress(frame), self.block_format)
+
+    def _read_range(self, segment, first, last):
+        # frames from first to last (included) of the segment, read with a single sequential read
+        path, _, starts, ends = self.segments[segment]
+        with open(path, 'rb') as f:
+            f.seek(starts[first])
+            return f.read(ends[last] - starts[first])
+
+    def iter_blocks(self, start=None, end=None):
+        """Yields (height, block) for the heights from start to end (included) in order, reading the next segments in the background."""
+        # (segment, first, last) positions of the frames to be read in each segment
+        ranges = []
+        for segment, (_, heights, _, _) in enumerate(self.segments):
+            first = 0 if start is None else np.searchsorted(heights, start, side='left')
+            last = len(heights) - 1 if end is None else np.searchsorted(heights, end, side='right') - 1
+            if first <= last:
+                ranges.append((segment, first, last))
+
+        with ThreadPoolExecutor(max_workers=1) as reader:
+            pending = [reader.submit(self._read_range, *segment_range) for segment_range in ranges[:self.readahead + 1]]
+            for i, (segment, first, last) in enumerate(ranges):
+                data = pending.pop(0).result()
+                if i + self.readahead + 1 < len(ranges):
+                    pending.append(reader.submit(self._read_range, *ranges[i + self.readahead + 1]))
+
+                _, heights, starts, ends = self.segments[segment]
+                base = starts[first]
+                for index in range(first, last + 1):
+                    frame = data[starts[index] - base:ends[index] - base]
+                    yield int(heights[index]), decode_block(self.decompressor.decompress(frame), self.block_format)
+
+    def feed(self, block_queue):
+        """Puts (height, block) items in block_queue in height order, waiting whenever it is full."""
+        for item in self.iter_blocks():
+            block_queue.put(item)
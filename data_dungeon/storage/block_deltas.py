@@ -0,0 +1,266 @@
+import os
+import numpy as np
+from tqdm import tqdm
+from storage.columnar_blocks import ColumnarBlock, INVALID_ADDRESS, UNKNOWN_ADDRESS
+from storage.block_prefetcher import BlockPrefetcher
+from redistribution_space.utils import list_block_files
+
+# Layout of a deltas directory (written once by build_block_deltas, memory-mapped by BlockDeltas):
+# - one raw int64 file per column, holding the rows of all the blocks one after the other
+# - index.npz: height, reward, fees and number of transactions of each block, plus the offsets of the rows of each block in every column
+#   (the rows of block i in column c are c[offsets[i]:offsets[i + 1]])
+# Columns (all transactions but the coinbase are collapsed, since the simulations apply their outputs and inputs in the same way):
+# - delta_address, delta_value: address ids touched by the block (in the order of their first input or output) and their net amount (received - sent), zeros included
+# - output_delta, output_value: for each output, the position of its receiver in delta_address (-1 if not an account) and its value
+# - tx_outputs: number of outputs of each transaction (to split the extra fee per transaction among its outputs)
+# - coinbase_address, coinbase_value: outputs of the coinbase transaction (INVALID_ADDRESS / UNKNOWN_ADDRESS if not an account)
+COLUMNS = {
+    'delta_address': 'delta',
+    'delta_value': 'delta',
+    'output_delta': 'output',
+    'output_value': 'output',
+    'tx_outputs': 'tx',
+    'coinbase_address': 'coinbase',
+    'coinbase_value': 'coinbase',
+}
+INDEX_NAME = 'index.npz'
+# redistributions whose results do not depend on the slots of the accounts, the only ones that can be applied to block deltas:
+# the net amounts hide the accounts crossing the minimum or the maximum and back within a block, which changes their slots
+DELTA_REDISTRIBUTION_TYPES = ('no_redistribution', 'equal', 'no_minimum_equal')
+
+def column_path(dir_deltas, column):
+    return os.path.join(dir_deltas, f'{column}.bin')
+
+# -------------------------------------------------------
+# Used by the extractor (data_main.py)
+# -------------------------------------------------------
+
+def _account_key(address, address_table):
+    # same accounts of the simulations: None and lists (multisig public keys) are not accounts either
+    if address is None or address == 'INVALID' or isinstance(address, list):
+        return INVALID_ADDRESS
+    if address == 'UNKNOWN':
+        return UNKNOWN_ADDRESS
+    if isinstance(address, int):
+        return address
+    if address_table is None:
+        raise ValueError('An address table is needed to build the deltas of blocks referencing addresses by string')
+    return address_table.get_id(address.decode('utf-8') if isinstance(address, bytes) else address)
+
+def block_arrays(block, address_table=None):
+    """Returns the account keys and values of the inputs and outputs of the block, with the offsets of each transaction (as in block_to_columns)."""
+    if isinstance(block, ColumnarBlock) and 'script_class' not in block.columns:
+        columns = block.columns
+        input_address, output_address = columns['input_address'], columns['output_address']
+        if 'addresses' in columns:
+            # positions in the address table of the block, the last two positions map UNKNOWN_ADDRESS (-2) and INVALID_ADDRESS (-1) to themselves
+            if address_table is None:
+                raise ValueError('An address table is needed to build the deltas of blocks referencing addresses by string')
+            ids = np.array(address_table.get_ids(columns['addresses'].tolist()) + [UNKNOWN_ADDRESS, INVALID_ADDRESS], dtype=np.int64)
+            input_address, output_address = ids[input_address], ids[output_address]
+        return (columns['input_offsets'], input_address, columns['input_value'],
+                columns['output_offsets'], output_address, columns['output_value'])
+
+    input_offsets, input_address, input_value = [0], [], []
+    output_offsets, output_address, output_value = [0], [], []
+    for transaction in block['Transactions']:
+        for input in transaction['Inputs']:
+            input_address.append(_account_key(input['Sender'], address_table))
+            input_value.append(input['Value'])
+        input_offsets.append(len(input_value))
+        for output in transaction['Outputs']:
+            output_address.append(_account_key(output['Receiver'], address_table))
+            output_value.append(output['Value'])
+        output_offsets.append(len(output_value))
+
+    return tuple(np.array(column, dtype=np.int64) for column in (input_offsets, input_address, input_value, output_offsets, output_address, output_value))
+
+def block_to_deltas(block, address_table=None):
+    """Collapses a block into the columns of COLUMNS."""
+    input_offsets, input_address, input_value, output_offsets, output_address, output_value = block_arrays(block, address_table)
+
+    # the coinbase transaction is the first one, it has no inputs to be considered
+    input_address, input_value = input_address[input_offsets[1]:], input_value[input_offsets[1]:]
+    coinbase_address, coinbase_value = output_address[:output_offsets[1]], output_value[:output_offsets[1]]
+    output_address, output_value = output_address[output_offsets[1]:], output_value[output_offsets[1]:]
+
+    tx_inputs, tx_outputs = np.diff(input_offsets)[1:], np.diff(output_offsets)[1:]
+
+    # position of each input and output in the order of the simulations (see block_operations in redistribution_space/utils.py)
+    input_order = np.arange(len(input_value)) + np.repeat(np.cumsum(tx_outputs) - tx_outputs, tx_inputs)
+    output_order = np.arange(len(output_value)) + np.repeat(np.cumsum(tx_inputs), tx_outputs)
+
+    valid_inputs = input_address >= 0
+    valid_outputs = output_address >= 0
+    keys, inverse = np.unique(np.concatenate((output_address[valid_outputs], input_address[valid_inputs])), return_inverse=True)
+    # the addresses are kept in the order in which the block touches them first, so that they take the same slots in the accounts
+    first_touch = np.full(len(keys), len(input_value) + len(output_value), dtype=np.int64)
+    np.minimum.at(first_touch, inverse, np.concatenate((output_order[valid_outputs], input_order[valid_inputs])))
+    order = np.argsort(first_touch)
+    ranks = np.empty(len(keys), dtype=np.int64)
+    ranks[order] = np.arange(len(keys))
+    delta_address, inverse = keys[order], ranks[inverse]
+    delta_value = np.zeros(len(delta_address), dtype=np.int64)
+    np.add.at(delta_value, inverse, np.concatenate((output_value[valid_outputs], -input_value[valid_inputs])))
+
+    output_delta = np.full(len(output_address), -1, dtype=np.int64)
+    output_delta[valid_outputs] = inverse[:np.count_nonzero(valid_outputs)]
+
+    return {
+        'delta_address': delta_address.astype(np.int64),
+        'delta_value': delta_value,
+        'output_delta': output_delta,
+        'output_value': output_value.astype(np.int64),
+        'tx_outputs': tx_outputs.astype(np.int64),
+        'coinbase_address': coinbase_address.astype(np.int64),
+        'coinbase_value': coinbase_value.astype(np.int64),
+    }
+
+def build_block_deltas(dir_sorted_blocks, dir_deltas, address_table=None, files=None):
+    """
+    Collapses the blocks of dir_sorted_blocks (all of them if files is None) into the columns of dir_deltas, replacing the previous ones.
+    Blocks referencing addresses by string need an address table (see storage/address_table.py), blocks interned in it are read as they are.
+    """
+    files = list_block_files(dir_sorted_blocks) if files is None else files
+    os.makedirs(dir_deltas, exist_ok=True)
+    # the index is written last, so a directory without it is never read
+    if os.path.exists(os.path.join(dir_deltas, INDEX_NAME)):
+        os.remove(os.path.join(dir_deltas, INDEX_NAME))
+
+    heights, rewards, fees, num_transactions = [], [], [], []
+    offsets = {group: [0] for group in set(COLUMNS.values())}
+    column_files = {column: open(column_path(dir_deltas, column), 'wb') for column in COLUMNS}
+    try:
+        for height, block in tqdm(BlockPrefetcher(dir_sorted_blocks, files), total=len(files), desc='Building block deltas'):
+            columns = block_to_deltas(block, address_table)
+            for column in COLUMNS:
+                column_files[column].write(columns[column].tobytes())
+            # the columns of the same group have the same number of rows
+            rows = {group: len(columns[column]) for column, group in COLUMNS.items()}
+            for group in offsets:
+                offsets[group].append(offsets[group][-1] + rows[group])
+
+            heights.append(height)
+            rewards.append(block['Reward'])
+            fees.append(block['Fees'])
+            num_transactions.append(len(columns['tx_outputs']) + 1)
+    finally:
+        for f in column_files.values():
+            f.close()
+
+    # the new addresses are saved before the deltas referencing them
+    if address_table is not None:
+        address_table.save()
+
+    np.savez(os.path.join(dir_deltas, INDEX_NAME),
+             height=np.array(heights, dtype=np.int64), reward=np.array(rewards, dtype=np.int64),
+             fees=np.array(fees, dtype=np.int64), num_transactions=np.array(num_transactions, dtype=np.int64),
+             **{f'{group}_offsets': np.array(group_offsets, dtype=np.int64) for group, group_offsets in offsets.items()})
+
+    return len(heights)
+
+# -------------------------------------------------------
+# Used by the simulations
+# -------------------------------------------------------
+
+class DeltaTransactions:
+    """Transactions of a BlockDelta: only their number and the coinbase transaction (with the layout of blk_parser) are kept."""
+    def __init__(self, num_transactions, coinbase_address, coinbase_value):
+        self.num_transactions = num_transactions
+        self.coinbase_address = coinbase_address
+        self.coinbase_value = coinbase_value
+
+    def __len__(self):
+        return self.num_transactions
+
+    def __getitem__(self, index):
+        if index != 0:
+            raise TypeError('Only the coinbase transaction is stored in block deltas (see storage/block_deltas.py)')
+        addresses = ['INVALID' if key == INVALID_ADDRESS else 'UNKNOWN' if key == UNKNOWN_ADDRESS else key for key in self.coinbase_address.tolist()]
+        return {'Inputs': [], 'Outputs': [{'Receiver': address, 'Value': value} for address, value in zip(addresses, self.coinbase_value.tolist())]}
+
+    def __iter__(self):
+        raise TypeError('The transactions of block deltas cannot be iterated (see storage/block_deltas.py)')
+
+class BlockDelta:
+    """
+    Block collapsed by block_to_deltas: the columns are views of the memory-mapped files of BlockDeltas.
+    'Reward', 'Fees' and the coinbase transaction are read as in a block dictionary.
+    """
+    def __init__(self, height, reward, fees, num_transactions, columns):
+        self.height = height
+        self.reward = reward
+        self.fees = fees
+        self.columns = columns
+        self.transactions = DeltaTransactions(num_transactions, columns['coinbase_address'], columns['coinbase_value'])
+
+    def __getitem__(self, key):
+        if key == 'Transactions':
+            return self.transactions
+        elif key == 'Reward':
+            return self.reward
+        elif key == 'Fees':
+            return self.fees
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in ('Transactions', 'Reward', 'Fees')
+
+class BlockDeltas:
+    """
+    Reader of the deltas written by build_block_deltas, restricted to the heights from first_height to last_height (None for no limit).
+    It can replace the reader threads of redistribution_paradise and only_redistribution_paradise (see feed), like storage.block_archive.BlockArchive.
+    Only the redistributions of DELTA_REDISTRIBUTION_TYPES can be applied: with them the balances, the eligible and non eligible accounts
+    and the redistribution metrics are the same of the blocks (the float balances of no_minimum_equal may differ in the last digits,
+    since the net amount of each address is added at once). The slots of the accounts are the same as well, unless an account crosses
+    the minimum or the maximum and back within a block, so the accounts may be written in a different order.
+    """
+    def __init__(self, dir_deltas, first_height=None, last_height=None):
+        with np.load(os.path.join(dir_deltas, INDEX_NAME), allow_pickle=False) as data:
+            self.index = {key: data[key] for key in data.files}
+
+        selected = np.ones(len(self.index['height']), dtype=bool)
+        if first_height is not None:
+            selected &= self.index['height'] >= first_height
+        if last_height is not None:
+            selected &= self.index['height'] <= last_height
+        self.positions = np.flatnonzero(selected)
+
+        # the columns are never loaded in memory, each block is a view of the mapped files
+        self.columns = {}
+        for column in COLUMNS:
+            path = column_path(dir_deltas, column)
+            self.columns[column] = np.memmap(path, dtype=np.int64, mode='r') if os.path.getsize(path) > 0 else np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def first_height(self):
+        return int(self.index['height'][self.positions[0]])
+
+    def heights(self):
+        return self.index['height'][self.positions].tolist()
+
+    @property
+    def uses_address_ids(self):
+        # addresses are always stored by id
+        return True
+
+    def get_block(self, position):
+        columns = {}
+        for column, group in COLUMNS.items():
+            offsets = self.index[f'{group}_offsets']
+            columns[column] = self.columns[column][offsets[position]:offsets[position + 1]]
+
+        return BlockDelta(int(self.index['height'][position]), int(self.index['reward'][position]), int(self.index['fees'][position]),
+                          int(self.index['num_transactions'][position]), columns)
+
+    def __iter__(self):
+        for position in self.positions.tolist():
+            yield int(self.index['height'][position]), self.get_block(position)
+
+    def feed(self, block_queue):
+        """Puts (height, block) items in block_queue in height order, waiting whenever it is full."""
+        for item in self:
+            block_queue.put(item)
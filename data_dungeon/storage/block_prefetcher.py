@@ -0,0 +1,118 @@
+import os
+import time
+import threading
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from redistribution_space.utils import get_block, extract_height_from_name, blocks_use_address_ids
+
+class BlockPrefetcher:
+    """
+    Reader of the block_<height> files of a directory: a pool of processes decodes the blocks ahead of the simulation, and the decoded
+    blocks wait in a reorder buffer until all the previous ones have been consumed, so they are always returned in height order.
+    The blocks submitted and not yet consumed take at most max_buffered_bytes (measured on the size of their files).
+    It replaces the reader threads of the engines, like file_parsing.block_stream.BlockStream and storage.block_archive.BlockArchive.
+    """
+    def __init__(self, dir_sorted_blocks, files, num_processors=None, max_buffered_bytes=256 * 2**20):
+        self.dir_sorted_blocks = dir_sorted_blocks
+        # files are expected to be sorted by height (see list_block_files)
+        self.files = files
+        self.heights = [extract_height_from_name(file) for file in files]
+        self.sizes = [os.path.getsize(os.path.join(dir_sorted_blocks, file)) for file in files]
+        self.num_processors = num_processors or os.cpu_count() or 1
+        self.max_buffered_bytes = max_buffered_bytes
+
+        # shared by the submitting thread, the callbacks of the decoded blocks and the consumer
+        self.condition = threading.Condition()
+        # position of the block in files: future of its decoding
+        self.buffer = {}
+        self.buffered_bytes = 0
+        self.closed = False
+
+        # counters: blocks and bytes consumed, times the consumer had to wait for the next block and total waiting time
+        self.consumed_blocks = 0
+        self.consumed_bytes = 0
+        self.stalls = 0
+        self.stall_time = 0.0
+        self.elapsed = 0.0
+
+    def __len__(self):
+        return len(self.files)
+
+    @property
+    def first_height(self):
+        return self.heights[0]
+
+    @property
+    def uses_address_ids(self):
+        return blocks_use_address_ids(self.dir_sorted_blocks, self.files)
+
+    def stats(self):
+        elapsed = self.elapsed or 1e-9
+        return {
+            'blocks': self.consumed_blocks,
+            'blocks_per_second': self.consumed_blocks / elapsed,
+            'mb_per_second': self.consumed_bytes / elapsed / 2**20,
+            'stalls': self.stalls,
+            'stall_time': self.stall_time,
+        }
+
+    def _submit_blocks(self, processors):
+        for index, file in enumerate(self.files):
+            with self.condition:
+                # the next block is submitted as soon as it fits in the buffer (it is always submitted if the buffer is empty)
+                self.condition.wait_for(lambda: self.closed or self.buffered_bytes == 0 or self.buffered_bytes + self.sizes[index] <= self.max_buffered_bytes)
+                if self.closed:
+                    return
+                self.buffered_bytes += self.sizes[index]
+
+            future = processors.submit(get_block, os.path.join(self.dir_sorted_blocks, file))
+            future.add_done_callback(partial(self._decoded, index))
+
+    def _decoded(self, index, future):
+        with self.condition:
+            self.buffer[index] = future
+            self.condition.notify_all()
+
+    def __iter__(self):
+        """Yields (height, block) in height order, waiting for the blocks not yet decoded."""
+        start_time = time.time()
+        processors = ProcessPoolExecutor(max_workers=self.num_processors)
+        submitter = threading.Thread(target=self._submit_blocks, args=(processors,), daemon=True)
+        submitter.start()
+
+        try:
+            for index in range(len(self.files)):
+                with self.condition:
+                    if index not in self.buffer:
+                        self.stalls += 1
+                        stall_start = time.time()
+                        self.condition.wait_for(lambda: index in self.buffer)
+                        self.stall_time += time.time() - stall_start
+                    future = self.buffer.pop(index)
+
+                # errors of the worker are raised here
+                block = future.result()
+
+                with self.condition:
+                    self.buffered_bytes -= self.sizes[index]
+                    self.condition.notify_all()
+                self.consumed_blocks += 1
+                self.consumed_bytes += self.sizes[index]
+                self.elapsed = time.time() - start_time
+
+                yield self.heights[index], block
+        finally:
+            with self.condition:
+                self.closed = True
+                self.condition.notify_all()
+            submitter.join()
+            processors.shutdown(cancel_futures=True)
+
+    def feed(self, block_queue):
+        """Puts (height, block) items in block_queue in height order, waiting whenever it is full."""
+        for item in self:
+            block_queue.put(item)
+
+        stats = self.stats()
+        print(f'Prefetcher: {stats["blocks"]} blocks, {stats["blocks_per_second"]:.1f} blocks/s, {stats["mb_per_second"]:.2f} MB/s, '
+              f'{stats["stalls"]} stalls ({stats["stall_time"]:.2f} s)')
@@ -0,0 +1,217 @@
+import io
+import numpy as np
+from utils.batch_address_encoding import SCRIPT_CLASSES, receiver_from_script
+
+# address keys used for inputs and outputs whose address could not be retrieved
+INVALID_ADDRESS = -1
+UNKNOWN_ADDRESS = -2
+
+# -------------------------------------------------------
+# Used by the extractor (data_main.py)
+# -------------------------------------------------------
+
+def _address_key(address, addresses):
+    # None (address not retrievable) and lists (multisig public keys) are both treated as INVALID by the simulations
+    if address is None or address == 'INVALID' or isinstance(address, list):
+        return INVALID_ADDRESS
+    if address == 'UNKNOWN':
+        return UNKNOWN_ADDRESS
+    if isinstance(address, bytes):
+        address = address.decode('utf-8')
+
+    key = addresses.get(address)
+    if key is None:
+        key = len(addresses)
+        addresses[address] = key
+
+    return key
+
+def _script_key(script, scripts):
+    key = scripts.get(script)
+    if key is None:
+        key = len(scripts)
+        scripts[script] = key
+
+    return key
+
+def block_to_columns(block):
+    """
+    Converts a block dictionary (as returned by blk_parser.block_parsing) into a dictionary of NumPy arrays.
+    If the outputs have a 'Script' (blk_parser.parse_block with lazy_receivers), their scripts are stored in place of their addresses.
+    """
+    # address: position in the address table of the block
+    addresses = {}
+    # (script class, payload): position in the script table of the block
+    scripts = {}
+    lazy_receivers = False
+
+    input_offsets = [0]
+    input_addresses = []
+    input_values = []
+
+    output_offsets = [0]
+    output_addresses = []
+    output_values = []
+
+    for transaction in block['Transactions']:
+        for input in transaction['Inputs']:
+            input_addresses.append(_address_key(input['Sender'], addresses))
+            input_values.append(input['Value'])
+        input_offsets.append(len(input_values))
+
+        for output in transaction['Outputs']:
+            if 'Script' in output:
+                lazy_receivers = True
+                output_addresses.append(_script_key(output['Script'], scripts))
+            else:
+                output_addresses.append(_address_key(output['Receiver'], addresses))
+            output_values.append(output['Value'])
+        output_offsets.append(len(output_values))
+
+    columns = {
+        'block_hash': np.array(block.get('Block Hash', '')),
+        'previous_block_hash': np.array(block.get('Previous Block Hash', '')),
+        'reward': np.array(block['Reward'], dtype=np.int64),
+        'fees': np.array(block['Fees'], dtype=np.int64),
+        # addresses are stored once per block, inputs and outputs refer to them through their position
+        'addresses': np.array(list(addresses.keys()), dtype=str),
+        # transaction boundaries: inputs (outputs) of transaction i are in [offsets[i], offsets[i + 1])
+        'input_offsets': np.array(input_offsets, dtype=np.int64),
+        'input_address': np.array(input_addresses, dtype=np.int64),
+        'input_value': np.array(input_values, dtype=np.int64),
+        'output_offsets': np.array(output_offsets, dtype=np.int64),
+        'output_address': np.array(output_addresses, dtype=np.int64),
+        'output_value': np.array(output_values, dtype=np.int64),
+    }
+
+    if lazy_receivers:
+        # output_address refers to the script table: script i is script_payload[script_offsets[i]:script_offsets[i + 1]]
+        # of class SCRIPT_CLASSES[script_class[i]], its address is computed only when the output is read
+        payloads = [payload for _, payload in scripts]
+        columns['script_class'] = np.array([SCRIPT_CLASSES.index(script_class) for script_class, _ in scripts], dtype=np.uint8)
+        columns['script_offsets'] = np.cumsum([0] + [len(payload) for payload in payloads], dtype=np.int64)
+        columns['script_payload'] = np.frombuffer(b''.join(payloads), dtype=np.uint8)
+
+    return columns
+
+def intern_block_addresses(columns, address_table):
+    """
+    Replaces the address table of the block with the ids of a global AddressTable (see storage/address_table.py):
+    input_address and output_address then contain global ids (or INVALID_ADDRESS / UNKNOWN_ADDRESS).
+    Blocks storing the scripts of their outputs are not supported, since their addresses are not known.
+    """
+    if 'script_class' in columns:
+        raise ValueError('The addresses of blocks with lazy receivers cannot be interned')
+    columns = dict(columns)
+    # the last two positions map INVALID_ADDRESS (-1) and UNKNOWN_ADDRESS (-2) to themselves
+    ids = np.array(address_table.get_ids(columns.pop('addresses').tolist()) + [UNKNOWN_ADDRESS, INVALID_ADDRESS], dtype=np.int64)
+
+    columns['input_address'] = ids[columns['input_address']]
+    columns['output_address'] = ids[columns['output_address']]
+
+    return columns
+
+def columnar_block_bytes(columns):
+    # np.savez stores each array in binary form, no pickling and no text conversion
+    buffer = io.BytesIO()
+    np.savez(buffer, **columns)
+    return buffer.getvalue()
+
+# -------------------------------------------------------
+# Used by the simulations
+# -------------------------------------------------------
+
+def load_columnar_block(path):
+    """Loads a block written from columnar_block_bytes (a .npz file) and returns its arrays."""
+    with np.load(path, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+def _global_address(key):
+    # global ids are returned as they are, INVALID_ADDRESS and UNKNOWN_ADDRESS as the strings used by the simulations
+    if key >= 0:
+        return key
+    return 'INVALID' if key == INVALID_ADDRESS else 'UNKNOWN'
+
+class ColumnarTransactions:
+    """Sequence of transactions built on demand from the columns of a block (same layout as blk_parser)."""
+    def __init__(self, columns):
+        if 'addresses' in columns:
+            self.addresses = columns['addresses'].tolist() + ['UNKNOWN', 'INVALID']
+        else:
+            # addresses are referenced by their global id (see intern_block_addresses), which is used as the address itself
+            self.addresses = None
+
+        if 'script_class' in columns:
+            # outputs refer to the scripts of the block (see block_to_columns), each of them is converted once, when first read
+            offsets = columns['script_offsets'].tolist()
+            payload = columns['script_payload'].tobytes()
+            self.scripts = [(SCRIPT_CLASSES[script_class], payload[offsets[i]:offsets[i + 1]]) for i, script_class in enumerate(columns['script_class'].tolist())]
+            self.receivers = [None] * len(self.scripts)
+        else:
+            self.scripts = None
+
+        self.input_offsets = columns['input_offsets'].tolist()
+        self.input_address = columns['input_address'].tolist()
+        self.input_value = columns['input_value'].tolist()
+
+        self.output_offsets = columns['output_offsets'].tolist()
+        self.output_address = columns['output_address'].tolist()
+        self.output_value = columns['output_value'].tolist()
+
+    def __len__(self):
+        return len(self.input_offsets) - 1
+
+    def _receiver(self, key):
+        receiver = self.receivers[key]
+        if receiver is None:
+            receiver = receiver_from_script(*self.scripts[key])
+            self.receivers[key] = receiver
+        return receiver
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('transaction index out of range')
+
+        # negative keys (INVALID_ADDRESS, UNKNOWN_ADDRESS) point to the last two elements of self.addresses
+        address_of = self.addresses.__getitem__ if self.addresses is not None else _global_address
+        receiver_of = self._receiver if self.scripts is not None else address_of
+
+        inputs = [{'Sender': address_of(key), 'Value': value} for key, value in zip(
+            self.input_address[self.input_offsets[index]:self.input_offsets[index + 1]],
+            self.input_value[self.input_offsets[index]:self.input_offsets[index + 1]])]
+
+        outputs = [{'Receiver': receiver_of(key), 'Value': value} for key, value in zip(
+            self.output_address[self.output_offsets[index]:self.output_offsets[index + 1]],
+            self.output_value[self.output_offsets[index]:self.output_offsets[index + 1]])]
+
+        return {'Inputs': inputs, 'Outputs': outputs}
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+class ColumnarBlock:
+    """Read-only view of a columnar block that can be used wherever a block dictionary is expected."""
+    def __init__(self, columns):
+        self.columns = columns
+        self._transactions = None
+
+    def __getitem__(self, key):
+        if key == 'Transactions':
+            if self._transactions is None:
+                self._transactions = ColumnarTransactions(self.columns)
+            return self._transactions
+        elif key == 'Reward':
+            return int(self.columns['reward'])
+        elif key == 'Fees':
+            return int(self.columns['fees'])
+        elif key == 'Block Hash':
+            return str(self.columns['block_hash'])
+        elif key == 'Previous Block Hash':
+            return str(self.columns['previous_block_hash'])
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in ('Transactions', 'Reward', 'Fees', 'Block Hash', 'Previous Block Hash')
@@ -0,0 +1,93 @@
+import os
+import zlib
+import sqlite3
+
+# file (inside the directory of the extracted blocks) where the manifest is stored
+MANIFEST_NAME = 'manifest.db'
+
+def checksum(data):
+    return zlib.crc32(data)
+
+def write_atomically(path, data):
+    """Writes data to a temporary file which then replaces path, returns the length and the checksum of data."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    # a crash can only leave the temporary file behind, never a truncated path
+    os.replace(tmp_path, path)
+
+    return len(data), checksum(data)
+
+class ExtractionManifest:
+    """
+    Record of the blocks extracted in a directory (see data_main.py): for each height and format it stores the position of the block
+    in the blk*.dat and rev*.dat files, the name of the output file, its length and its checksum.
+    A block is recorded only after its output file has been completely written, so blocks not in the manifest have to be extracted.
+    """
+    def __init__(self, dir_results):
+        self.dir_results = dir_results
+        os.makedirs(dir_results, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(dir_results, MANIFEST_NAME))
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS blocks (
+                    height INTEGER,
+                    format TEXT,
+                    file INTEGER,
+                    data_pos INTEGER,
+                    undo_pos INTEGER,
+                    name TEXT,
+                    length INTEGER,
+                    checksum INTEGER,
+                    PRIMARY KEY (height, format)
+                );
+            """)
+
+        # format: heights of the recorded blocks, kept in memory so that checking a block does not require any query
+        self.heights = {}
+        for height, block_format in self.conn.execute('SELECT height, format FROM blocks;'):
+            self.heights.setdefault(block_format, set()).add(height)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def contains(self, height, block_format):
+        return height in self.heights.get(block_format, ())
+
+    def recorded_heights(self):
+        """Returns the heights recorded in any format."""
+        return set().union(*self.heights.values())
+
+    def record(self, entries):
+        """Records (height, format, file, data_pos, undo_pos, name, length, checksum) entries in a single transaction."""
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?, ?, ?, ?);', entries)
+        for entry in entries:
+            self.heights.setdefault(entry[1], set()).add(entry[0])
+
+    def remove(self, heights, block_format):
+        with self.conn:
+            self.conn.executemany('DELETE FROM blocks WHERE height = ? AND format = ?;', [(height, block_format) for height in heights])
+        self.heights.get(block_format, set()).difference_update(heights)
+
+    def verify(self, block_format):
+        """Returns the (height, file, data_pos, undo_pos) of the recorded blocks whose output file is missing or has a different length or checksum."""
+        corrupted = []
+        cursor = self.conn.execute('SELECT height, file, data_pos, undo_pos, name, length, checksum FROM blocks WHERE format = ? ORDER BY height;', (block_format,))
+        for height, file, data_pos, undo_pos, name, length, expected_checksum in cursor:
+            path = os.path.join(self.dir_results, name)
+            if os.path.exists(path) and os.path.getsize(path) == length:
+                with open(path, 'rb') as f:
+                    if checksum(f.read()) == expected_checksum:
+                        continue
+            corrupted.append((height, file, data_pos, undo_pos))
+
+        return corrupted
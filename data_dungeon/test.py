@@ -1,23 +1,44 @@
 from tests import test_only_redistribution as only
 from tests import test_redistribution as red
 from tests import test_adjusted_redistribution as adj
+from tests import test_extraction as ext
 
 # selection of set to test
 # 1 -> only redistribution
 # 2 -> redistribution
 # 3 -> adjusted redistribution
+# 4 -> extraction
 test = 3
 
 if test == 1:
     only.test_perform_input_output()
     only.test_perform_block_transactions()
+    only.test_perform_block_transactions_deltas()
+    only.test_perform_redistribution_deltas()
     only.test_perform_redistribution()
     only.test_perform_coinbase_transaction()
 elif test == 2:
     red.test_perform_input_output()
     red.test_perform_block_transactions()
+    red.test_perform_block_transactions_columnar()
+    red.test_perform_block_transactions_kernel()
+    red.test_perform_block_transactions_deltas()
+    red.test_perform_redistribution_deltas()
+    red.test_account_store()
+    red.test_lazy_account_store()
+    red.test_weighted_account_store()
     red.test_perform_redistribution()
 elif test == 3:
     adj.test_perform_input_output()
     adj.test_perform_block_transactions()
-    adj.test_perform_redistribution()
\ No newline at end of file
+    adj.test_perform_redistribution()
+elif test == 4:
+    ext.test_parse_block()
+    ext.test_parse_undo_block()
+    ext.test_extract_large_blocks()
+    ext.test_extract_lazy_receivers()
+    ext.test_extraction_manifest()
+    ext.test_block_archive()
+    ext.test_chainstate_extraction()
+    ext.test_utxo_rewind()
+    ext.test_block_prefetcher()
\ No newline at end of file
@@ -0,0 +1,271 @@
+import os
+import mmap
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+import data_main
+from benchmark_space.synthetic_chain import generate_chain
+from utils.batch_address_encoding import classify_script, receiver_from_script
+from file_parsing.blk_parser import parse_block
+from file_parsing.rev_parser import parse_undo_block
+from file_parsing.block_stream import merge_undo_block
+from storage.extraction_manifest import ExtractionManifest
+from storage.block_archive import pack_blocks, BlockArchive
+from storage.block_prefetcher import BlockPrefetcher
+from redistribution_space.utils import get_block, list_block_files
+from utxo_hub.address_extraction import NOT_ACCOUNTS
+from utxo_hub.chainstate_extraction import chainstate_extraction
+from utxo_hub.utxo_rewind import utxo_rewind
+
+# small chain written by benchmark_space/synthetic_chain.py, spread over several blk/rev files
+NUM_BLOCKS = 8
+TXS_PER_BLOCK = 20
+BLOCKS_PER_FILE = 3
+
+def generate_test_chain(dir_test):
+    # entries = [(height, file, data_pos, undo_pos)], transactions = [(height, [(spent outputs, (value, script) of the outputs)])]
+    transactions = []
+    entries, utxos = generate_chain(os.path.join(dir_test, 'chain'), NUM_BLOCKS, TXS_PER_BLOCK, BLOCKS_PER_FILE, chainstate=True, transactions=transactions)
+    return entries, utxos, dict(transactions)
+
+def address(script):
+    return receiver_from_script(*classify_script(script))
+
+def expected_transactions(contents):
+    # (senders and values, receivers and values) of the generated transactions, the coinbase input has no sender (INVALID once written)
+    return [([(address(utxo['script']), utxo['value']) for utxo in spent] or [('INVALID', 0)], [(address(script), value) for value, script in outputs])
+            for spent, outputs in contents]
+
+def block_transactions(block):
+    return [([(input['Sender'] if input['Sender'] is not None else 'INVALID', input['Value']) for input in transaction['Inputs']],
+             [(output['Receiver'], output['Value']) for output in transaction['Outputs']]) for transaction in block['Transactions']]
+
+@contextmanager
+def extraction_settings(dir_test, **settings):
+    # module variables of data_main, restored once the blocks have been extracted
+    settings = {'dir_blocks': os.path.join(dir_test, 'chain', 'blocks'), 'num_processors': 2, 'address_table_file': os.path.join(dir_test, 'addresses.txt'), **settings}
+    previous = {name: getattr(data_main, name) for name in settings}
+    for name, value in settings.items():
+        setattr(data_main, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(data_main, name, value)
+
+def extract_test_blocks(dir_test, entries, dir_results, block_format='txt', **settings):
+    os.makedirs(dir_results, exist_ok=True)
+    with extraction_settings(dir_test, **settings):
+        data_main.extract_blocks(entries, dir_results, parse_block, block_format, 'Writing blocks')
+
+@contextmanager
+def working_directory(path):
+    # the accounts databases are in ./result/utxo/
+    previous = os.getcwd()
+    os.makedirs(os.path.join(path, 'result', 'utxo'), exist_ok=True)
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+def read_accounts():
+    conn = sqlite3.connect('./result/utxo/accounts.db')
+    accounts = dict(conn.execute('SELECT address, balance FROM accounts;').fetchall())
+    conn.close()
+    return accounts
+
+def utxo_balances(utxos):
+    balances = {}
+    for utxo in utxos:
+        receiver = address(utxo['script'])
+        if receiver not in NOT_ACCOUNTS:
+            balances[receiver] = balances.get(receiver, 0) + utxo['value']
+    return balances
+
+def test_parse_block():
+    with tempfile.TemporaryDirectory() as dir_test:
+        entries, _, transactions = generate_test_chain(dir_test)
+
+        previous_block_hash = None
+        for height, file, data_pos, _ in entries:
+            with open(os.path.join(dir_test, 'chain', 'blocks', f'blk{file:05d}.dat'), 'rb') as blk_f, mmap.mmap(blk_f.fileno(), 0, prot=mmap.PROT_READ) as blk_data:
+                block = parse_block(blk_data, data_pos - 8)
+
+            # without the undo data, the inputs are only counted (their senders and values are in rev*.dat)
+            expected = expected_transactions(transactions[height])
+            assert [len(inputs) for inputs, _ in expected] == [len(transaction['Inputs']) for transaction in block['Transactions']]
+            assert [outputs for _, outputs in expected] == [outputs for _, outputs in block_transactions(block)]
+            assert block['Reward'] == sum(value for value, _ in transactions[height][0][1])
+            assert previous_block_hash is None or block['Previous Block Hash'] == previous_block_hash
+            previous_block_hash = block['Block Hash']
+
+    print('Test passed: parse the generated blocks')
+
+def test_parse_undo_block():
+    with tempfile.TemporaryDirectory() as dir_test:
+        entries, _, transactions = generate_test_chain(dir_test)
+
+        for height, file, data_pos, undo_pos in entries:
+            with open(os.path.join(dir_test, 'chain', 'blocks', f'blk{file:05d}.dat'), 'rb') as blk_f, open(os.path.join(dir_test, 'chain', 'blocks', f'rev{file:05d}.dat'), 'rb') as rev_f, \
+                    mmap.mmap(blk_f.fileno(), 0, prot=mmap.PROT_READ) as blk_data, mmap.mmap(rev_f.fileno(), 0, prot=mmap.PROT_READ) as rev_data:
+                undo_block = parse_undo_block(rev_data, undo_pos - 8)
+                block = merge_undo_block(parse_block(blk_data, data_pos - 8), undo_block)
+
+            # the coinbase transaction spends nothing, so it is not in the undo data
+            assert [[(output['Address'], output['Amount']) for output in spent_outputs] for spent_outputs in undo_block] == \
+                [[(address(utxo['script']), utxo['value']) for utxo in spent] for spent, _ in transactions[height][1:]]
+            assert block_transactions(block) == expected_transactions(transactions[height])
+            assert block['Fees'] == sum(utxo['value'] for spent, _ in transactions[height] for utxo in spent) - sum(value for _, outputs in transactions[height][1:] for value, _ in outputs)
+
+    print('Test passed: parse the generated blocks with their undo data')
+
+def test_extract_large_blocks():
+    with tempfile.TemporaryDirectory() as dir_test:
+        entries, _, transactions = generate_test_chain(dir_test)
+        dir_results = os.path.join(dir_test, 'blocks')
+
+        # every block is decoded in ranges of transactions by different workers
+        with extraction_settings(dir_test, large_block_transactions=5):
+            assert data_main.find_large_blocks(0, entries[:BLOCKS_PER_FILE]) == entries[:BLOCKS_PER_FILE]
+        extract_test_blocks(dir_test, entries, dir_results, num_processors=3, large_block_transactions=5)
+
+        for height in transactions:
+            assert block_transactions(get_block(os.path.join(dir_results, f'block_{height}.txt'))) == expected_transactions(transactions[height])
+
+    print('Test passed: extract large blocks in ranges of transactions')
+
+def test_extract_lazy_receivers():
+    with tempfile.TemporaryDirectory() as dir_test:
+        entries, _, transactions = generate_test_chain(dir_test)
+        dir_results = os.path.join(dir_test, 'blocks')
+
+        extract_test_blocks(dir_test, entries, dir_results, 'npz', LAZY_RECEIVERS=True)
+
+        # the output scripts are stored in place of the receivers, which are encoded only when read
+        for height in transactions:
+            block = get_block(os.path.join(dir_results, f'block_{height}.npz'))
+            assert 'script_class' in block.columns
+            assert block_transactions(block) == expected_transactions(transactions[height])
+        assert not os.path.exists(os.path.join(dir_test, 'addresses.txt'))
+
+    print('Test passed: extract blocks with lazy receivers')
+
+def test_extraction_manifest():
+    with tempfile.TemporaryDirectory() as dir_test:
+        entries, _, transactions = generate_test_chain(dir_test)
+        dir_results = os.path.join(dir_test, 'blocks')
+
+        # an interrupted run: only the first blocks are recorded, and the file of the next one is left truncated
+        extract_test_blocks(dir_test, entries[:4], dir_results)
+        with open(os.path.join(dir_results, 'block_5.txt'), 'wb') as file:
+            file.write(b'{')
+        written = {height: os.stat(os.path.join(dir_results, f'block_{height}.txt')).st_mtime_ns for height in range(1, 5)}
+
+        # the recorded blocks are skipped, the others are extracted
+        extract_test_blocks(dir_test, entries, dir_results)
+        assert {height: os.stat(os.path.join(dir_results, f'block_{height}.txt')).st_mtime_ns for height in range(1, 5)} == written
+        with ExtractionManifest(dir_results) as manifest:
+            assert manifest.recorded_heights() == set(transactions)
+            assert manifest.verify('txt') == []
+
+        # a corrupted block is found by verify_blocks and extracted again
+        with open(os.path.join(dir_results, 'block_3.txt'), 'r+b') as file:
+            file.truncate(10)
+        with extraction_settings(dir_test):
+            data_main.verify_blocks(dir_results, parse_block, 'txt')
+        with ExtractionManifest(dir_results) as manifest:
+            assert manifest.verify('txt') == []
+
+        for height in transactions:
+            assert block_transactions(get_block(os.path.join(dir_results, f'block_{height}.txt'))) == expected_transactions(transactions[height])
+
+    print('Test passed: resume and verify the extraction with the manifest')
+
+def test_block_archive():
+    with tempfile.TemporaryDirectory() as dir_test:
+        entries, _, transactions = generate_test_chain(dir_test)
+        dir_results = os.path.join(dir_test, 'blocks')
+        dir_archive = os.path.join(dir_test, 'archive')
+
+        extract_test_blocks(dir_test, entries, dir_results)
+        assert pack_blocks(dir_results, dir_archive, 'txt', set(transactions), segment_size=3) == 3
+
+        archive = BlockArchive(dir_archive)
+        assert len(archive) == NUM_BLOCKS
+        for height in reversed(list(transactions)):
+            assert block_transactions(archive.get_block(height)) == expected_transactions(transactions[height])
+        assert [(height, block_transactions(block)) for height, block in archive.iter_blocks()] == \
+            [(height, expected_transactions(transactions[height])) for height in transactions]
+
+        # heights crossing the boundaries of the segments
+        archive = BlockArchive(dir_archive, 2, 7)
+        assert [height for height, _ in archive.iter_blocks()] == list(range(2, 8))
+        assert [height for height, _ in archive.iter_blocks(3, 4)] == [3, 4]
+
+    print('Test passed: read the blocks packed in the archive')
+
+def test_chainstate_extraction():
+    with tempfile.TemporaryDirectory() as dir_test:
+        entries, utxos, _ = generate_test_chain(dir_test)
+        dir_results = os.path.join(dir_test, 'blocks')
+        extract_test_blocks(dir_test, entries[-1:], dir_results)
+
+        with working_directory(dir_test):
+            tip_hash = chainstate_extraction(os.path.join(dir_test, 'chain', 'chainstate'), num_processors=2)
+            accounts = read_accounts()
+
+        assert accounts == utxo_balances(utxos)
+        assert tip_hash == get_block(os.path.join(dir_results, f'block_{NUM_BLOCKS}.txt'))['Block Hash']
+
+    print('Test passed: read the balances of the chainstate')
+
+def test_utxo_rewind():
+    rewind_height = 5
+
+    with tempfile.TemporaryDirectory() as dir_test:
+        entries, utxos, transactions = generate_test_chain(dir_test)
+        dir_results = os.path.join(dir_test, 'blocks')
+        extract_test_blocks(dir_test, [entry for entry in entries if entry[0] > rewind_height], dir_results)
+
+        # outputs unspent after rewind_height: created up to it and not spent by then (the P2PK coins are only in the chainstate, they are never spent)
+        spent_later = [utxo for height, contents in transactions.items() if height > rewind_height for spent, _ in contents for utxo in spent]
+        rewind_utxos = [utxo for utxo in utxos + spent_later if utxo['height'] <= rewind_height or utxo['type'] == 'P2PK']
+
+        with working_directory(dir_test):
+            tip_hash = chainstate_extraction(os.path.join(dir_test, 'chain', 'chainstate'), num_processors=2)
+            utxo_rewind(dir_results, rewind_height, tip_hash)
+            accounts = read_accounts()
+
+        # the accounts emptied by the blocks undone are not removed, only the ones emptied by the rewind
+        assert {address: balance for address, balance in accounts.items() if balance != 0} == \
+            {address: balance for address, balance in utxo_balances(rewind_utxos).items() if balance != 0}
+
+    print('Test passed: rewind the balances of the chainstate')
+
+def test_block_prefetcher():
+    with tempfile.TemporaryDirectory() as dir_test:
+        entries, _, transactions = generate_test_chain(dir_test)
+        dir_results = os.path.join(dir_test, 'blocks')
+        extract_test_blocks(dir_test, entries, dir_results)
+        files = list_block_files(dir_results)
+
+        # with a budget smaller than a block, a single block at a time is decoded ahead of the consumer
+        for max_buffered_bytes in (1, 2 * max(os.path.getsize(os.path.join(dir_results, file)) for file in files)):
+            prefetcher = BlockPrefetcher(dir_results, files, num_processors=3, max_buffered_bytes=max_buffered_bytes)
+            items = []
+            for height, block in prefetcher:
+                assert prefetcher.buffered_bytes <= max(max_buffered_bytes, max(prefetcher.sizes))
+                items.append((height, block_transactions(block)))
+
+            assert items == [(height, expected_transactions(transactions[height])) for height in sorted(transactions)]
+            assert prefetcher.stats()['blocks'] == NUM_BLOCKS
+
+        # the consumer stops early: the pending blocks are dropped
+        prefetcher = BlockPrefetcher(dir_results, files, num_processors=2, max_buffered_bytes=1)
+        blocks = iter(prefetcher)
+        assert [next(blocks)[0] for _ in range(3)] == [1, 2, 3]
+        blocks.close()
+        assert prefetcher.closed
+
+    print('Test passed: prefetch the blocks in height order')
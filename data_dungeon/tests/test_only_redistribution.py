@@ -1,6 +1,9 @@
 import numpy as np
 from only_redistribution_space.utils import DoubleDictionaryDoubleList, DictionaryDoubleList
 from only_redistribution_space.only_redistribution_paradise import *
+import os
+import tempfile
+from storage.block_deltas import BlockDelta, BlockDeltas, DELTA_REDISTRIBUTION_TYPES, block_to_deltas, build_block_deltas
 
 def test_perform_input_output():
     eligible_addresses = {'bc12': 0, 'bc13': 1, 'bc14': 2}
@@ -237,6 +240,91 @@ def test_perform_block_transactions():
     print(f'- Non eligible accounts: {non_eligible_accounts.dictionary}, {non_eligible_accounts.first_list}')
     print(f'- Expected non eligible accounts: {expected_dict}, {expected_first_list}')
 
+def test_perform_block_transactions_deltas():
+    redistribution_minimum = 10
+    redistribution_maximum = 500
+    extra_fee_amount = 10
+    extra_fee_percentage = 0.1
+
+    # 19 and 18 take the slots freed by 12 and 13 in the order in which the block touches them, 13 and 16 keep their redistributions
+    block = {'Reward': 316227592, 'Fees': 3727592, 
+             'Transactions': [
+                 {'Inputs': [{'Sender': None, 'Value': 0}], 'Outputs': [{'Receiver': 12, 'Value': 700}]}, 
+                 {'Inputs': [{'Sender': 13, 'Value': 20}], 
+                  'Outputs': [{'Receiver': 19, 'Value': 200}, {'Receiver': 18, 'Value': 100}, {'Receiver': 'INVALID', 'Value': 50}]}, 
+                 {'Inputs': [{'Sender': 14, 'Value': 300}, {'Sender': 16, 'Value': 400}], 
+                  'Outputs': [{'Receiver': 15, 'Value': 300}, {'Receiver': 13, 'Value': 5}]}
+                 ]}
+
+    # the same block is executed both as it is and collapsed by block_to_deltas
+    results = []
+    for actual_block in [block, BlockDelta(1, block['Reward'], block['Fees'], len(block['Transactions']), block_to_deltas(block))]:
+        eligible_accounts = DoubleDictionaryDoubleList({12: 0, 13: 1, 14: 2}, np.array([100, 25, 320]), np.array([2, 2, 3]))
+        _ = eligible_accounts.remove(12)
+        non_eligible_accounts = DictionaryDoubleList({15: 0, 16: 1, 17: 2}, np.array([501, 750, 1000]), np.array([100, 100, 100]))
+
+        eligible_accounts, non_eligible_accounts, total_extra_fee_percentage = perform_block_transactions(eligible_accounts, non_eligible_accounts, 
+                                redistribution_minimum, redistribution_maximum, actual_block, extra_fee_amount, extra_fee_percentage)
+        eligible_accounts.perform_addition()
+        non_eligible_accounts.perform_addition()
+
+        results.append((list(eligible_accounts.dictionary.items()), eligible_accounts.first_list.tolist(), eligible_accounts.second_list.tolist(), 
+                        list(non_eligible_accounts.dictionary.items()), non_eligible_accounts.first_list.tolist(), non_eligible_accounts.second_list.tolist(), total_extra_fee_percentage))
+
+    assert results[0] == results[1], 'block deltas give different results'
+    print('Test passed: block deltas execution')
+
+def test_perform_redistribution_deltas():
+    redistribution_minimum = 100
+    redistribution_maximum = 1000
+
+    # 1 and 2 leave the eligible accounts and come back (2 first) within the block, so with the block they take different slots
+    block = {'Reward': 5000, 'Fees': 1201, 
+             'Transactions': [
+                 {'Inputs': [{'Sender': None, 'Value': 0}], 'Outputs': [{'Receiver': 'INVALID', 'Value': 5000}]}, 
+                 {'Inputs': [{'Sender': 1, 'Value': 450}, {'Sender': 2, 'Value': 450}], 'Outputs': [{'Receiver': 'INVALID', 'Value': 900}]}, 
+                 {'Inputs': [{'Sender': 4, 'Value': 900}], 'Outputs': [{'Receiver': 2, 'Value': 450}, {'Receiver': 1, 'Value': 450}]}
+                 ]}
+    block_delta = BlockDelta(1, block['Reward'], block['Fees'], len(block['Transactions']), block_to_deltas(block))
+
+    for redistribution_type in ['equal', 'no_minimum_equal', 'almost_equal', 'circular_queue_equal']:
+        # the same block is executed both as it is and collapsed by block_to_deltas, then the fees are redistributed
+        results = []
+        for actual_block in [block, block_delta]:
+            dtype = np.float64 if redistribution_type == 'no_minimum_equal' else np.int64
+            eligible_accounts = DoubleDictionaryDoubleList({1: 0, 2: 1, 3: 2}, np.array([500, 500, 500], dtype=dtype), np.array([2, 2, 3], dtype=dtype))
+            non_eligible_accounts = DictionaryDoubleList({4: 0}, np.array([5000], dtype=dtype), np.array([100], dtype=dtype))
+
+            eligible_accounts, non_eligible_accounts, total_extra_fee = perform_block_transactions(eligible_accounts, non_eligible_accounts, 
+                                    redistribution_minimum, redistribution_maximum, actual_block, 0, 0.0)
+            eligible_accounts, non_eligible_accounts, block_redistribution, _, _ = perform_redistribution(
+                redistribution_type, 'fees', redistribution_maximum, 1.0, 1.0, actual_block, total_extra_fee, 
+                eligible_accounts, non_eligible_accounts, 0)
+
+            accounts = {address: (accounts.get_balance(address), accounts.get_redistribution(address)) 
+                        for accounts in [eligible_accounts, non_eligible_accounts] for address in accounts.dictionary}
+            results.append((accounts, list(non_eligible_accounts.dictionary), block_redistribution))
+
+        if redistribution_type in DELTA_REDISTRIBUTION_TYPES:
+            assert results[0] == results[1], f'block deltas give different results with {redistribution_type}'
+        else:
+            # the unit left by the rounding goes to a different account, which is why the deltas are rejected
+            assert results[0][0] != results[1][0], f'block deltas give the same results with {redistribution_type}'
+
+    # the simulations refuse the deltas for the redistributions depending on the slots
+    with tempfile.TemporaryDirectory() as dir_test:
+        build_block_deltas(dir_test, os.path.join(dir_test, 'deltas'), files=[])
+        for redistribution_type in ['almost_equal', 'circular_queue_equal']:
+            try:
+                only_redistribution_paradise(dir_test, dir_test, redistribution_type, 0.5, 'fees', redistribution_minimum, redistribution_maximum, 1.0, 0, 0.0, 
+                                             BlockDeltas(os.path.join(dir_test, 'deltas')))
+                rejected = False
+            except ValueError:
+                rejected = True
+            assert rejected, f'block deltas accepted with {redistribution_type}'
+
+    print('Test passed: block deltas redistribution')
+
 def test_perform_redistribution():
     # Test for equal redistribution
     eligible_addresses = {'bc12': 0, 'bc13': 1, 'bc14': 2}
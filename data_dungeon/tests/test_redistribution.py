@@ -1,11 +1,15 @@
 import numpy as np
-from redistribution_space.utils import DoubleDictionaryList
+from redistribution_space.utils import AccountStore, LazyAccountStore, WeightedAccountStore
 from redistribution_space.redistribution_paradise import *
+from storage.columnar_blocks import ColumnarBlock, block_to_columns
+import os
+import tempfile
+from storage.block_deltas import BlockDelta, BlockDeltas, DELTA_REDISTRIBUTION_TYPES, block_to_deltas, build_block_deltas
 
 def test_perform_input_output():
     eligible_addresses = {'bc12': 0, 'bc13': 1, 'bc14': 2}
     eligible_balances = np.array([100, 25, 320])
-    eligible_accounts = DoubleDictionaryList(eligible_addresses, eligible_balances)
+    eligible_accounts = AccountStore(eligible_addresses, eligible_balances)
 
     non_eligible_accounts = {'bc15': 501, 'bc16': 750, 'bc17': 1000}
 
@@ -106,7 +110,7 @@ def test_perform_input_output():
 def test_perform_block_transactions():
     eligible_addresses = {'bc12': 0, 'bc13': 1, 'bc14': 2}
     eligible_balances = np.array([100, 25, 320])
-    eligible_accounts = DoubleDictionaryList(eligible_addresses, eligible_balances)
+    eligible_accounts = AccountStore(eligible_addresses, eligible_balances)
 
     non_eligible_accounts = {'bc15': 501, 'bc16': 750, 'bc17': 1000}
 
@@ -154,7 +158,7 @@ def test_perform_block_transactions():
     # an equal fraction of the fee is subtracted to each output
     eligible_addresses = {'bc12': 0, 'bc13': 1, 'bc14': 2}
     eligible_balances = np.array([100, 25, 320])
-    eligible_accounts = DoubleDictionaryList(eligible_addresses, eligible_balances)
+    eligible_accounts = AccountStore(eligible_addresses, eligible_balances)
 
     non_eligible_accounts = {'bc15': 501, 'bc16': 750, 'bc17': 1000}
 
@@ -185,7 +189,7 @@ def test_perform_block_transactions():
     # the same percentage is subtracted to each output
     eligible_addresses = {'bc12': 0, 'bc13': 1, 'bc14': 2}
     eligible_balances = np.array([100, 25, 320])
-    eligible_accounts = DoubleDictionaryList(eligible_addresses, eligible_balances)
+    eligible_accounts = AccountStore(eligible_addresses, eligible_balances)
 
     non_eligible_accounts = {'bc15': 501, 'bc16': 750, 'bc17': 1000}
 
@@ -213,11 +217,319 @@ def test_perform_block_transactions():
     print(f'- Non eligible accounts: {non_eligible_accounts}')
     print(f'- Expected non eligible accounts: {expected_dict}')
 
+def test_perform_block_transactions_columnar():
+    redistribution_minimum = 10
+    redistribution_maximum = 500
+    extra_fee_per_output = 10
+    extra_fee_percentage_per_output = 0.1
+
+    block = {'Block Hash': '000000000000000000004988528F7BE1744D4F05E706E33DDB36963236FC3C41', 
+             'Previous Block Hash': '00000000000000000000DF86517266E2DCE9766241C14FE224D5FED1C09F5F8D', 
+             'Reward': 316227592, 'Fees': 3727592, 
+             'Transactions': [
+                 {'Inputs': [{'Sender': None, 'Value': 0}], 
+                  'Outputs': [{'Receiver': 'bc12', 'Value': 700}, {'Receiver': 'INVALID', 'Value': 0}, {'Receiver': 'UNKNOWN', 'Value': 0}]}, 
+                  {'Inputs': [{'Sender': 'bc15', 'Value': 150}], 
+                   'Outputs': [{'Receiver': 'bc17', 'Value': 150}]}, 
+                    {'Inputs': [{'Sender': 'bc17', 'Value': 1000}, {'Sender': 'INVALID', 'Value': 20}], 
+                     'Outputs': [{'Receiver': 'bc13', 'Value': 500}, {'Receiver': 'bc16', 'Value': 500}]
+                     }
+                     ]}
+    
+    # the same block is executed as a dictionary and as a columnar block (through the block kernel), and one operation at a time (float balances)
+    results = []
+    for actual_block, dtype in [(block, np.int64), (ColumnarBlock(block_to_columns(block)), np.int64), (block, np.float64)]:
+        eligible_addresses = {'bc12': 0, 'bc13': 1, 'bc14': 2}
+        eligible_balances = np.array([100, 25, 320], dtype=dtype)
+        eligible_accounts = AccountStore(eligible_addresses, eligible_balances)
+
+        non_eligible_accounts = {'bc15': 501, 'bc16': 750, 'bc17': 1000}
+
+        eligible_accounts, non_eligible_accounts, total_extra_fee_percentage = perform_block_transactions(eligible_accounts, non_eligible_accounts, 
+                                redistribution_minimum, redistribution_maximum, actual_block, extra_fee_per_output, extra_fee_percentage_per_output)
+        eligible_accounts.perform_addition()
+
+        results.append((list(eligible_accounts.dictionary.items()), eligible_accounts.list.tolist(), list(eligible_accounts.invalid_elements), 
+                        list(non_eligible_accounts.items()), total_extra_fee_percentage))
+
+    assert results[0] == results[1], 'the columnar block gives different results from the dictionary'
+    assert results[0] == results[2], 'the block kernel gives different results from the operations applied one at a time'
+
+    columnar_block = ColumnarBlock(block_to_columns(block))
+    assert columnar_block['Reward'] == block['Reward'] and columnar_block['Fees'] == block['Fees']
+    assert len(columnar_block['Transactions']) == 3 and columnar_block['Transactions'][2]['Inputs'][1]['Sender'] == 'INVALID'
+    print('Test passed: columnar block execution')
+
+def test_perform_block_transactions_kernel():
+    redistribution_minimum = 10
+    redistribution_maximum = 500
+    extra_fee_amount = 10
+    extra_fee_percentage = 0.1
+
+    # bc13 and bc14 cross both thresholds more than once within the block
+    block = {'Reward': 316227592, 'Fees': 3727592, 
+             'Transactions': [
+                 {'Inputs': [{'Sender': None, 'Value': 0}], 'Outputs': [{'Receiver': 'bc12', 'Value': 700}]}, 
+                 {'Inputs': [{'Sender': 'bc13', 'Value': 20}, {'Sender': 'bc16', 'Value': 300}], 
+                  'Outputs': [{'Receiver': 'bc14', 'Value': 400}, {'Receiver': 'bc18', 'Value': 5}, {'Receiver': 'INVALID', 'Value': 50}]}, 
+                 {'Inputs': [{'Sender': 'bc14', 'Value': 600}, {'Sender': 'UNKNOWN', 'Value': 20}], 
+                  'Outputs': [{'Receiver': 'bc13', 'Value': 300}, {'Receiver': 'bc19', 'Value': 200}, {'Receiver': 'bc14', 'Value': 150}]},
+                 {'Inputs': [{'Sender': 'bc13', 'Value': 280}], 
+                  'Outputs': [{'Receiver': 'bc16', 'Value': 280}]}
+                 ]}
+
+    # integer balances are updated by the block kernel, float balances one input or output at a time
+    results = []
+    for dtype in [np.int64, np.float64]:
+        eligible_addresses = {'bc12': 0, 'bc13': 1, 'bc14': 2}
+        eligible_balances = np.array([100, 25, 320], dtype=dtype)
+        eligible_accounts = AccountStore(eligible_addresses, eligible_balances)
+        _ = eligible_accounts.remove('bc12')
+
+        non_eligible_accounts = {'bc15': 501, 'bc16': 750, 'bc17': 1000}
+
+        eligible_accounts, non_eligible_accounts, total_extra_fee_percentage = perform_block_transactions(eligible_accounts, non_eligible_accounts, 
+                                redistribution_minimum, redistribution_maximum, ColumnarBlock(block_to_columns(block)), extra_fee_amount, extra_fee_percentage)
+
+        # slots of the accounts, balances of the valid slots, freed slots (in the order in which they are reused) and non eligible accounts
+        results.append((list(eligible_accounts.dictionary.items()), eligible_accounts.list[eligible_accounts.valid_indices()].tolist(), 
+                        list(eligible_accounts.invalid_elements), list(non_eligible_accounts.items()), total_extra_fee_percentage))
+
+    # bc13 and bc14 leave and come back in each other's slots, then bc13 and bc16 leave (the same slots only if the crossings are replayed in order)
+    assert results[0] == results[1], 'the block kernel gives different results from the operations applied one at a time'
+    assert results[0][0] == [('bc14', 1), ('bc19', 3)] and results[0][2] == [2, 0], 'the block kernel does not replay the threshold crossings in order'
+    assert dict(results[0][3]) == {'bc15': 501, 'bc16': 692, 'bc17': 1000, 'bc18': 2, 'bc13': -9}
+    print('Test passed: block kernel execution')
+
+def test_perform_block_transactions_deltas():
+    redistribution_minimum = 10
+    redistribution_maximum = 500
+    extra_fee_amount = 10
+    extra_fee_percentage = 0.1
+
+    # 19 and 18 take the slots freed by 12 and 13 in the order in which the block touches them
+    block = {'Reward': 316227592, 'Fees': 3727592, 
+             'Transactions': [
+                 {'Inputs': [{'Sender': None, 'Value': 0}], 'Outputs': [{'Receiver': 12, 'Value': 700}]}, 
+                 {'Inputs': [{'Sender': 13, 'Value': 20}], 
+                  'Outputs': [{'Receiver': 19, 'Value': 200}, {'Receiver': 18, 'Value': 100}, {'Receiver': 'INVALID', 'Value': 50}]}, 
+                 {'Inputs': [{'Sender': 14, 'Value': 300}, {'Sender': 'UNKNOWN', 'Value': 20}], 
+                  'Outputs': [{'Receiver': 16, 'Value': 300}, {'Receiver': 13, 'Value': 5}]}
+                 ]}
+
+    # the same block is executed both as it is and collapsed by block_to_deltas
+    results = []
+    for actual_block in [block, BlockDelta(1, block['Reward'], block['Fees'], len(block['Transactions']), block_to_deltas(block))]:
+        eligible_addresses = {12: 0, 13: 1, 14: 2}
+        eligible_balances = np.array([100, 25, 320])
+        eligible_accounts = AccountStore(eligible_addresses, eligible_balances)
+        _ = eligible_accounts.remove(12)
+
+        non_eligible_accounts = {15: 501, 16: 750, 17: 1000}
+
+        eligible_accounts, non_eligible_accounts, total_extra_fee_percentage = perform_block_transactions(eligible_accounts, non_eligible_accounts, 
+                                redistribution_minimum, redistribution_maximum, actual_block, extra_fee_amount, extra_fee_percentage)
+        eligible_accounts.perform_addition()
+
+        results.append((list(eligible_accounts.dictionary.items()), eligible_accounts.list.tolist(), list(non_eligible_accounts.items()), total_extra_fee_percentage))
+
+    assert results[0] == results[1], 'block deltas give different results'
+    print('Test passed: block deltas execution')
+
+def test_perform_redistribution_deltas():
+    redistribution_minimum = 100
+    redistribution_maximum = 1000
+
+    # 1 and 2 leave the eligible accounts and come back (2 first) within the block, so with the block they take different slots
+    block = {'Reward': 5000, 'Fees': 1201, 
+             'Transactions': [
+                 {'Inputs': [{'Sender': None, 'Value': 0}], 'Outputs': [{'Receiver': 'INVALID', 'Value': 5000}]}, 
+                 {'Inputs': [{'Sender': 1, 'Value': 450}, {'Sender': 2, 'Value': 450}], 'Outputs': [{'Receiver': 'INVALID', 'Value': 900}]}, 
+                 {'Inputs': [{'Sender': 4, 'Value': 900}], 'Outputs': [{'Receiver': 2, 'Value': 450}, {'Receiver': 1, 'Value': 450}]}
+                 ]}
+    block_delta = BlockDelta(1, block['Reward'], block['Fees'], len(block['Transactions']), block_to_deltas(block))
+
+    for redistribution_type in ['equal', 'no_minimum_equal', 'almost_equal', 'circular_queue_equal']:
+        # the same block is executed both as it is and collapsed by block_to_deltas, then the fees are redistributed
+        results = []
+        for actual_block in [block, block_delta]:
+            dtype = np.float64 if redistribution_type == 'no_minimum_equal' else np.int64
+            eligible_accounts = AccountStore({1: 0, 2: 1, 3: 2}, np.array([500, 500, 500], dtype=dtype))
+            non_eligible_accounts = {4: 5000}
+
+            eligible_accounts, non_eligible_accounts, total_extra_fee = perform_block_transactions(eligible_accounts, non_eligible_accounts, 
+                                    redistribution_minimum, redistribution_maximum, actual_block, 0, 0.0)
+            redistribution, eligible_accounts, non_eligible_accounts, _, _, _ = perform_redistribution(
+                redistribution_type, 'fees', redistribution_maximum, 1.0, 1.0, actual_block, 0, total_extra_fee, 
+                [0], eligible_accounts, non_eligible_accounts, 0)
+
+            balances = {address: eligible_accounts.get_balance(address) for address in eligible_accounts.dictionary}
+            results.append((balances, non_eligible_accounts, redistribution))
+
+        if redistribution_type in DELTA_REDISTRIBUTION_TYPES:
+            assert results[0] == results[1], f'block deltas give different results with {redistribution_type}'
+        else:
+            # the unit left by the rounding goes to a different account, which is why the deltas are rejected
+            assert results[0][0] != results[1][0], f'block deltas give the same results with {redistribution_type}'
+
+    # the simulations refuse the deltas for the redistributions depending on the slots
+    with tempfile.TemporaryDirectory() as dir_test:
+        build_block_deltas(dir_test, os.path.join(dir_test, 'deltas'), files=[])
+        for redistribution_type in ['almost_equal', 'circular_queue_equal']:
+            try:
+                redistribution_paradise(dir_test, dir_test, redistribution_type, 0.5, 'fees', redistribution_minimum, redistribution_maximum, 1.0, 0, 0.0, 
+                                        BlockDeltas(os.path.join(dir_test, 'deltas')))
+                rejected = False
+            except ValueError:
+                rejected = True
+            assert rejected, f'block deltas accepted with {redistribution_type}'
+
+    print('Test passed: block deltas redistribution')
+
+def test_account_store():
+    eligible_addresses = {'bc12': 0, 'bc13': 1}
+    eligible_balances = np.array([100, 25])
+    eligible_accounts = AccountStore(eligible_addresses, eligible_balances)
+    # reference of the balances of the accounts
+    balances = {'bc12': 100, 'bc13': 25}
+
+    # the capacity is exceeded, the balances already stored are kept
+    for i in range(5):
+        eligible_accounts.add(f'bc2{i}', 10 * i)
+        balances[f'bc2{i}'] = 10 * i
+    # freed slots are reused in the order in which they were freed
+    for address in ['bc21', 'bc12']:
+        assert eligible_accounts.remove(address) == balances.pop(address)
+    eligible_accounts.add('bc30', 300)
+    eligible_accounts.add('bc31', 310)
+    balances.update({'bc30': 300, 'bc31': 310})
+    assert eligible_accounts.dictionary['bc30'] == 3 and eligible_accounts.dictionary['bc31'] == 0, 'freed slots not reused in order'
+    # the valid slots are updated by every removal and addition
+    assert eligible_accounts.remove('bc23') == balances.pop('bc23')
+    assert eligible_accounts.num_users == 6 and eligible_accounts.valid_indices().tolist() == [0, 1, 2, 3, 4, 6] and not eligible_accounts.valid_mask()[5]
+    eligible_accounts.add('bc23', 30)
+    balances['bc23'] = 30
+    # changes made through the list are made to the balances
+    eligible_accounts.list += 1
+    eligible_accounts.list[[0, 1]] += 1
+    balances = {address: balance + 1 for address, balance in balances.items()}
+    balances['bc31'] += 1
+    balances['bc13'] += 1
+
+    assert {address: eligible_accounts.get_balance(address) for address in eligible_accounts.dictionary} == balances
+    assert eligible_accounts.dictionary == {'bc13': 1, 'bc20': 2, 'bc22': 4, 'bc23': 5, 'bc24': 6, 'bc30': 3, 'bc31': 0}
+    assert eligible_accounts.list.tolist() == [312, 27, 1, 301, 21, 31, 41]
+    assert all(eligible_accounts.reverse_dictionary[index] == address for address, index in eligible_accounts.dictionary.items())
+    assert len(eligible_accounts.invalid_elements) == 0 and eligible_accounts.num_users == 7 and eligible_accounts.valid_indices().tolist() == list(range(7))
+    print('Test passed: account store')
+
+def test_lazy_account_store():
+    # the same operations are made to a LazyAccountStore and (adding the credits at once) to an AccountStore
+    eligible_addresses = {'bc12': 0, 'bc13': 1, 'bc14': 2}
+    eligible_balances = np.array([100, 25, 60])
+    eligible_accounts = LazyAccountStore(dict(eligible_addresses), eligible_balances.copy())
+    reference_accounts = AccountStore(dict(eligible_addresses), eligible_balances.copy())
+
+    def credit_all(amount):
+        eligible_accounts.credit_all(amount)
+        reference_accounts.list[reference_accounts.valid_indices()] += amount
+
+    def credit_ranks(start, end):
+        eligible_accounts.credit_ranks(start, end)
+        reference_accounts.list[reference_accounts.valid_indices()[start:end]] += 1
+
+    def accounts_above(maximum):
+        # the accounts of the reference above maximum, in the order of their slots
+        expected = [reference_accounts.reverse_dictionary[index] for index in reference_accounts.valid_indices().tolist() if reference_accounts.balances[index] > maximum]
+        assert eligible_accounts.accounts_above(maximum) == expected, f'accounts above {maximum} differ'
+        return expected
+
+    def check():
+        assert eligible_accounts.dictionary == reference_accounts.dictionary
+        assert eligible_accounts.num_users == reference_accounts.num_users
+        # the freed slots may keep different balances
+        assert eligible_accounts.list[eligible_accounts.valid_indices()].tolist() == reference_accounts.list[reference_accounts.valid_indices()].tolist()
+
+    credit_all(10)
+    for accounts in [eligible_accounts, reference_accounts]:
+        accounts.remove('bc13')
+        accounts.add('bc20', 50)
+    credit_all(5)
+    # bc20 took the slot of bc13
+    credit_ranks(1, 5)
+    for accounts in [eligible_accounts, reference_accounts]:
+        accounts.update_balance('bc14', 200)
+    credit_all(1)
+    for accounts in [eligible_accounts, reference_accounts]:
+        accounts.add('bc21', 70)
+    check()
+
+    assert eligible_accounts.get_balance('bc20') == reference_accounts.get_balance('bc20') == 57
+    assert accounts_above(115) == ['bc12', 'bc14']
+    for address in ['bc12', 'bc14']:
+        assert eligible_accounts.remove(address) == reference_accounts.remove(address)
+    credit_ranks(0, 5)
+
+    check()
+    assert eligible_accounts.dictionary == {'bc20': 1, 'bc21': 3} and eligible_accounts.list[[1, 3]].tolist() == [58, 71]
+    assert accounts_above(60) == ['bc21']
+    print('Test passed: lazy account store')
+
+def test_weighted_account_store():
+    eligible_addresses = {'bc12': 0, 'bc13': 1, 'bc14': 2}
+    eligible_balances = np.array([100, 200, 400])
+    eligible_accounts = WeightedAccountStore(eligible_addresses, eligible_balances, 10**6, resync_interval=2, tolerance=1.0)
+
+    # the weights of the second redistribution are those of the balances settled (bc12) and of the last resync (bc13, bc14)
+    eligible_accounts.redistribute(70)
+    condition = eligible_accounts.get_balance('bc12') == 140 and eligible_accounts.pool == 30
+    # the metrics are those of weight_based on the balances 140, 220 and 410 (bc13 and bc14 are not settled)
+    condition = condition and eligible_accounts.redistribution_metrics(70) == [70, 35, 12, 12, 22, 35]
+    eligible_accounts.redistribute(70)
+    # the resync gives 34, 43 and 21 units, and the 2 left to the highest weights
+    condition = condition and eligible_accounts.list.tolist() == [175, 244, 421] and eligible_accounts.pool == 0
+
+    eligible_addresses = {'bc12': 0, 'bc13': 1, 'bc14': 2}
+    eligible_balances = np.array([100, 1000, 1000])
+    eligible_accounts = WeightedAccountStore(eligible_addresses, eligible_balances, 2000, resync_interval=10, tolerance=100.0)
+
+    # bc12 receives 1000 units per redistribution (not enough to be settled by the tolerance), it exceeds the maximum with the second one
+    eligible_accounts.redistribute(1200)
+    condition = condition and eligible_accounts.accounts_above(2000) == []
+    eligible_accounts.redistribute(1200)
+    condition = condition and eligible_accounts.accounts_above(2000) == ['bc12'] and eligible_accounts.remove('bc12') == 2100
+    eligible_accounts.resync()
+
+    condition = condition and eligible_accounts.list[[1, 2]].tolist() == [1200, 1200] and eligible_accounts.pool == 0
+
+    tolerance = 0.1
+    eligible_addresses = {f'bc{i}': i for i in range(20)}
+    eligible_balances = np.arange(1, 21) * 1000
+    eligible_accounts = WeightedAccountStore(eligible_addresses, eligible_balances, 10**9, resync_interval=1000, tolerance=tolerance)
+
+    # in each block the amounts differ from those of weight_based on the settled balances by at most tolerance (plus one unit of rounding)
+    indices = eligible_accounts.valid_indices()
+    for _ in range(100):
+        settled_balances = eligible_accounts.balances[indices] + (eligible_accounts.credit - eligible_accounts.credit_at_entry[indices]) // eligible_accounts.balances[indices]
+        expected_amounts = 20000 * (1 / settled_balances) / np.sum(1 / settled_balances)
+        eligible_accounts.redistribute(20000)
+        _ = eligible_accounts.accounts_above(10**9)
+
+        amounts = eligible_accounts.balances[indices] + (eligible_accounts.credit - eligible_accounts.credit_at_entry[indices]) // eligible_accounts.balances[indices] - settled_balances
+        errors = np.abs(amounts - expected_amounts)
+        assert np.all(errors <= tolerance * expected_amounts + 1) and np.sum(errors) <= tolerance * 20000 + len(indices), 'weighted account store out of the bound of weight_based'
+
+    if condition:
+        print('Test passed: weighted account store')
+    else:
+        print('Test failed: weighted account store')
+        return
+
 def test_perform_redistribution():
     # Test for equal redistribution
     eligible_addresses = {'bc12': 0, 'bc13': 1, 'bc14': 2}
     eligible_balances = np.array([100, 25, 320])
-    eligible_accounts = DoubleDictionaryList(eligible_addresses, eligible_balances)
+    eligible_accounts = AccountStore(eligible_addresses, eligible_balances)
 
     non_eligible_accounts = {'bc15': 501, 'bc16': 750, 'bc17': 1000}
 
@@ -252,7 +564,7 @@ def test_perform_redistribution():
     # Test for equal redistribution with percentage on users
     eligible_addresses = {'bc12': 0, 'bc13': 1, 'bc14': 2}
     eligible_balances = np.array([100, 25, 320])
-    eligible_accounts = DoubleDictionaryList(eligible_addresses, eligible_balances)
+    eligible_accounts = AccountStore(eligible_addresses, eligible_balances)
 
     non_eligible_accounts = {'bc15': 501, 'bc16': 750, 'bc17': 1000}
 
@@ -286,7 +598,7 @@ def test_perform_redistribution():
     # Test for equal redistribution with percentage on users and an extra fee
     eligible_addresses = {'bc12': 0, 'bc13': 1, 'bc14': 2}
     eligible_balances = np.array([100, 25, 320])
-    eligible_accounts = DoubleDictionaryList(eligible_addresses, eligible_balances)
+    eligible_accounts = AccountStore(eligible_addresses, eligible_balances)
 
     non_eligible_accounts = {'bc15': 501, 'bc16': 750, 'bc17': 1000}
 
@@ -320,7 +632,7 @@ def test_perform_redistribution():
     # Test for simple weight based redistribution
     eligible_addresses = {'bc12': 0, 'bc13': 1, 'bc14': 2}
     eligible_balances = np.array([100, 25, 320])
-    eligible_accounts = DoubleDictionaryList(eligible_addresses, eligible_balances)
+    eligible_accounts = AccountStore(eligible_addresses, eligible_balances)
 
     non_eligible_accounts = {'bc15': 501, 'bc16': 750, 'bc17': 1000}
 
@@ -354,7 +666,7 @@ def test_perform_redistribution():
     # Test for weight based redistribution with percentage on users
     eligible_addresses = {'bc12': 0, 'bc13': 1, 'bc14': 2}
     eligible_balances = np.array([100, 25, 320])
-    eligible_accounts = DoubleDictionaryList(eligible_addresses, eligible_balances)
+    eligible_accounts = AccountStore(eligible_addresses, eligible_balances)
 
     non_eligible_accounts = {'bc15': 501, 'bc16': 750, 'bc17': 1000}
 
@@ -388,7 +700,7 @@ def test_perform_redistribution():
     # Test for weight based redistribution with percentage on users and an extra fee
     eligible_addresses = {'bc12': 0, 'bc13': 1, 'bc14': 2}
     eligible_balances = np.array([100, 25, 320])
-    eligible_accounts = DoubleDictionaryList(eligible_addresses, eligible_balances)
+    eligible_accounts = AccountStore(eligible_addresses, eligible_balances)
 
     non_eligible_accounts = {'bc15': 501, 'bc16': 750, 'bc17': 1000}
 
@@ -1,9 +1,22 @@
 import base58
-from utils.utils import sha256, ripemd160
+from utils.utils import sha256, ripemd160, cached_address
 
 def public_key_to_address(hex_string, legacy=True):
-    # 1. Perform SHA256 on the input string (convert hex string to bytes first)
-    data = bytes.fromhex(hex_string)
+    # convert hex string to bytes first
+    return public_key_bytes_to_address(bytes.fromhex(hex_string), legacy)
+
+def public_key_bytes_to_address(data, legacy=True):
+    # the same public keys are spent over and over, so the hashing and the encoding are done only once for each of them
+    return cached_address('P2PKH Input' if legacy else 'P2SH Input', bytes(data), _encode_p2pkh_input if legacy else _encode_p2sh_input)
+
+def _encode_p2pkh_input(data):
+    return _public_key_bytes_to_address(data, True)
+
+def _encode_p2sh_input(data):
+    return _public_key_bytes_to_address(data, False)
+
+def _public_key_bytes_to_address(data, legacy):
+    # 1. Perform SHA256 on the input bytes
     sha256_result = sha256(data)
 
     # 2. Perform RIPEMD-160 on the result of SHA256
@@ -39,4 +52,15 @@ def input_script_to_addr(script_type, public_key):
         # addresses start with 3
         return public_key_to_address('0014' + public_key, False)
     else:
-        return None
\ No newline at end of file
+        return None
+
+def input_script_bytes_to_addr(script_type, payload):
+    # same as input_script_to_addr, but the payload is given as bytes
+    if script_type == "P2PKH Input":
+        # addresses start with 1
+        return public_key_bytes_to_address(payload, True)
+    elif script_type == "P2SH-P2WPKH Input":
+        # addresses start with 3
+        return public_key_bytes_to_address(b'\x00\x14' + payload, False)
+    else:
+        return None
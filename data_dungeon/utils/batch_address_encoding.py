@@ -0,0 +1,220 @@
+import hashlib
+import numpy as np
+from utils.utils import address_cache, sha256, ripemd160, CHARSET, BECH32M_CONST
+
+# -------------------------------------------------------
+# Script classification
+# -------------------------------------------------------
+
+# script type: (mainnet prefix, payload length) for base58, (witness version, payload length) for bech32
+BASE58_TYPES = {'P2PKH': (0x00, 20), 'P2SH': (0x05, 20)}
+BECH32_TYPES = {'P2WPKH': (0, 20), 'P2WSH': (0, 32), 'P2TR': (1, 32)}
+
+def classify_output_script(script):
+    """Returns (script type, payload) if the script is one of the types handled by encode_addresses, (None, None) otherwise."""
+    length = len(script)
+    if length == 25 and script[:3] == b'\x76\xa9\x14' and script[-2:] == b'\x88\xac':
+        return 'P2PKH', script[3:-2]
+    if length == 23 and script[:2] == b'\xa9\x14' and script[-1:] == b'\x87':
+        return 'P2SH', script[2:-1]
+    if length == 22 and script[:2] == b'\x00\x14':
+        return 'P2WPKH', script[2:]
+    if length == 34 and script[:2] == b'\x00\x20':
+        return 'P2WSH', script[2:]
+    if length == 34 and script[:2] == b'\x51\x20':
+        return 'P2TR', script[2:]
+    return None, None
+
+# classes of all the output scripts, the position in the list is the tag stored by the columnar blocks (see storage/columnar_blocks.py)
+SCRIPT_CLASSES = ['P2PKH', 'P2SH', 'P2WPKH', 'P2WSH', 'P2TR', 'Multisig', 'OP_RETURN', 'Unknown']
+
+def classify_script(script):
+    """
+    Returns (script class, payload) of any output script without encoding anything: the payload is the hash / witness program
+    for the types handled by encode_addresses, the whole script for 'Unknown' scripts and empty otherwise.
+    """
+    script_type, payload = classify_output_script(script)
+    if script_type is not None:
+        return script_type, payload
+    # same checks of parse_transaction_output.parse_multisig, but the public keys are not extracted
+    if len(script) >= 3 and 0x51 <= script[0] <= 0x60 and script[-1] == 0xae:
+        return 'Multisig', b''
+    if script[:1] == b'\x6a':
+        return 'OP_RETURN', b''
+    return 'Unknown', bytes(script)
+
+def receiver_from_script(script_class, payload):
+    """Returns the receiver of an output classified by classify_script, the same returned by blk_parser.output_script_to_receiver."""
+    if script_class in BASE58_TYPES or script_class in BECH32_TYPES:
+        # encode_addresses looks up (and fills) the address cache
+        return encode_addresses([payload], [script_class])[0]
+    if script_class == 'Multisig':
+        return 'UNKNOWN'
+    if script_class == 'OP_RETURN':
+        return 'INVALID'
+    return payload.hex()
+
+def receivers_from_scripts(script_classes, payloads):
+    """Same as receiver_from_script for many outputs, the encodable ones are encoded in a single batch."""
+    receivers = [None] * len(payloads)
+    positions = []
+    for index, (script_class, payload) in enumerate(zip(script_classes, payloads)):
+        if script_class in BASE58_TYPES or script_class in BECH32_TYPES:
+            positions.append(index)
+        else:
+            receivers[index] = receiver_from_script(script_class, payload)
+
+    if positions:
+        encoded = encode_addresses([payloads[index] for index in positions], [script_classes[index] for index in positions])
+        for index, address in zip(positions, encoded):
+            receivers[index] = address
+
+    return receivers
+
+# -------------------------------------------------------
+# Base58
+# -------------------------------------------------------
+
+BASE58_ALPHABET = np.frombuffer(b'123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz', dtype=np.uint8)
+
+def _base58_check_encode_batch(prefix, payloads):
+    # checksums are computed with hashlib (there is no vectorized sha256), everything else is done on the whole batch
+    data = [bytes([prefix]) + payload for payload in payloads]
+    data = b''.join(d + hashlib.sha256(hashlib.sha256(d).digest()).digest()[:4] for d in data)
+    numbers = np.frombuffer(data, dtype=np.uint8).reshape(len(payloads), -1).astype(np.int64)
+
+    # leading zero bytes are encoded as '1'
+    leading_zeros = np.argmax(numbers != 0, axis=1)
+
+    # repeated long division by 58 of all the numbers at once, digits are produced from the least significant one
+    digits = []
+    remaining = numbers.copy()
+    while remaining.any():
+        remainder = np.zeros(len(payloads), dtype=np.int64)
+        for column in range(remaining.shape[1]):
+            current = remainder * 256 + remaining[:, column]
+            remaining[:, column] = current // 58
+            remainder = current % 58
+        digits.append(remainder)
+
+    digits = np.stack(digits[::-1], axis=1)
+    # the most significant digits produced after a number reached 0 are zeros and must be skipped
+    first_digit = np.argmax(digits != 0, axis=1)
+    encoded = BASE58_ALPHABET[digits]
+
+    return [b'1' * int(zeros) + row[start:].tobytes() for zeros, start, row in zip(leading_zeros, first_digit, encoded)]
+
+# -------------------------------------------------------
+# Bech32
+# -------------------------------------------------------
+
+BECH32_GENERATOR = np.array([0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3], dtype=np.int64)
+BECH32_CHARSET = np.frombuffer(CHARSET.encode(), dtype=np.uint8)
+BECH32_HRP = 'bc'  # Bech32 mainnet human-readable part (hrp)
+
+def _polymod_step(chk, values):
+    top = chk >> 25
+    chk = ((chk & 0x1ffffff) << 5) ^ values
+    for i in range(5):
+        chk ^= np.where((top >> i) & 1, BECH32_GENERATOR[i], 0)
+    return chk
+
+def _bech32_encode_batch(version, payloads, bech32m):
+    # convertbits(payload, 8, 5) on the whole batch: bits are unpacked, padded to a multiple of 5 and regrouped
+    bits = np.unpackbits(np.frombuffer(b''.join(payloads), dtype=np.uint8).reshape(len(payloads), -1), axis=1)
+    padding = (-bits.shape[1]) % 5
+    if padding:
+        bits = np.pad(bits, ((0, 0), (0, padding)))
+    data = bits.reshape(len(payloads), -1, 5).dot(np.array([16, 8, 4, 2, 1])).astype(np.int64)
+    data = np.hstack((np.full((len(payloads), 1), version, dtype=np.int64), data))
+
+    # the checksum of the hrp is the same for all the addresses
+    chk = np.ones(len(payloads), dtype=np.int64)
+    for value in [ord(x) >> 5 for x in BECH32_HRP] + [0] + [ord(x) & 31 for x in BECH32_HRP]:
+        chk = _polymod_step(chk, value)
+    for column in range(data.shape[1]):
+        chk = _polymod_step(chk, data[:, column])
+    for _ in range(6):
+        chk = _polymod_step(chk, 0)
+    chk ^= BECH32M_CONST if bech32m else 1
+
+    checksum = np.stack([(chk >> 5 * (5 - i)) & 31 for i in range(6)], axis=1)
+    encoded = BECH32_CHARSET[np.hstack((data, checksum))]
+
+    prefix = BECH32_HRP + '1'
+    return [prefix + row.tobytes().decode('ascii') for row in encoded]
+
+# -------------------------------------------------------
+# Batch API
+# -------------------------------------------------------
+
+def encode_addresses(payloads, script_types):
+    """
+    Encodes the payloads (20 or 32 bytes hashes / witness programs) according to their script type
+    ('P2PKH', 'P2SH', 'P2WPKH', 'P2WSH' or 'P2TR'), returns the list of addresses as strings.
+    Addresses already in the address cache are not encoded again, the others are added to it.
+    """
+    addresses = [None] * len(payloads)
+    # script type: (positions, payloads) of the addresses to be encoded
+    missing = {}
+
+    for index, (script_type, payload) in enumerate(zip(script_types, payloads)):
+        payload = bytes(payload)
+        address = address_cache.get((script_type, payload))
+        if address is None:
+            positions, type_payloads = missing.setdefault(script_type, ([], []))
+            positions.append(index)
+            type_payloads.append(payload)
+        else:
+            addresses[index] = address
+
+    for script_type, (positions, type_payloads) in missing.items():
+        if script_type in BASE58_TYPES:
+            prefix, length = BASE58_TYPES[script_type]
+        elif script_type in BECH32_TYPES:
+            version, length = BECH32_TYPES[script_type]
+        else:
+            raise ValueError(f'Unsupported script type: {script_type}')
+
+        if any(len(payload) != length for payload in type_payloads):
+            raise ValueError(f'{script_type} payloads must be {length} bytes long')
+
+        if script_type in BASE58_TYPES:
+            encoded = _base58_check_encode_batch(prefix, type_payloads)
+        else:
+            encoded = _bech32_encode_batch(version, type_payloads, script_type == 'P2TR')
+
+        for index, payload, address in zip(positions, type_payloads, encoded):
+            # base58 addresses are cached as bytes, like p2pkh_to_address and p2sh_to_address return them
+            address_cache.put((script_type, payload), address)
+            addresses[index] = address
+
+    return [address.decode('utf-8') if isinstance(address, bytes) else address for address in addresses]
+
+# public key type (as used by address_conversion): script type of the address, whose payload is the hash160 of the public key
+PUBLIC_KEY_TYPES = {'P2PKH Input': 'P2PKH', 'P2SH Input': 'P2SH', 'P2WPKH Input': 'P2WPKH'}
+
+def encode_public_keys(public_keys, key_types):
+    """
+    Same as encode_addresses, but starting from public keys (see address_conversion.public_key_bytes_to_address for the key types,
+    the public keys of P2WPKH witnesses are encoded as the P2WPKH address of their hash160).
+    """
+    addresses = [None] * len(public_keys)
+    positions, payloads, script_types, cache_keys = [], [], [], []
+
+    for index, (key_type, public_key) in enumerate(zip(key_types, public_keys)):
+        public_key = bytes(public_key)
+        address = address_cache.get((key_type, public_key))
+        if address is None:
+            positions.append(index)
+            payloads.append(ripemd160(sha256(public_key)))
+            script_types.append(PUBLIC_KEY_TYPES[key_type])
+            cache_keys.append((key_type, public_key))
+        else:
+            addresses[index] = address
+
+    for index, cache_key, address in zip(positions, cache_keys, encode_addresses(payloads, script_types)):
+        address_cache.put(cache_key, address)
+        addresses[index] = address
+
+    return [address.decode('utf-8') if isinstance(address, bytes) else address for address in addresses]
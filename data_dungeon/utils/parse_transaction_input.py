@@ -1,8 +1,7 @@
 import binascii
 
-def parse_transaction_input(script_hex):
-    """Parse and classify input script as P2PK, P2PKH, P2WPKH, P2WSH, or P2SH."""
-    script_bytes = bytes.fromhex(script_hex)
+def parse_input_script(script_bytes):
+    """Parse and classify input script (as bytes) as P2PK, P2PKH, P2WPKH, P2WSH, or P2SH, the payload is returned as bytes."""
     script_len = len(script_bytes)
 
     # P2PKH format: <signature> <public key>
@@ -11,36 +10,36 @@ def parse_transaction_input(script_hex):
         pubkey_len = script_bytes[1 + signature_len]
         pubkey = script_bytes[1 + signature_len + 1: 1 + signature_len + 1 + pubkey_len]
         
-        script_type = "P2PKH Input"
-        public_key = f"{binascii.hexlify(pubkey).decode()}"
-        return script_type, public_key
+        return "P2PKH Input", pubkey
 
     # P2PK format: <signature> (No public key, public key was in previous output)
     elif script_len == 71 or script_len == 72:  # Typical lengths for P2PK input scripts        
-        script_type = "P2PK Input"
-        return script_type, None
+        return "P2PK Input", None
     
     # P2WPKH or P2WSH format (segwit): <witness> (handled in witness section, not scriptSig)
     elif script_len == 0:  # Segwit input scripts typically have no scriptSig
-        script_type = "SegWit Input"
-        return script_type, None
+        return "SegWit Input", None
     
     # P2SH format: <redeem script> (Could be a wrapped P2WPKH, P2WSH, etc.)
     elif script_len > 0:
         redeem_script_len = script_bytes[0]
         redeem_script = script_bytes[1:1 + redeem_script_len]
-        script_type = "P2SH Input"
-        public_key_hash = f"{binascii.hexlify(redeem_script).decode()}"
         
         # Check for nested P2WPKH (P2SH-P2WPKH)
         if len(redeem_script) == 22 and redeem_script[0] == 0x00 and redeem_script[1] == 0x14:
-            pubkey_hash = redeem_script[2:22]
-            script_type = "P2SH-P2WPKH Input"
-            public_key_hash = f"{binascii.hexlify(pubkey_hash).decode()}"
-        return script_type, public_key_hash
+            return "P2SH-P2WPKH Input", redeem_script[2:22]
+        return "P2SH Input", redeem_script
     
     # Unknown input script
     else:
-        script_type = "Unknown Input"
-        script = f"{script_hex}"
-        return script_type, script
\ No newline at end of file
+        return "Unknown Input", script_bytes
+
+def parse_transaction_input(script_hex):
+    """Parse and classify input script as P2PK, P2PKH, P2WPKH, P2WSH, or P2SH."""
+    script_type, payload = parse_input_script(bytes.fromhex(script_hex))
+
+    if payload is None:
+        return script_type, None
+    elif script_type == "Unknown Input":
+        return script_type, f"{script_hex}"
+    return script_type, f"{binascii.hexlify(payload).decode()}"
\ No newline at end of file
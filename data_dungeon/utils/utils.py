@@ -2,6 +2,7 @@ import hashlib
 import base58
 import struct
 from enum import Enum
+from collections import OrderedDict
 from binascii import hexlify
 
 # -------------------------------------------------------
@@ -170,38 +171,122 @@ def convertbits(data, frombits, tobits, pad=True):
         return None
     return ret
 
+# -------------------------------------------------------
+# Address cache
+# -------------------------------------------------------
+
+ADDRESS_CACHE_SIZE = 1000000  # maximum number of encoded addresses kept in memory (per process)
+
+class AddressCache:
+    """Least recently used cache of encoded addresses, keyed by (script type, hash bytes)."""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        address = self.entries.get(key)
+        if address is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return address
+
+    def put(self, key, address):
+        if self.max_size <= 0:
+            return
+        self.entries[key] = address
+        if len(self.entries) > self.max_size:
+            # the least recently used address is the first one
+            self.entries.popitem(last=False)
+
+    def resize(self, max_size):
+        self.max_size = max_size
+        while len(self.entries) > max(max_size, 0):
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+            'size': len(self.entries),
+            'max_size': self.max_size,
+        }
+
+# shared by blk_parser, rev_parser and address_conversion
+address_cache = AddressCache(ADDRESS_CACHE_SIZE)
+
+def set_address_cache_size(max_size):
+    address_cache.resize(max_size)
+
+def address_cache_stats():
+    return address_cache.stats()
+
+def cached_address(script_type, data, encode):
+    """Returns the address encoded by encode(data), computing it only if (script_type, data) is not in the cache."""
+    key = (script_type, data)
+    address = address_cache.get(key)
+    if address is None:
+        address = encode(data)
+        address_cache.put(key, address)
+    return address
+
 # Address conversion based on script type
-def p2pkh_to_address(pubkey_hash):
+def _encode_p2pkh(pubkey_hash):
     return base58_check_encode(b'\x00', pubkey_hash)  # Mainnet P2PKH
 
-def p2sh_to_address(script_hash):
+def _encode_p2sh(script_hash):
     return base58_check_encode(b'\x05', script_hash)  # Mainnet P2SH
 
-def p2wpkh_to_address(pubkey_hash):
+def _encode_p2wpkh(pubkey_hash):
     pubkey_hash_5_bit = convertbits(pubkey_hash, 8, 5, pad=False)
     return bech32_encode('bc', [0] + pubkey_hash_5_bit, spec=Encoding.BECH32) # Bech32 mainnet human-readable part (hrp)
 
-def p2wsh_to_address(script_hash):
+def _encode_p2wsh(script_hash):
     script_hash_5_bit = convertbits(script_hash, 8, 5)
     return bech32_encode('bc', [0] + script_hash_5_bit, spec=Encoding.BECH32) # Bech32 mainnet human-readable part (hrp)
 
-def p2tr_to_address(script_hash):
+def _encode_p2tr(script_hash):
     script_hash_5_bit = convertbits(script_hash, 8, 5)
     return bech32_encode('bc', [1] + script_hash_5_bit, spec=Encoding.BECH32M) # Bech32 mainnet human-readable part (hrp)
 
+def p2pkh_to_address(pubkey_hash):
+    return cached_address('P2PKH', bytes(pubkey_hash), _encode_p2pkh)
+
+def p2sh_to_address(script_hash):
+    return cached_address('P2SH', bytes(script_hash), _encode_p2sh)
+
+def p2wpkh_to_address(pubkey_hash):
+    return cached_address('P2WPKH', bytes(pubkey_hash), _encode_p2wpkh)
+
+def p2wsh_to_address(script_hash):
+    return cached_address('P2WSH', bytes(script_hash), _encode_p2wsh)
+
+def p2tr_to_address(script_hash):
+    return cached_address('P2TR', bytes(script_hash), _encode_p2tr)
+
 # -------------------------------------------------------
 # Used in rev*.dat file parsing
 # -------------------------------------------------------
 
-def decode_varint(raw_hex):
+def decode_varint(raw_hex, pos=0):
     """
     Reads the weird format of VarInt present in src/serialize.h of bitcoin core
     and being used for storing data in the leveldb.
     This is not the VARINT format described for general bitcoin serialization
     use.
+    Returns the integer together with the position of the following byte (i.e. the number of bytes read if pos = 0).
     """
     n = 0
-    pos = 0
     while True:
         try:
             data = raw_hex[pos]
@@ -214,13 +299,14 @@ def decode_varint(raw_hex):
             return n, pos
         n += 1
 
-def decode_compactsize(data):
-    assert(len(data) > 0)
-    size = int(data[0])
+def decode_compactsize(data, pos=0):
+    # returns the integer together with the position of the following byte (i.e. the number of bytes read if pos = 0)
+    assert(len(data) > pos)
+    size = int(data[pos])
     assert(size <= 255)
 
     if size < 253:
-        return size, 1
+        return size, pos + 1
 
     if size == 253:
         format_ = '<H'
@@ -233,7 +319,7 @@ def decode_compactsize(data):
         assert 0, "unknown format_ for size : %s" % size
 
     size = struct.calcsize(format_)
-    return struct.unpack(format_, data[1:size+1])[0], size + 1
+    return struct.unpack_from(format_, data, pos + 1)[0], pos + size + 1
 
 def decompress_txout_amt(amount_compressed_int):
     # (this function stolen from https://github.com/sr-gi/bitcoin_tools and modified to remove bug)
@@ -1,19 +1,36 @@
 from utxo_hub.address_extraction import address_extraction
 from utxo_hub.utxo_script_conversion import utxo_script_conversion
+from utxo_hub.chainstate_extraction import chainstate_extraction
+from utxo_hub.utxo_rewind import utxo_rewind
 from utxo_hub.multi_input_address_clustering import multi_input_address_clustering
+from storage.address_table import AddressTable
+from storage.block_archive import BlockArchive
 
 dir_transactions = './result/utxos/'
 dir_sorted_blocks = './result/blocks/'
+dir_archive_blocks = './result/archive/' # Directory where the segments packed by data_main.py (PACK_BLOCKS) are stored
 csv_file = '/home/carlo/Documents/PythonProjects/BitcoinParser/result/utxo/utxodump.csv'
 csv_file_with_addresses = '/home/carlo/Documents/PythonProjects/BitcoinParser/result/utxo/utxodump_with_addresses.csv'
+dir_chainstate = '/home/carlo/Documents/PythonProjects/BitcoinParser/result/utxo/chainstate/' # Copy of the chainstate directory of the node (taken while bitcoind is stopped)
 
+READ_CHAINSTATE = True  # Flag to determine whether the balances should be read from dir_chainstate instead of csv_file (produced by an external utxo dump)
+REWIND = True  # used only by READ_CHAINSTATE: flag to determine whether the balances (at the tip of the node) should be brought back to rewind_height
+rewind_height = 856002  # used only by REWIND: the blocks from rewind_height + 1 up to the tip of the chainstate must have been extracted in dir_sorted_blocks
 MULTI_INPUT_ADDRESSES = True
+ADDRESS_IDS = True  # Flag to determine whether accounts should be stored by address id (needed by the 'npz' blocks written by data_main.py)
+USE_ARCHIVE = False  # Flag to determine whether the blocks should be read from dir_archive_blocks instead of dir_sorted_blocks
+first_block = 856003  # used only by USE_ARCHIVE: first block read (the previous ones are already included in the utxo)
 
 def main():
-    utxo_script_conversion(csv_file, csv_file_with_addresses)
-    address_extraction(csv_file_with_addresses)
+    if READ_CHAINSTATE:
+        tip_hash = chainstate_extraction(dir_chainstate, address_table=AddressTable() if ADDRESS_IDS else None)
+        if REWIND:
+            utxo_rewind(dir_sorted_blocks, rewind_height, tip_hash)
+    else:
+        utxo_script_conversion(csv_file, csv_file_with_addresses)
+        address_extraction(csv_file_with_addresses, address_table=AddressTable() if ADDRESS_IDS else None)
     if MULTI_INPUT_ADDRESSES:
-        multi_input_address_clustering(dir_sorted_blocks)
+        multi_input_address_clustering(dir_sorted_blocks, BlockArchive(dir_archive_blocks, first_block) if USE_ARCHIVE else None)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,8 +1,12 @@
 import pandas as pd
 import time
-from database.accounts_database import create_connection, create_table, insert_many_accounts
+from database.accounts_database import create_connection, create_table, insert_many_accounts, DB_NAME, ADDRESS_IDS_DB_NAME
 
-def address_extraction(csv_file, chunk_size=1000000):
+# addresses of the outputs that do not belong to any account (OP_RETURN, unretrievable addresses, multisig)
+NOT_ACCOUNTS = (None, 'INVALID', 'UNKNOWN')
+
+def address_extraction(csv_file, chunk_size=1000000, address_table=None):
+    # if an address table (see storage/address_table.py) is given, the accounts are stored by address id
     addresses = {}
 
     with pd.read_csv(csv_file, chunksize=chunk_size) as reader:
@@ -11,6 +15,8 @@ def address_extraction(csv_file, chunk_size=1000000):
         for index, chunk in enumerate(reader):
             for _, row in chunk.iterrows():
                 address = row['address']
+                if address_table is not None:
+                    address = address_table.get_id(str(address))
                 amount = row['amount']
                 if not address in addresses:
                     addresses[address] = amount
@@ -22,12 +28,20 @@ def address_extraction(csv_file, chunk_size=1000000):
             print(f'Total addresses: {len(addresses)}')
             print(f'Time elapsed (in seconds): {end_time - start_time}')
 
-    accounts = list(addresses.items())
+    store_accounts(list(addresses.items()), address_table)
 
+def store_accounts(accounts, address_table=None):
+    # accounts are (address, balance) pairs, with the address replaced by its id if an address table is given
     start_time  = time.time()
     # create the database, create the table, populate the table
-    conn = create_connection()
-    create_table(conn)
+    if address_table is not None:
+        # the new addresses are saved before the accounts referencing them
+        address_table.save()
+        conn = create_connection(ADDRESS_IDS_DB_NAME)
+        create_table(conn, 'INTEGER')
+    else:
+        conn = create_connection(DB_NAME)
+        create_table(conn)
     insert_many_accounts(conn, accounts)
     end_time  = time.time()
     print(f'Time elapsed (in seconds): {end_time - start_time}')
\ No newline at end of file
@@ -0,0 +1,101 @@
+import os
+import time
+import plyvel
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from tqdm import tqdm
+from utils.utils import decode_varint, decompress_txout_amt
+from file_parsing.rev_parser import decompress_script, extract_from_hex
+from utxo_hub.address_extraction import store_accounts, NOT_ACCOUNTS
+
+# Keys of the chainstate LevelDB of bitcoin core (src/txdb.cpp)
+OBFUSCATE_KEY = b'\x0e\x00obfuscate_key'
+BEST_BLOCK_KEY = b'B'
+# coins are stored as 'C' + txid + varint(output index), one key per unspent output
+COIN_PREFIX = b'C'
+
+def obfuscation_key(db):
+    # the value is a vector: its length (always 8) followed by the key, chainstates without the key are not obfuscated
+    value = db.get(OBFUSCATE_KEY)
+    if value is None:
+        return b''
+    return value[1:]
+
+def deobfuscate(value, key):
+    # every value is XORed with the key repeated over its whole length
+    if not key:
+        return value
+    key_stream = (key * (len(value) // len(key) + 1))[:len(value)]
+    return (int.from_bytes(value, 'little') ^ int.from_bytes(key_stream, 'little')).to_bytes(len(value), 'little')
+
+def decode_coin(value):
+    """Returns the height, the coinbase flag, the amount and the address of the coin stored in a (deobfuscated) value of the chainstate."""
+    # same layout of the spent outputs of the undo files, without the byte reserved for backwards compatibility
+    code, pos = decode_varint(value, 0)
+    compressed_amt, pos = decode_varint(value, pos)
+    script_end = extract_from_hex(value, pos)
+    _, address = decompress_script(value[pos:script_end])
+
+    return code // 2, code % 2 == 1, decompress_txout_amt(compressed_amt), address
+
+def coin_balances(values, key):
+    # balances (address: amount) of the coins of a key range, coins not belonging to any account (multisig, non-standard scripts) are skipped
+    balances = {}
+    for value in values:
+        _, _, amount, address = decode_coin(deobfuscate(value, key))
+        if address in NOT_ACCOUNTS:
+            continue
+        balances[address] = balances.get(address, 0) + amount
+
+    return balances
+
+def key_ranges():
+    # the txids of the coins are uniformly distributed, so their first byte splits the coins in 256 ranges of similar size
+    return [COIN_PREFIX + bytes([first_byte]) for first_byte in range(256)]
+
+def chainstate_extraction(dir_chainstate, address_table=None, num_processors=None, max_pending_ranges=None):
+    """
+    Sums the unspent outputs of the chainstate of bitcoin core (version 0.15 or later) by address and stores the balances in the accounts database.
+    dir_chainstate must be a copy of the chainstate directory taken while bitcoind is stopped (LevelDB cannot be opened by two processes).
+    If an address table (see storage/address_table.py) is given, the accounts are stored by address id.
+    Returns the hash of the block the balances refer to (the best block of the chainstate).
+    """
+    num_processors = num_processors or os.cpu_count() or 1
+    max_pending_ranges = max_pending_ranges or 2 * num_processors
+    balances = {}
+    best_block_hash = None
+
+    start_time = time.time()
+    with plyvel.DB(dir_chainstate, create_if_missing=False) as db, ProcessPoolExecutor(max_workers=num_processors) as processors:
+        key = obfuscation_key(db)
+        best_block = db.get(BEST_BLOCK_KEY)
+        if best_block is not None:
+            # same format of the 'Block Hash' of the extracted blocks
+            best_block_hash = deobfuscate(best_block, key)[::-1].hex().upper()
+            print(f'Best block of the chainstate: {best_block_hash}')
+
+        def merge(futures):
+            for future in futures:
+                for address, amount in future.result().items():
+                    balances[address] = balances.get(address, 0) + amount
+
+        # LevelDB is read sequentially by this process, the values of each key range are decoded by the worker processes
+        pending = set()
+        for prefix in tqdm(key_ranges(), desc='Reading chainstate'):
+            if len(pending) >= max_pending_ranges:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                merge(done)
+            values = list(db.iterator(prefix=prefix, include_key=False))
+            pending.add(processors.submit(coin_balances, values, key))
+        merge(pending)
+
+    end_time = time.time()
+    print(f'Total addresses: {len(balances)}')
+    print(f'Time elapsed (in seconds): {end_time - start_time}')
+
+    if address_table is not None:
+        accounts = list(zip(address_table.get_ids(list(balances.keys())), balances.values()))
+    else:
+        accounts = list(balances.items())
+    store_accounts(accounts, address_table)
+
+    return best_block_hash
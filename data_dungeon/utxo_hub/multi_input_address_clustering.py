@@ -1,59 +1,43 @@
 import queue
-import time
-import os
 import numpy as np
 import database.accounts_database as accounts_database
 import database.multi_input_accounts_database as multi_input_accounts_database
-from redistribution_space.utils import get_block, extract_height_from_name
+from redistribution_space.utils import list_block_files
+from storage.block_prefetcher import BlockPrefetcher
 from concurrent.futures import ThreadPoolExecutor, wait, as_completed
 from tqdm import tqdm
 
-# number of readers for blocks
-num_readers = 2
-
-def multi_input_address_clustering(dir_sorted_blocks):
+def multi_input_address_clustering(dir_sorted_blocks, block_archive=None):
     file_queue = queue.Queue(maxsize=10)
 
-    files = os.listdir(dir_sorted_blocks)
-    files = [x for x in files if (x.endswith('.txt') and x.startswith('block_'))]
-    files.sort()
-    # delete the first 3 files (000, 001, 002) because the utxo has already them
-    files = files[3:]
-
-    len_files = len(files)
-
-    prev_height = extract_height_from_name(files[0]) - 1
-    lock = prev_height
+    if block_archive is None:
+        files = list_block_files(dir_sorted_blocks)
+        # delete the first 3 files (000, 001, 002) because the utxo has already them
+        files = files[3:]
+
+        # block files are decoded ahead of the clustering by a pool of processes (see storage/block_prefetcher.py)
+        block_reader = BlockPrefetcher(dir_sorted_blocks, files)
+    else:
+        # blocks are read from the segments of an archive (see storage/block_archive.py)
+        block_reader = block_archive
+
+    len_files = len(block_reader)
+    use_address_ids = block_reader.uses_address_ids
+
+    # blocks referencing addresses by id (see storage/address_table.py) are clustered using the accounts keyed by id
+    if use_address_ids:
+        accounts_conn = accounts_database.create_connection(accounts_database.ADDRESS_IDS_DB_NAME)
+        multi_input_accounts_conn = multi_input_accounts_database.create_connection(multi_input_accounts_database.ADDRESS_IDS_DB_NAME)
+        multi_input_accounts_database.create_tables(multi_input_accounts_conn, 'INTEGER')
+    else:
+        accounts_conn = accounts_database.create_connection()
+        multi_input_accounts_conn = multi_input_accounts_database.create_connection()
+        multi_input_accounts_database.create_tables(multi_input_accounts_conn)
 
-    accounts_conn = accounts_database.create_connection()
     accounts = {key: int(value) for key, value in accounts_database.retrieve_all_accounts(accounts_conn)}
 
-    multi_input_accounts_conn = multi_input_accounts_database.create_connection()
-    multi_input_accounts_database.create_tables(multi_input_accounts_conn)
-
     user_index = 0
 
-    def read_files(files, thread_number, dir_sorted_blocks):
-        nonlocal file_queue
-        nonlocal lock
-
-        with tqdm(total=len(files) // num_readers, desc=f'Reader Thread {thread_number}') as reading_pbar:
-            for i in range(thread_number, len(files), num_readers):
-                height = extract_height_from_name(files[i])
-                path_file = os.path.join(dir_sorted_blocks, files[i])
-
-                block = get_block(path_file)
-
-                # wait until the previous block is inserted in the queue
-                while height - 1 != lock:
-                    time.sleep(0.1)
-
-                file_queue.put((height, block))
-                
-                lock = height
-
-                reading_pbar.update(1)
-
     class UnionFind:
         def __init__(self):
             self.parent = {}
@@ -141,9 +125,10 @@ def multi_input_address_clustering(dir_sorted_blocks):
         
         return addresses, multi_input_accounts
 
-    with ThreadPoolExecutor(max_workers=num_readers) as readers, ThreadPoolExecutor(max_workers=1) as processors:
+    with ThreadPoolExecutor(max_workers=1) as readers, ThreadPoolExecutor(max_workers=1) as processors:
 
-        futures_readers = [readers.submit(read_files, files, i, dir_sorted_blocks) for i in range(num_readers)]
+        # a single producer puts the blocks in the queue, already in height order
+        futures_readers = [readers.submit(block_reader.feed, file_queue)]
 
         futures_processors = [processors.submit(process_blocks, accounts)]
 
@@ -0,0 +1,108 @@
+import os
+import time
+import numpy as np
+from tqdm import tqdm
+from database.accounts_database import create_connection, add_to_balances, count_negative_accounts, DB_NAME, ADDRESS_IDS_DB_NAME
+from redistribution_space.utils import get_block, list_block_files, extract_height_from_name, blocks_use_address_ids
+from storage.columnar_blocks import ColumnarBlock
+from utils.batch_address_encoding import SCRIPT_CLASSES, receivers_from_scripts
+from utxo_hub.address_extraction import NOT_ACCOUNTS
+
+def _sum_by_key(keys, amounts):
+    # amounts of the same key are summed with a single sort, negative keys (INVALID_ADDRESS and UNKNOWN_ADDRESS) are skipped
+    valid = keys >= 0
+    keys, amounts = keys[valid], amounts[valid]
+    if len(keys) == 0:
+        return keys, amounts
+
+    order = np.argsort(keys, kind='stable')
+    keys, amounts = keys[order], amounts[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    return keys[starts], np.add.reduceat(amounts, starts)
+
+def columnar_block_deltas(columns):
+    # created outputs are subtracted and spent outputs added back
+    if 'script_class' in columns:
+        # output keys refer to the script table of the block, whose receivers are encoded in a single batch
+        input_keys, input_sums = _sum_by_key(columns['input_address'], columns['input_value'])
+        output_keys, output_sums = _sum_by_key(columns['output_address'], -columns['output_value'])
+
+        offsets = columns['script_offsets'].tolist()
+        payload = columns['script_payload'].tobytes()
+        script_classes = [SCRIPT_CLASSES[script_class] for script_class in columns['script_class'][output_keys].tolist()]
+        receivers = receivers_from_scripts(script_classes, [payload[offsets[key]:offsets[key + 1]] for key in output_keys.tolist()])
+
+        deltas = dict(zip(columns['addresses'][input_keys].tolist(), input_sums.tolist()))
+        for receiver, amount in zip(receivers, output_sums.tolist()):
+            if receiver not in NOT_ACCOUNTS:
+                deltas[receiver] = deltas.get(receiver, 0) + amount
+        return deltas
+
+    keys, sums = _sum_by_key(np.concatenate((columns['output_address'], columns['input_address'])),
+                             np.concatenate((-columns['output_value'], columns['input_value'])))
+    if 'addresses' in columns:
+        # keys are positions in the address table of the block
+        keys = columns['addresses'][keys]
+
+    return dict(zip(keys.tolist(), sums.tolist()))
+
+def block_deltas(block):
+    """Returns the amounts (address: amount) to be added to the balances to undo the block."""
+    if isinstance(block, ColumnarBlock):
+        return columnar_block_deltas(block.columns)
+
+    deltas = {}
+    for transaction in block['Transactions']:
+        for output in transaction['Outputs']:
+            if output['Receiver'] not in NOT_ACCOUNTS:
+                deltas[output['Receiver']] = deltas.get(output['Receiver'], 0) - output['Value']
+        for input in transaction['Inputs']:
+            if input['Sender'] not in NOT_ACCOUNTS:
+                deltas[input['Sender']] = deltas.get(input['Sender'], 0) + input['Value']
+
+    return deltas
+
+def utxo_rewind(dir_sorted_blocks, rewind_height, tip_hash=None):
+    """
+    Brings the accounts table, holding the balances at the tip of the node (see chainstate_extraction), back to the balances after block rewind_height.
+    The blocks from rewind_height + 1 up to the tip must have been extracted in dir_sorted_blocks (see data_main.py): they are undone from the last one,
+    removing the outputs they created and restoring the ones they spent.
+    If tip_hash is given, the last block must be the one the balances refer to.
+    """
+    files = [file for file in list_block_files(dir_sorted_blocks) if extract_height_from_name(file) > rewind_height]
+    if len(files) == 0:
+        print(f'No blocks after {rewind_height} in {dir_sorted_blocks}')
+        return
+    if extract_height_from_name(files[0]) != rewind_height + 1 or extract_height_from_name(files[-1]) - rewind_height != len(files):
+        raise ValueError(f'The blocks from {rewind_height + 1} to {extract_height_from_name(files[-1])} are not all in {dir_sorted_blocks}')
+
+    # address: amount to be added to its balance
+    deltas = {}
+    # hash of the block following the one being undone
+    next_previous_hash = tip_hash
+    start_time = time.time()
+
+    for file in tqdm(reversed(files), total=len(files), desc='Undoing blocks'):
+        block = get_block(os.path.join(dir_sorted_blocks, file))
+
+        # the blocks must form a chain ending at the tip of the balances
+        if next_previous_hash is not None and block['Block Hash'] != next_previous_hash:
+            raise ValueError(f'Block {extract_height_from_name(file)} is {block["Block Hash"]}, {next_previous_hash} was expected')
+        next_previous_hash = block['Previous Block Hash']
+
+        for address, amount in block_deltas(block).items():
+            deltas[address] = deltas.get(address, 0) + amount
+
+    deltas = {address: amount for address, amount in deltas.items() if amount != 0}
+
+    # blocks referencing addresses by id (see storage/address_table.py) are undone on the accounts keyed by id
+    conn = create_connection(ADDRESS_IDS_DB_NAME if blocks_use_address_ids(dir_sorted_blocks, files) else DB_NAME)
+    add_to_balances(conn, deltas)
+    negative_accounts = count_negative_accounts(conn)
+    conn.close()
+
+    end_time = time.time()
+    print(f'Undone blocks: {len(files)}, updated accounts: {len(deltas)}')
+    if negative_accounts > 0:
+        print(f'Accounts with a negative balance: {negative_accounts}')
+    print(f'Time elapsed (in seconds): {end_time - start_time}')
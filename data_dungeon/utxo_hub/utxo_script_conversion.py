@@ -2,6 +2,7 @@ import pandas as pd
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 from utils.parse_transaction_output import parse_transaction_output
+from utils.batch_address_encoding import classify_output_script, encode_addresses
 
 def _process_row(row):
     script = row['script']
@@ -15,7 +16,22 @@ def _process_chunk(chunk):
     criterion = chunk['address'].map(lambda x: not str(x).startswith('bc1') and not str(x).startswith('1') and not str(x).startswith('3'))
     selected_rows = chunk[criterion]
 
-    chunk.loc[selected_rows.index] = selected_rows.apply(_process_row, axis=1)
+    # standard scripts of the whole chunk are encoded in a single batch, the others are converted row by row
+    standard_index, script_types, payloads = [], [], []
+    other_index = []
+    for index, script in zip(selected_rows.index, selected_rows['script']):
+        script_type, payload = classify_output_script(bytes.fromhex(script))
+        if script_type is None:
+            other_index.append(index)
+        else:
+            standard_index.append(index)
+            script_types.append(script_type)
+            payloads.append(payload)
+
+    if standard_index:
+        chunk.loc[standard_index, 'address'] = encode_addresses(payloads, script_types)
+    if other_index:
+        chunk.loc[other_index] = chunk.loc[other_index].apply(_process_row, axis=1)
 
     return chunk
     